@@ -0,0 +1,21 @@
+"""
+Scanning admin
+"""
+from django.contrib import admin
+from .models import RescanSweep, ScanVerdict
+
+
+@admin.register(ScanVerdict)
+class ScanVerdictAdmin(admin.ModelAdmin):
+    list_display = ['file_hash', 'engine_version', 'scanned_at']
+    list_filter = ['engine_version']
+    search_fields = ['file_hash']
+    readonly_fields = ['file_hash', 'engine_version', 'scan_result', 'scanned_at']
+
+
+@admin.register(RescanSweep)
+class RescanSweepAdmin(admin.ModelAdmin):
+    list_display = ['engine_version', 'scanned', 'infected', 'started_at', 'finished_at']
+    readonly_fields = [
+        'engine_version', 'cursor_downloads', 'cursor_id', 'scanned', 'infected', 'started_at', 'finished_at'
+    ]
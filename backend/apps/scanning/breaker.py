@@ -0,0 +1,71 @@
+"""
+Circuit breaker for clamd outages
+
+Without it, every pending scan_file_task burns through its retries on its
+own while clamd is down, and files are deleted once retries run out. The
+breaker state lives in the cache (Redis), shared by all workers:
+
+- closed: scans run normally; CLAMD_BREAKER_THRESHOLD scan failures within
+  CLAMD_BREAKER_WINDOW seconds open the breaker
+- open: scans are parked (left pending, retries untouched) without
+  contacting clamd; clamd_probe_task pings clamd every
+  CLAMD_BREAKER_PROBE_INTERVAL seconds and starts recovery once it answers
+- recovering: new scans run again, and each probe releases the parked
+  backlog CLAMD_BREAKER_RELEASE_BATCH schematics at a time until nothing
+  is pending, then the breaker closes
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+RECOVERING = 'recovering'
+
+STATE_KEY = 'scanning:clamd_breaker:state'
+FAILURES_KEY = 'scanning:clamd_breaker:failures'
+
+
+def state():
+    return cache.get(STATE_KEY) or CLOSED
+
+
+def is_open():
+    """Whether scans should be parked instead of sent to clamd"""
+    return state() == OPEN
+
+
+def record_failure():
+    """Count a failed clamd exchange; returns True if this opened the breaker"""
+    cache.add(FAILURES_KEY, 0, timeout=settings.CLAMD_BREAKER_WINDOW)
+    try:
+        failures = cache.incr(FAILURES_KEY)
+    except ValueError:
+        # Window expired between add and incr
+        cache.set(FAILURES_KEY, 1, timeout=settings.CLAMD_BREAKER_WINDOW)
+        failures = 1
+    if failures >= settings.CLAMD_BREAKER_THRESHOLD and state() != OPEN:
+        cache.set(STATE_KEY, OPEN, timeout=None)
+        logger.error(f"clamd failed {failures} times within {settings.CLAMD_BREAKER_WINDOW}s, parking scans")
+        return True
+    return False
+
+
+def record_success():
+    """A clamd exchange worked, so earlier failures no longer count"""
+    cache.delete(FAILURES_KEY)
+
+
+def recover():
+    """clamd answers again: let new scans through and release the parked backlog"""
+    cache.set(STATE_KEY, RECOVERING, timeout=None)
+    cache.delete(FAILURES_KEY)
+    logger.info("clamd is reachable again, releasing parked scans")
+
+
+def close():
+    cache.set(STATE_KEY, CLOSED, timeout=None)
+    logger.info("Parked scan backlog released, clamd breaker closed")
@@ -0,0 +1,145 @@
+"""
+Local fake clamd for tests and benchmarks
+
+Speaks the parts of the clamd protocol the scanners use (IDSESSION/END,
+PING, VERSION, SCAN and INSTREAM, null-terminated commands) on a local TCP
+port, with no signatures to load. Verdicts are decided by content: streams
+containing b'EICAR' are always infected, and a further `infection_rate` of
+streams is reported infected, chosen by content hash so the same bytes
+always get the same verdict. Every reply waits `delay` seconds plus up to
+`jitter` random seconds, to stand in for clamd's scan time.
+
+Run one from the shell with `python manage.py fake_clamd`.
+"""
+import hashlib
+import random
+import socketserver
+import struct
+import threading
+import time
+
+VERSION = 'ClamAV 1.2.1/27112/Mon Oct 12 08:21:54 2026'
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    # Like clamd's MaxConnectionQueueLength; the default of 5 drops concurrent connects
+    request_queue_size = 200
+
+
+class FakeClamd:
+    """
+    Threaded fake clamd server, started on construction
+
+    With close_after_reply the server drops each session after one reply,
+    like clamd does after its IdleTimeout. port=0 picks a free port.
+    """
+
+    def __init__(self, close_after_reply=False, delay=0, jitter=0, infection_rate=0.0,
+                 host='127.0.0.1', port=0):
+        fake = self
+        self.version = VERSION
+        self.close_after_reply = close_after_reply
+        self.delay = delay
+        self.jitter = jitter
+        self.infection_rate = infection_rate
+        self.connections = 0
+        self.scans = 0
+        self.infected = 0
+        self.commands = []
+        self._lock = threading.Lock()
+
+        class Handler(socketserver.BaseRequestHandler):
+            def read_command(self, buffer):
+                while b'\0' not in buffer:
+                    data = self.request.recv(4096)
+                    if not data:
+                        return None, buffer
+                    buffer += data
+                command, _, buffer = buffer.partition(b'\0')
+                return command.decode(), buffer
+
+            def read_exact(self, buffer, size):
+                while len(buffer) < size:
+                    data = self.request.recv(65536)
+                    if not data:
+                        raise ConnectionError('Client closed the stream')
+                    buffer += data
+                return buffer[:size], buffer[size:]
+
+            def read_stream(self, buffer):
+                content = hashlib.sha256()
+                eicar = False
+                tail = b''
+                while True:
+                    header, buffer = self.read_exact(buffer, 4)
+                    (size,) = struct.unpack('!L', header)
+                    if not size:
+                        return content, eicar, buffer
+                    chunk, buffer = self.read_exact(buffer, size)
+                    content.update(chunk)
+                    # Keep a few bytes so a marker split across chunks is still found
+                    eicar = eicar or b'EICAR' in tail + chunk
+                    tail = chunk[-4:]
+
+            def handle(self):
+                with fake._lock:
+                    fake.connections += 1
+                buffer = b''
+                request_id = 0
+                session = False
+                while True:
+                    command, buffer = self.read_command(buffer)
+                    if command in (None, 'zEND'):
+                        return
+                    with fake._lock:
+                        fake.commands.append(command)
+                    if command == 'zIDSESSION':
+                        session = True
+                        continue
+                    request_id += 1
+                    if command == 'zPING':
+                        reply = 'PONG'
+                    elif command == 'zVERSION':
+                        reply = fake.version
+                    elif command.startswith('zSCAN '):
+                        reply = f'{command[6:]}: OK'
+                    elif command == 'zINSTREAM':
+                        content, eicar, buffer = self.read_stream(buffer)
+                        infected = fake.is_infected(content.digest(), eicar)
+                        with fake._lock:
+                            fake.scans += 1
+                            fake.infected += infected
+                        reply = 'stream: Eicar-Test-Signature FOUND' if infected else 'stream: OK'
+                    else:
+                        reply = 'UNKNOWN COMMAND'
+                    fake.wait()
+                    if not session:
+                        # Outside a session clamd answers once, without an id
+                        self.request.sendall(reply.encode() + b'\0')
+                        return
+                    self.request.sendall(f'{request_id}: {reply}'.encode() + b'\0')
+                    if fake.close_after_reply:
+                        return
+
+        self.server = _Server((host, port), Handler)
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def is_infected(self, digest, eicar=False):
+        """Verdict for content with this SHA-256 digest"""
+        if eicar:
+            return True
+        # The first 8 digest bytes as a fraction in [0, 1)
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64 < self.infection_rate
+
+    def wait(self):
+        latency = self.delay + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if latency:
+            time.sleep(latency)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
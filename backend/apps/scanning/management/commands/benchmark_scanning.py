@@ -0,0 +1,227 @@
+"""
+Load benchmark of the scanning pipeline against a fake (or real) clamd
+
+Creates --files pending schematics with unique random content, drains them
+with scan_file_task workers and/or the batch tasks, and reports throughput,
+queue wait (backlog created -> scan started) and latency (backlog created
+-> verdict written), with tail percentiles. Everything it creates is
+deleted afterwards. Follow-up metadata processing is not queued.
+
+Use PostgreSQL: concurrent workers on SQLite mostly measure lock waits.
+The rows and files go to the configured database and storage, so the
+command refuses to run unless DEBUG is on or --allow-live is given: an
+interrupted run leaves its backlog behind.
+
+Usage:
+    python manage.py benchmark_scanning --files 5000 --mode file --mode batch --mode async
+    python manage.py benchmark_scanning --clamd clamav:3310 --workers 4 --allow-live
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from celery.exceptions import Retry
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from apps.scanning import tasks
+from apps.scanning.fakeclamd import FakeClamd
+from apps.scanning.models import ScanVerdict
+from apps.schematics.models import Schematic
+from apps.storage.models import FileBlob
+from apps.storage.promotion import save_to_quarantine
+
+MODES = ('file', 'batch', 'async')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark scan_file_task and the batch scan tasks at thousands of files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=1000, help='Pending schematics per mode')
+        parser.add_argument('--size', type=int, default=16 * 1024, help='Bytes per file')
+        parser.add_argument('--mode', action='append', choices=MODES,
+                            help='file (scan_file_task), batch (scan_batch_task) or async '
+                                 '(scan_batch_async_task); repeat for several (default: all)')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent task executions, like worker processes')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Schematics claimed per batch task (default: the task\'s setting)')
+        parser.add_argument('--delay', type=float, default=0.005, help='Fake clamd seconds per reply')
+        parser.add_argument('--jitter', type=float, default=0, help='Fake clamd extra random seconds per reply')
+        parser.add_argument('--infection-rate', type=float, default=0.01,
+                            help='Share of files the fake clamd reports infected')
+        parser.add_argument('--clamd', default=None, metavar='HOST:PORT',
+                            help='Scan with this clamd instead of starting a fake one')
+        parser.add_argument('--allow-live', action='store_true',
+                            help='Run although DEBUG is off, writing to the configured database and storage')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['allow_live']:
+            raise CommandError(
+                'DEBUG is off, so this may be a live database and bucket. The benchmark creates '
+                'and deletes thousands of rows and files there; pass --allow-live to run it anyway.'
+            )
+        fake = None
+        if options['clamd']:
+            host, _, port = options['clamd'].rpartition(':')
+            port = int(port)
+        else:
+            fake = FakeClamd(delay=options['delay'], jitter=options['jitter'],
+                             infection_rate=options['infection_rate'])
+            host, port = fake.host, fake.port
+            self.stdout.write(
+                f'Fake clamd on {host}:{port}: {options["delay"] * 1000:.1f} ms '
+                f'(+{options["jitter"] * 1000:.1f} ms jitter) per reply, '
+                f'{options["infection_rate"]:.1%} infected'
+            )
+
+        try:
+            with override_settings(CLAMAV_HOST=host, CLAMAV_PORT=port), \
+                    patch('apps.schematics.tasks.process_schematic_task'):
+                for mode in options['mode'] or MODES:
+                    self._benchmark(mode, options)
+        finally:
+            if fake:
+                fake.stop()
+
+    def _benchmark(self, mode, options):
+        run = uuid.uuid4().hex[:12]
+        user = get_user_model().objects.create_user(
+            username=f'scan-benchmark-{run}',
+            email=f'scan-benchmark-{run}@example.com',
+            password=uuid.uuid4().hex
+        )
+        try:
+            ids = self._create_backlog(user, run, options['files'], options['size'])
+            started, finished = {}, {}
+            began = time.perf_counter()
+            if mode == 'file':
+                self._run_file_tasks(ids, options['workers'], started, finished)
+            else:
+                task = tasks.scan_batch_task if mode == 'batch' else tasks.scan_batch_async_task
+                self._run_batch_tasks(task, options['workers'], options['batch_size'], started, finished)
+            elapsed = time.perf_counter() - began
+            self._report(mode, user, elapsed, began, started, finished)
+        finally:
+            self._clean_up(user)
+
+    def _create_backlog(self, user, run, count, size):
+        schematics = []
+        for index in range(count):
+            data = f'{run}-{index}'.encode() + os.urandom(size)
+            schematics.append(Schematic(
+                owner=user,
+                title=f'Scan benchmark {index}',
+                file=save_to_quarantine(ContentFile(data, name=f'benchmark-{run}-{index}.schem')),
+                file_size=len(data),
+                file_hash=hashlib.sha256(data).hexdigest(),
+                scan_status='pending'
+            ))
+        Schematic.objects.bulk_create(schematics, batch_size=500)
+        return [str(schematic.id) for schematic in schematics]
+
+    def _run_file_tasks(self, ids, workers, started, finished):
+        """Each id is one queued scan_file_task; `workers` of them execute at a time"""
+
+        def run(schematic_id):
+            started[schematic_id] = time.perf_counter()
+            try:
+                tasks.scan_file_task(schematic_id)
+            except Retry:
+                pass
+            finished[schematic_id] = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, ids))
+
+    def _run_batch_tasks(self, task, workers, batch_size, started, finished):
+        """`workers` loops each running the batch task until nothing is left to claim"""
+        claim_pending, apply_batch_verdicts = tasks._claim_pending, tasks._apply_batch_verdicts
+
+        def timed_claim(size):
+            batch = claim_pending(size)
+            now = time.perf_counter()
+            for schematic in batch:
+                started[str(schematic.id)] = now
+            return batch
+
+        def timed_apply(batch, results):
+            summary = apply_batch_verdicts(batch, results)
+            now = time.perf_counter()
+            for schematic in batch:
+                finished[str(schematic.id)] = now
+            return summary
+
+        def drain():
+            while task(batch_size)['claimed']:
+                pass
+
+        # The loops above stand in for the tasks re-queueing themselves
+        with patch.object(tasks, '_claim_pending', timed_claim), \
+                patch.object(tasks, '_apply_batch_verdicts', timed_apply), \
+                patch.object(task, 'delay'):
+            threads = [threading.Thread(target=drain) for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def _report(self, mode, user, elapsed, began, started, finished):
+        statuses = {}
+        for scan_status in Schematic.objects.filter(owner=user).values_list('scan_status', flat=True):
+            statuses[scan_status] = statuses.get(scan_status, 0) + 1
+        done = len(finished)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{mode}'))
+        self.stdout.write(
+            f'{done} scans in {elapsed:.2f} s: {done / elapsed:.1f} files/s  '
+            + ', '.join(f'{count} {scan_status}' for scan_status, count in sorted(statuses.items()))
+        )
+        if not done:
+            return
+        for label, values in (
+            ('queue wait', [started[key] - began for key in started]),
+            ('latency', [finished[key] - began for key in finished]),
+            ('service', [finished[key] - started[key] for key in finished if key in started]),
+        ):
+            self.stdout.write(
+                f'{label:10}  p50 {percentile(values, 0.5) * 1000:9.1f} ms  '
+                f'p95 {percentile(values, 0.95) * 1000:9.1f} ms  '
+                f'p99 {percentile(values, 0.99) * 1000:9.1f} ms  '
+                f'max {max(values) * 1000:9.1f} ms'
+            )
+
+    def _clean_up(self, user):
+        from apps.scanning.scanner import VirusScanner
+        from apps.scanning.verdicts import _key
+
+        schematics = list(Schematic.objects.filter(owner=user))
+        hashes = [schematic.file_hash for schematic in schematics]
+        blobs = list(FileBlob.objects.filter(file_hash__in=hashes))
+        names = {schematic.file.name for schematic in schematics if schematic.file}
+        names.update(blob.file.name for blob in blobs)
+
+        user.delete()
+        FileBlob.objects.filter(id__in=[blob.id for blob in blobs]).delete()
+        for name in names:
+            Schematic.file.field.storage.delete(name)
+
+        engine_version = VirusScanner().engine_version()
+        ScanVerdict.objects.filter(file_hash__in=hashes).delete()
+        if engine_version:
+            cache.delete_many([_key(file_hash, engine_version) for file_hash in hashes])
@@ -0,0 +1,22 @@
+"""
+Show clamd session pool counters
+
+Usage:
+    python manage.py clamd_pool_stats
+"""
+from django.core.management.base import BaseCommand
+
+from apps.scanning.sessions import STATS_FLUSH_INTERVAL, cluster_stats
+
+
+class Command(BaseCommand):
+    help = 'Show opened/reused/failed clamd connection counts summed over all scan workers'
+
+    def handle(self, *args, **options):
+        stats = cluster_stats()
+        total = stats['opened'] + stats['reused']
+        for name, value in stats.items():
+            self.stdout.write(f'{name:>8}: {value}')
+        if total:
+            self.stdout.write(f'   reuse: {stats["reused"] / total:.1%} of sessions handed out')
+        self.stdout.write(f'Workers publish their counters every {STATS_FLUSH_INTERVAL}s')
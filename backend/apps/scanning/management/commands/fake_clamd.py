@@ -0,0 +1,43 @@
+"""
+Run a local fake clamd
+
+Usage:
+    python manage.py fake_clamd [--port 3310] [--delay 0.02] [--jitter 0.01] [--infection-rate 0.01]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.scanning.fakeclamd import FakeClamd
+
+
+class Command(BaseCommand):
+    help = 'Serve a fake clamd (PING, VERSION, INSTREAM, IDSESSION) for local development and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=3310)
+        parser.add_argument('--delay', type=float, default=0, help='Seconds before each reply')
+        parser.add_argument('--jitter', type=float, default=0, help='Up to this many extra random seconds per reply')
+        parser.add_argument('--infection-rate', type=float, default=0,
+                            help='Share of streams reported infected (by content hash)')
+
+    def handle(self, *args, **options):
+        fake = FakeClamd(
+            delay=options['delay'],
+            jitter=options['jitter'],
+            infection_rate=options['infection_rate'],
+            host=options['host'],
+            port=options['port'],
+        )
+        self.stdout.write(f'Fake clamd listening on {fake.host}:{fake.port} (Ctrl-C to stop)')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.stop()
+        self.stdout.write(
+            f'{fake.connections} connections, {fake.scans} scans, {fake.infected} reported infected'
+        )
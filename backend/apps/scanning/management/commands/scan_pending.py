@@ -0,0 +1,33 @@
+"""
+Queue batch scans of pending schematics
+
+Usage:
+    python manage.py scan_pending [--batch-size N] [--now] [--async]
+"""
+from django.core.management.base import BaseCommand
+
+from apps.scanning.tasks import scan_batch_async_task, scan_batch_task
+
+
+class Command(BaseCommand):
+    help = 'Drain pending virus scans with scan_batch_task'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Schematics claimed per batch (default: SCAN_BATCH_SIZE)')
+        parser.add_argument('--now', action='store_true',
+                            help='Scan one batch in this process instead of queueing')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Use scan_batch_async_task (one event loop, many scans in flight)')
+
+    def handle(self, *args, **options):
+        task = scan_batch_async_task if options['use_async'] else scan_batch_task
+        if options['now']:
+            result = task(options['batch_size'])
+            self.stdout.write(
+                f"Claimed {result['claimed']}: {result['clean']} clean, "
+                f"{result['infected']} infected, {result['error']} errors"
+            )
+        else:
+            task.delay(options['batch_size'])
+            self.stdout.write(f'Queued {task.name}; it re-queues itself until the backlog is drained')
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.26 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64)),
+                ('engine_version', models.CharField(max_length=64)),
+                ('scan_result', models.JSONField()),
+                ('scanned_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='scanverdict',
+            constraint=models.UniqueConstraint(fields=('file_hash', 'engine_version'), name='unique_verdict_per_version'),
+        ),
+    ]
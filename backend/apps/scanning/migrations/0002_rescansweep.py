@@ -0,0 +1,29 @@
+# Generated by Django 4.2.26 on 2026-10-16 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scanning', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RescanSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('engine_version', models.CharField(max_length=64, unique=True)),
+                ('cursor_downloads', models.IntegerField(blank=True, null=True)),
+                ('cursor_id', models.UUIDField(blank=True, null=True)),
+                ('scanned', models.IntegerField(default=0)),
+                ('infected', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
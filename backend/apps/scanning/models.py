@@ -0,0 +1,49 @@
+"""
+Scanning models
+"""
+from django.db import models
+
+
+class ScanVerdict(models.Model):
+    """
+    Remembered ClamAV verdict for some content
+
+    Keyed by SHA-256 plus the engine and signature version that produced
+    the verdict, so a signature update makes every entry a miss.
+    """
+    file_hash = models.CharField(max_length=64)  # SHA-256 hash
+    engine_version = models.CharField(max_length=64)  # e.g. "ClamAV 1.2.1/27112"
+    scan_result = models.JSONField()
+    scanned_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file_hash', 'engine_version'], name='unique_verdict_per_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_hash[:12]} @ {self.engine_version}: {self.scan_result.get('status')}"
+
+
+class RescanSweep(models.Model):
+    """
+    Progress of rescanning clean schematics with one signature version
+
+    The sweep walks clean schematics by download count (most downloaded
+    first) and keeps its position as a keyset cursor, so it resumes where
+    it stopped after a worker restart.
+    """
+    engine_version = models.CharField(max_length=64, unique=True)
+    cursor_downloads = models.IntegerField(null=True, blank=True)
+    cursor_id = models.UUIDField(null=True, blank=True)
+    scanned = models.IntegerField(default=0)
+    infected = models.IntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        state = 'finished' if self.finished_at else 'running'
+        return f"Rescan with {self.engine_version}: {self.scanned} scanned, {state}"
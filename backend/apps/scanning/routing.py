@@ -0,0 +1,36 @@
+"""
+Scan queue routing
+
+Scans are split over two Celery queues, each served by its own workers
+and concurrency, so a few large files cannot hold up many small ones:
+
+- SCAN_FAST_QUEUE: files up to SCAN_FAST_MAX_SIZE from trusted uploaders
+  (no infected uploads and at least SCAN_TRUSTED_MIN_CLEAN_UPLOADS clean ones)
+- SCAN_BULK_QUEUE: everything else, plus the batch and rescan tasks
+"""
+from django.apps import apps
+from django.conf import settings
+
+
+def is_trusted_uploader(user):
+    """Whether the user's upload history earns the fast lane"""
+    if user.infected_upload_count:
+        return False
+    if not settings.SCAN_TRUSTED_MIN_CLEAN_UPLOADS:
+        return True
+    Schematic = apps.get_model('schematics', 'Schematic')
+    clean = Schematic.objects.filter(owner=user, scan_status='clean')[:settings.SCAN_TRUSTED_MIN_CLEAN_UPLOADS]
+    return clean.count() >= settings.SCAN_TRUSTED_MIN_CLEAN_UPLOADS
+
+
+def scan_queue(schematic):
+    """Name of the queue a schematic's scan should go to"""
+    if schematic.file_size <= settings.SCAN_FAST_MAX_SIZE and is_trusted_uploader(schematic.owner):
+        return settings.SCAN_FAST_QUEUE
+    return settings.SCAN_BULK_QUEUE
+
+
+def queue_scan(schematic):
+    """Queue scan_file_task for a schematic on its queue"""
+    from .tasks import scan_file_task
+    return scan_file_task.apply_async(args=[str(schematic.id)], queue=scan_queue(schematic))
@@ -1,22 +1,92 @@
 """
 Virus scanning service
 """
+import io
 import logging
+import queue
+import re
+import threading
+import time
 from django.conf import settings
 
+from .sessions import ClamdSessionError, get_session_pool
+
 logger = logging.getLogger(__name__)
 
+SCAN_REPLY = re.compile(r'^(?P<path>.*): ((?P<virus>.+) )?(?P<status>FOUND|OK|ERROR)$')
+
+# Chunks buffered between the reader and the clamd connection
+QUEUE_CHUNKS = 16
+
+# (host, port) -> (engine version, monotonic time it was fetched)
+_engine_versions = {}
+
+
+def parse_verdict(reply):
+    """Turn a clamd scan reply into a result dict"""
+    match = SCAN_REPLY.match(reply)
+    if not match or match.group('status') == 'ERROR':
+        raise ClamdSessionError(reply)
+    if match.group('status') == 'FOUND':
+        return {
+            'is_infected': True,
+            'virus_name': match.group('virus'),
+            'status': 'infected'
+        }
+    return {
+        'is_infected': False,
+        'virus_name': None,
+        'status': 'clean'
+    }
+
 
 class VirusScanner:
     """
     Wrapper for ClamAV virus scanner
     ClamAV is always required for security. Files are queued if ClamAV is unavailable.
+    Commands run on pooled persistent clamd sessions (see sessions.py).
     """
 
     def __init__(self):
         self.host = settings.CLAMAV_HOST
         self.port = settings.CLAMAV_PORT
 
+    @property
+    def pool(self):
+        return get_session_pool(self.host, self.port)
+
+    def pool_stats(self):
+        """Open/reused/failed connection counts of this process's session pool"""
+        return self.pool.stats()
+
+    def engine_version(self):
+        """
+        Engine and signature version of clamd, e.g. "ClamAV 1.2.1/27112"
+
+        Asked with VERSION at most every CLAMAV_VERSION_TTL seconds per
+        process. Returns None if clamd cannot be reached.
+        """
+        cached = _engine_versions.get((self.host, self.port))
+        if cached and time.monotonic() - cached[1] < settings.CLAMAV_VERSION_TTL:
+            return cached[0]
+        try:
+            reply = self.pool.execute('VERSION')
+        except Exception as e:
+            logger.warning(f"Could not get clamd version: {str(e)}")
+            return None
+        # Drop the signature date: "ClamAV 1.2.1/27112/Mon Oct 12 08:21:54 2026"
+        version = '/'.join(reply.strip().split('/')[:2])
+        _engine_versions[(self.host, self.port)] = (version, time.monotonic())
+        return version
+
+    def ping(self):
+        """Whether clamd answers PING"""
+        try:
+            return self.pool.execute('PING').strip() == 'PONG'
+        except Exception as e:
+            logger.warning(f"clamd did not answer PING: {str(e)}")
+            return False
+
     def scan_file(self, file_path):
         """
         Scan a file for viruses
@@ -29,33 +99,13 @@ class VirusScanner:
             }
         """
         try:
-            import clamd
-            cd = clamd.ClamdNetworkSocket(self.host, self.port)
-
-            # Check if ClamAV is available
-            cd.ping()
-
-            # Scan the file
-            result = cd.scan(file_path)
-
-            if result:
-                file_result = result.get(file_path)
-                if file_result:
-                    status, virus_name = file_result
-                    if status == 'FOUND':
-                        logger.warning(f"Virus found in {file_path}: {virus_name}")
-                        return {
-                            'is_infected': True,
-                            'virus_name': virus_name,
-                            'status': 'infected'
-                        }
-
-            logger.info(f"File {file_path} is clean")
-            return {
-                'is_infected': False,
-                'virus_name': None,
-                'status': 'clean'
-            }
+            result = parse_verdict(self.pool.execute(f'SCAN {file_path}'))
+
+            if result['is_infected']:
+                logger.warning(f"Virus found in {file_path}: {result['virus_name']}")
+            else:
+                logger.info(f"File {file_path} is clean")
+            return result
 
         except Exception as e:
             logger.error(f"Error scanning file {file_path}: {str(e)}")
@@ -69,35 +119,79 @@ class VirusScanner:
 
     def scan_stream(self, file_stream):
         """
-        Scan a file stream for viruses
+        Scan a file stream (or bytes) for viruses
         """
         try:
-            import clamd
-            cd = clamd.ClamdNetworkSocket(self.host, self.port)
-            cd.ping()
+            if isinstance(file_stream, (bytes, bytearray)):
+                file_stream = io.BytesIO(file_stream)
 
-            result = cd.instream(file_stream)
-
-            if result and result.get('stream'):
-                status, virus_name = result['stream']
-                if status == 'FOUND':
-                    return {
-                        'is_infected': True,
-                        'virus_name': virus_name,
-                        'status': 'infected'
-                    }
+            return parse_verdict(self.pool.execute('INSTREAM', stream=file_stream))
 
+        except Exception as e:
+            logger.error(f"Error scanning stream: {str(e)}")
             return {
                 'is_infected': False,
                 'virus_name': None,
-                'status': 'clean'
+                'status': 'error',
+                'error': str(e)
             }
 
-        except Exception as e:
-            logger.error(f"Error scanning stream: {str(e)}")
+
+class ConcurrentStreamScan:
+    """
+    INSTREAM scan fed chunk by chunk while the caller still reads the data,
+    e.g. to hash an upload
+
+    The clamd exchange runs on a background thread that reads this object
+    as its stream; feed() only blocks while QUEUE_CHUNKS chunks are waiting.
+    finish() returns the usual result dict, with status 'error' if clamd
+    failed or did not answer within `timeout` seconds.
+    """
+
+    def __init__(self, scanner, timeout=None):
+        self.timeout = timeout
+        self.result = None
+        self._chunks = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self._pending = b''
+        self._ended = False
+        self._thread = threading.Thread(target=self._run, args=(scanner,), daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk):
+        if chunk:
+            self._chunks.put(bytes(chunk))
+
+    def finish(self):
+        self._chunks.put(None)
+        self._thread.join(self.timeout)
+        if self._thread.is_alive() or self.result is None:
+            logger.error("Concurrent stream scan did not finish in time")
             return {
                 'is_infected': False,
                 'virus_name': None,
                 'status': 'error',
-                'error': str(e)
+                'error': 'Scan timed out'
             }
+        return self.result
+
+    def read(self, size=-1):
+        """Stream side, called from the scanning thread"""
+        while not self._pending and not self._ended:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._ended = True
+            else:
+                self._pending = chunk
+        if size is None or size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _run(self, scanner):
+        try:
+            self.result = scanner.scan_stream(self)
+        finally:
+            # After a failed scan keep draining so feed() never blocks
+            while not self._ended:
+                if self._chunks.get() is None:
+                    self._ended = True
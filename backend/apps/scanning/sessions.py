@@ -0,0 +1,243 @@
+"""
+Persistent clamd sessions
+
+In IDSESSION mode clamd keeps one TCP connection open for many commands.
+Each command is prefixed with 'z' and NUL-terminated, and each reply reads
+"<request id>: <reply>". ClamdSessionPool keeps idle sessions per worker
+process, so a scan costs one round trip instead of connect + PING + command.
+
+Sessions are not pinged before use. A reused session that turns out to be
+dead (clamd drops idle sessions after its IdleTimeout) fails on its first
+command, which is then retried once on a fresh connection. Sessions idle
+longer than CLAMAV_SESSION_IDLE_TIMEOUT are closed instead of reused.
+
+Pool counters are kept per process and periodically added to cache-wide
+totals, read by cluster_stats() and the clamd_pool_stats command.
+"""
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STAT_NAMES = ('opened', 'reused', 'failed')
+STATS_KEY = 'scanning:clamd_pool:{}'
+STATS_FLUSH_INTERVAL = 30  # seconds
+
+
+class ClamdSessionError(Exception):
+    """Raised when clamd closes a session or replies out of protocol"""
+
+
+class ClamdSession:
+    """One clamd connection in IDSESSION mode"""
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.sendall(b'zIDSESSION\0')
+        self.request_id = 0
+        self.last_used = time.monotonic()
+        self._buffer = b''
+
+    def command(self, command, stream=None):
+        """
+        Run one command and return its reply text
+
+        With a stream, the command is followed by the stream's content in
+        INSTREAM chunks.
+        """
+        self.request_id += 1
+        self.sock.sendall(b'z' + command.encode('utf-8') + b'\0')
+        if stream is not None:
+            self._send_stream(stream)
+        reply = self._read_reply()
+        request_id, _, text = reply.partition(': ')
+        if request_id != str(self.request_id):
+            raise ClamdSessionError(f'Unexpected reply to request {self.request_id}: {reply}')
+        self.last_used = time.monotonic()
+        return text
+
+    def _send_stream(self, stream):
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+        self.sock.sendall(struct.pack('!L', 0))
+
+    def _read_reply(self):
+        while b'\0' not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ClamdSessionError('clamd closed the session')
+            self._buffer += data
+        reply, _, self._buffer = self._buffer.partition(b'\0')
+        return reply.decode('utf-8', errors='replace')
+
+    def close(self):
+        try:
+            self.sock.sendall(b'zEND\0')
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+
+
+class ClamdSessionPool:
+    """Idle clamd sessions of one worker process, reused most recent first"""
+
+    def __init__(self, host, port, size=4, idle_timeout=20, timeout=None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(STAT_NAMES, 0)
+        self._unflushed = dict.fromkeys(STAT_NAMES, 0)
+        self._flushed_at = time.monotonic()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+            self._unflushed[name] += 1
+
+    def _acquire(self):
+        """Return (session, reused)"""
+        now = time.monotonic()
+        stale = []
+        session = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.last_used < self.idle_timeout:
+                    session = candidate
+                    break
+                stale.append(candidate)
+        for expired in stale:
+            expired.close()
+        if session is not None:
+            self._count('reused')
+            return session, True
+
+        try:
+            session = ClamdSession(self.host, self.port, timeout=self.timeout)
+        except OSError:
+            self._count('failed')
+            raise
+        self._count('opened')
+        return session, False
+
+    def _release(self, session):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(session)
+                return
+        session.close()
+
+    def execute(self, command, stream=None):
+        """
+        Run a command on a pooled session and return the reply text
+
+        If a reused session turns out to be dead, the command is retried once
+        on a new connection; a stream is rewound for that if it is seekable.
+
+        Raises:
+            OSError, ClamdSessionError: if clamd cannot be reached or the
+                session breaks
+        """
+        seekable = stream is not None and getattr(stream, 'seekable', lambda: False)()
+        start = stream.tell() if seekable else None
+        retry = stream is None or seekable
+        try:
+            while True:
+                session, reused = self._acquire()
+                try:
+                    reply = session.command(command, stream)
+                except (OSError, ClamdSessionError):
+                    self._count('failed')
+                    session.sock.close()
+                    if not (reused and retry):
+                        raise
+                    retry = False
+                    if stream is not None:
+                        stream.seek(start)
+                    continue
+                self._release(session)
+                return reply
+        finally:
+            self._maybe_flush_stats()
+
+    def stats(self):
+        """Counters of this process plus the number of idle sessions"""
+        with self._lock:
+            return {**self.counts, 'idle': len(self._idle)}
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = list(self._idle), deque()
+        for session in sessions:
+            session.close()
+
+    def _maybe_flush_stats(self):
+        now = time.monotonic()
+        if now - self._flushed_at < STATS_FLUSH_INTERVAL:
+            return
+        with self._lock:
+            deltas, self._unflushed = self._unflushed, dict.fromkeys(STAT_NAMES, 0)
+            self._flushed_at = now
+        try:
+            for name, delta in deltas.items():
+                if delta:
+                    key = STATS_KEY.format(name)
+                    cache.add(key, 0, timeout=None)
+                    cache.incr(key, delta)
+        except Exception as e:
+            # Stats are best effort and must never fail a scan
+            logger.debug(f"Could not publish clamd pool stats: {e}")
+
+
+def cluster_stats():
+    """Pool counters summed over all worker processes, as last flushed"""
+    values = cache.get_many([STATS_KEY.format(name) for name in STAT_NAMES])
+    return {name: values.get(STATS_KEY.format(name), 0) for name in STAT_NAMES}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_session_pool(host, port):
+    """The session pool of this process for a clamd address"""
+    pool = _pools.get((host, port))
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get((host, port))
+            if pool is None:
+                pool = ClamdSessionPool(
+                    host, port,
+                    size=settings.CLAMAV_POOL_SIZE,
+                    idle_timeout=settings.CLAMAV_SESSION_IDLE_TIMEOUT,
+                    timeout=settings.CLAMAV_TIMEOUT,
+                )
+                _pools[(host, port)] = pool
+    return pool
+
+
+def _reset_after_fork():
+    # Forked children (Celery prefork) must not share the parent's sockets
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,137 @@
+"""
+Streaming reads of stored files for scanning
+
+clamd receives file content over INSTREAM, so scans need neither a shared
+filesystem nor a local copy of the file. S3 objects are read with ranged
+GETs of SCAN_RANGE_SIZE bytes, holding at most one range in memory (the
+regular S3 file object downloads the whole object into a temporary file
+first). Other storages are read through their own file objects.
+
+Files whose hash is not known yet (direct-to-S3 uploads) are hashed on the
+way to clamd with HashingReader.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+
+class RangedS3Reader(io.RawIOBase):
+    """Seekable read-only stream over an S3 object, fetched one byte range at a time"""
+
+    def __init__(self, s3_object, size, range_size):
+        self.s3_object = s3_object
+        self.size = size
+        self.range_size = range_size
+        self.position = 0
+        self.gets = 0
+        self._buffer = b''
+        self._buffer_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def _fetch(self):
+        end = min(self.position + self.range_size, self.size) - 1
+        response = self.s3_object.get(Range=f'bytes={self.position}-{end}')
+        self.gets += 1
+        self._buffer = response['Body'].read()
+        self._buffer_start = self.position
+
+    def read(self, size=-1):
+        if self.position >= self.size:
+            return b''
+        offset = self.position - self._buffer_start
+        if not 0 <= offset < len(self._buffer):
+            self._fetch()
+            offset = 0
+        if size is None or size < 0:
+            size = self.size - self.position
+        # Never more than what is left of the current range
+        data = self._buffer[offset:offset + size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class HashingReader(io.RawIOBase):
+    """SHA-256 of everything read through a stream, complete once it reached the end"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+        self.exhausted = False
+        self._sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.stream.seekable()
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Only rewinding to the start, as the session pool does on a retry
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('HashingReader can only rewind to the start')
+        self.stream.seek(0)
+        self.position = 0
+        self.exhausted = False
+        self._sha256 = hashlib.sha256()
+        return 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if data:
+            self._sha256.update(data)
+            self.position += len(data)
+        elif size != 0:
+            self.exhausted = True
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+def open_scan_stream(field_file):
+    """
+    Binary stream over a stored file, for VirusScanner.scan_stream()
+
+    The caller closes the stream.
+    """
+    storage = field_file.storage
+    if isinstance(storage, S3Boto3Storage):
+        s3_object = storage.bucket.Object(storage._normalize_name(clean_name(field_file.name)))
+        return RangedS3Reader(s3_object, s3_object.content_length, settings.SCAN_RANGE_SIZE)
+    return storage.open(field_file.name, 'rb')
@@ -1,23 +1,142 @@
 """
 Celery tasks for virus scanning
 """
+from concurrent.futures import ThreadPoolExecutor
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 from django.apps import apps
+from django.db import transaction
 from django.db.models import F
 import logging
 
+from . import breaker
+
 logger = logging.getLogger(__name__)
 
+RESCAN_LOCK_KEY = 'scanning:rescan_sweep:lock'
+RESCAN_LOCK_TIMEOUT = 30 * 60  # seconds
+
+
+def flag_infected_upload(user):
+    """Count an infected upload against the user's account"""
+    User = apps.get_model('users', 'User')
+    User.objects.filter(id=user.id).update(
+        infected_upload_count=F('infected_upload_count') + 1
+    )
+    user.refresh_from_db()
+    logger.warning(
+        f"Flagged user {user.username} for uploading infected file "
+        f"(total: {user.infected_upload_count})"
+    )
+
+
+def _record_scan_outcome(scan_result):
+    """Feed the clamd circuit breaker"""
+    if scan_result['status'] == 'error':
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def record_scan_result(file_hash, engine_version, scan_result):
+    """Feed a scan done outside the scan tasks (inline at upload) to the breaker and verdict cache"""
+    from .verdicts import store_verdict
+
+    _record_scan_outcome(scan_result)
+    store_verdict(file_hash, engine_version, scan_result)
+
+
+def _set_scanned_hash(schematic, reader, scan_result):
+    """Take the content hash of a direct upload from the bytes clamd read"""
+    from .streams import HashingReader
+
+    if isinstance(reader, HashingReader) and reader.exhausted and scan_result['status'] != 'error':
+        schematic.file_hash = reader.hexdigest()
+
+
+def _stream_scan(scanner, schematic):
+    from .streams import HashingReader, open_scan_stream
+
+    try:
+        # Streamed from whatever storage holds the file; clamd needs no access to it
+        with open_scan_stream(schematic.file) as stream:
+            reader = stream if schematic.file_hash else HashingReader(stream)
+            scan_result = scanner.scan_stream(reader)
+        # Only clamd's own answers count; storage errors raise below
+        _record_scan_outcome(scan_result)
+        _set_scanned_hash(schematic, reader, scan_result)
+        return scan_result
+    except Exception as e:
+        logger.error(f"Error scanning file {schematic.id}: {str(e)}")
+        return {
+            'is_infected': False,
+            'virus_name': None,
+            'status': 'error',
+            'error': str(e)
+        }
+
+
+def _scan_schematics(scanner, schematics, engine_version=None, concurrency=1):
+    """
+    Scan results for schematics' files, in order
+
+    Verdicts cached for the content and engine version are reused. Scans
+    run on up to `concurrency` threads; the cache (and thus the database)
+    is only used from the calling thread.
+    """
+    from .verdicts import cached_verdict, store_verdict
+
+    results = [cached_verdict(schematic.file_hash, engine_version) for schematic in schematics]
+    unscanned = [index for index, scan_result in enumerate(results) if scan_result is None]
+    for index in set(range(len(schematics))) - set(unscanned):
+        logger.info(f"Reusing {results[index]['status']} verdict for {schematics[index].id} ({engine_version})")
+
+    if len(unscanned) > 1 and concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            scanned = list(executor.map(lambda index: _stream_scan(scanner, schematics[index]), unscanned))
+    else:
+        scanned = [_stream_scan(scanner, schematics[index]) for index in unscanned]
+
+    for index, scan_result in zip(unscanned, scanned):
+        results[index] = scan_result
+        store_verdict(schematics[index].file_hash, engine_version, scan_result)
+    return results
+
+
+def after_clean_scan(schematic):
+    """Follow-up work once a schematic's file is known to be clean"""
+    # Server-side move to production storage; a file left in quarantine
+    # stays readable, so a failed move must not undo the verdict
+    from apps.storage.promotion import promote_file
+    try:
+        promote_file(schematic)
+    except Exception as e:
+        # Registered as a blob only once promoted, by the retrying task
+        logger.error(f"Error promoting file of {schematic.id} from quarantine: {str(e)}")
+        from apps.storage.tasks import promote_file_task
+        promote_file_task.apply_async(args=[str(schematic.id)], countdown=60)
+    else:
+        # Later uploads of the same content reuse this copy and verdict
+        from apps.storage.blobs import register_blob
+        register_blob(schematic)
+
+    # Chain metadata extraction now that the file is safe to parse
+    from apps.schematics.tasks import process_schematic_task
+    process_schematic_task.delay(str(schematic.id))
+
 
 @shared_task(bind=True, max_retries=5)
 def scan_file_task(self, schematic_id):
     """
     Asynchronous task to scan uploaded files for viruses
     Implements retry logic and automatic file deletion for infected/error files
+
+    While the clamd circuit breaker is open (see breaker.py) the schematic
+    is parked: left pending, without spending a retry, until
+    clamd_probe_task releases it.
     """
     Schematic = apps.get_model('schematics', 'Schematic')
-    User = apps.get_model('users', 'User')
 
     try:
         schematic = Schematic.objects.get(id=schematic_id)
@@ -38,17 +157,25 @@ def scan_file_task(self, schematic_id):
             schematic.save(update_fields=['scan_status', 'scan_result'])
             return {'status': 'error', 'reason': 'max_retries_exceeded'}
 
-        # Update status to scanning
+        if breaker.is_open():
+            logger.info(f"clamd is down, parking scan of {schematic_id}")
+            return {'status': 'parked', 'reason': 'clamd_unavailable'}
+
+        # Claim the row; scan_batch_task may already be scanning it
+        claimed = Schematic.objects.filter(
+            id=schematic_id, scan_status='pending'
+        ).update(scan_status='scanning')
+        if not claimed:
+            logger.info(f"Schematic {schematic_id} is {schematic.scan_status}, not scanning it again")
+            return {'status': schematic.scan_status, 'reason': 'not_pending'}
         schematic.scan_status = 'scanning'
-        schematic.save(update_fields=['scan_status'])
 
         # Perform scan
         from .scanner import VirusScanner
         scanner = VirusScanner()
 
-        # Get file path
-        file_path = schematic.file.path
-        scan_result = scanner.scan_file(file_path)
+        # Identical content already scanned with these signatures needs no scan
+        scan_result = _scan_schematics(scanner, [schematic], scanner.engine_version())[0]
 
         # Handle scan results
         if scan_result['is_infected']:
@@ -56,7 +183,7 @@ def scan_file_task(self, schematic_id):
             schematic.scan_status = 'infected'
             schematic.scan_result = scan_result
             schematic.scanned_at = timezone.now()
-            schematic.save(update_fields=['scan_status', 'scan_result', 'scanned_at'])
+            schematic.save(update_fields=['scan_status', 'scan_result', 'scanned_at', 'file_hash'])
 
             logger.warning(
                 f"Infected file detected: {schematic_id}, "
@@ -76,15 +203,7 @@ def scan_file_task(self, schematic_id):
 
             # Flag the user account (atomic update to prevent race conditions)
             try:
-                user = schematic.owner
-                User.objects.filter(id=user.id).update(
-                    infected_upload_count=F('infected_upload_count') + 1
-                )
-                user.refresh_from_db()
-                logger.warning(
-                    f"Flagged user {user.username} for uploading infected file "
-                    f"(total: {user.infected_upload_count})"
-                )
+                flag_infected_upload(schematic.owner)
             except Exception as flag_error:
                 logger.error(
                     f"Error flagging user for {schematic_id}: "
@@ -93,6 +212,14 @@ def scan_file_task(self, schematic_id):
 
             return scan_result
 
+        elif scan_result['status'] == 'error' and breaker.is_open():
+            # CLAMD IS DOWN: Park without spending a retry; clamd_probe_task releases it
+            schematic.scan_status = 'pending'
+            schematic.scan_result = scan_result
+            schematic.save(update_fields=['scan_status', 'scan_result'])
+            logger.warning(f"Scan error for {schematic_id} with clamd down, parking scan")
+            return {'status': 'parked', 'reason': 'clamd_unavailable'}
+
         elif scan_result['status'] == 'error':
             # ERROR DURING SCAN: Increment retry count and requeue
             schematic.scan_retry_count += 1
@@ -118,12 +245,13 @@ def scan_file_task(self, schematic_id):
             schematic.scan_status = 'clean'
             schematic.scan_result = scan_result
             schematic.scanned_at = timezone.now()
-            schematic.save(update_fields=['scan_status', 'scan_result', 'scanned_at'])
+            schematic.save(update_fields=['scan_status', 'scan_result', 'scanned_at', 'file_hash'])
 
-            # Note: File movement from quarantine to normal storage would be handled here
-            # if using separate storage backends for quarantine and production
             logger.info(f"File {schematic_id} marked as clean")
 
+            # Promotes the file out of quarantine
+            after_clean_scan(schematic)
+
         return scan_result
 
     except Schematic.DoesNotExist:
@@ -169,3 +297,330 @@ def scan_file_task(self, schematic_id):
                 f"{inner_exc.__class__.__name__}: {inner_exc}"
             )
         return None
+
+
+def _delete_schematic_file(schematic):
+    if schematic.file:
+        try:
+            schematic.file.delete(save=False)
+        except Exception as delete_error:
+            logger.error(f"Error deleting file for {schematic.id}: {delete_error}")
+
+
+def _claim_pending(batch_size):
+    """Lock up to `batch_size` pending schematics, skipping rows others hold, and mark them scanning"""
+    Schematic = apps.get_model('schematics', 'Schematic')
+    with transaction.atomic():
+        batch = list(
+            Schematic.objects.select_for_update(skip_locked=True)
+            .filter(scan_status='pending', scan_retry_count__lt=F('max_scan_retries'))
+            .order_by('created_at')[:batch_size]
+        )
+        Schematic.objects.filter(id__in=[schematic.id for schematic in batch]).update(scan_status='scanning')
+    return batch
+
+
+def _apply_batch_verdicts(batch, results):
+    """Write the scan results of a claimed batch back in one bulk_update and act on them"""
+    Schematic = apps.get_model('schematics', 'Schematic')
+    now = timezone.now()
+    # Also true when this batch's own failures just opened the breaker
+    clamd_down = breaker.is_open()
+    clean, infected, expired = [], [], []
+    for schematic, scan_result in zip(batch, results):
+        schematic.scan_result = scan_result
+        if scan_result['is_infected']:
+            schematic.scan_status = 'infected'
+            schematic.scanned_at = now
+            infected.append(schematic)
+        elif scan_result['status'] == 'error' and clamd_down:
+            # Parked without spending a retry, as in scan_file_task; clamd_probe_task releases it
+            schematic.scan_status = 'pending'
+        elif scan_result['status'] == 'error':
+            schematic.scan_retry_count += 1
+            if schematic.scan_retry_count >= schematic.max_scan_retries:
+                schematic.scan_status = 'error'
+                schematic.scan_result = {'error': 'Max scan retries exceeded, file deleted'}
+                expired.append(schematic)
+            else:
+                schematic.scan_status = 'pending'
+        else:
+            schematic.scan_status = 'clean'
+            schematic.scanned_at = now
+            clean.append(schematic)
+
+    Schematic.objects.bulk_update(
+        batch, ['scan_status', 'scan_result', 'scanned_at', 'scan_retry_count', 'file_hash']
+    )
+
+    for schematic in infected + expired:
+        _delete_schematic_file(schematic)
+    for schematic in infected:
+        logger.warning(f"Infected file detected: {schematic.id}, deleted file")
+        try:
+            flag_infected_upload(schematic.owner)
+        except Exception as flag_error:
+            logger.error(
+                f"Error flagging user for {schematic.id}: "
+                f"{flag_error.__class__.__name__}: {flag_error}"
+            )
+    for schematic in clean:
+        after_clean_scan(schematic)
+
+    errors = len(batch) - len(clean) - len(infected)
+    logger.info(
+        f"Scanned batch of {len(batch)}: {len(clean)} clean, "
+        f"{len(infected)} infected, {errors} errors"
+    )
+    return {'claimed': len(batch), 'clean': len(clean), 'infected': len(infected), 'error': errors}
+
+
+@shared_task
+def scan_batch_task(batch_size=None, drain=True):
+    """
+    Scan up to `batch_size` pending schematics in one go
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+    batches (and scan_file_task) never scan the same file twice. Files are
+    scanned concurrently over the clamd session pool (verdicts of content
+    already scanned with the current signatures are reused) and all are
+    written back with one bulk_update. Scan errors put a row back to pending
+    until its retries run out. While batches come back full and make
+    progress, the task queues itself again to drain the backlog (unless
+    `drain` is False). Nothing is claimed while the clamd breaker is open.
+    """
+    if breaker.is_open():
+        return {'claimed': 0, 'clean': 0, 'infected': 0, 'error': 0}
+
+    batch_size = batch_size or settings.SCAN_BATCH_SIZE
+    batch = _claim_pending(batch_size)
+    if not batch:
+        return {'claimed': 0, 'clean': 0, 'infected': 0, 'error': 0}
+
+    from .scanner import VirusScanner
+    scanner = VirusScanner()
+    engine_version = scanner.engine_version()
+    results = _scan_schematics(scanner, batch, engine_version, settings.SCAN_BATCH_CONCURRENCY)
+
+    summary = _apply_batch_verdicts(batch, results)
+    if drain and len(batch) == batch_size and summary['clean'] + summary['infected']:
+        scan_batch_task.delay(batch_size)
+    return summary
+
+
+@shared_task
+def scan_batch_async_task(batch_size=None):
+    """
+    Like scan_batch_task, but with all scans of the batch on one event loop
+
+    Suits large backlogs: up to CLAMAV_ASYNC_CONCURRENCY INSTREAM scans are
+    in flight at once from a single worker process.
+    """
+    import asyncio
+    from .aioscanner import AsyncVirusScanner
+    from .scanner import VirusScanner
+    from .streams import HashingReader, open_scan_stream
+    from .verdicts import cached_verdict, store_verdict
+
+    if breaker.is_open():
+        return {'claimed': 0, 'clean': 0, 'infected': 0, 'error': 0}
+
+    batch_size = batch_size or settings.SCAN_ASYNC_BATCH_SIZE
+    batch = _claim_pending(batch_size)
+    if not batch:
+        return {'claimed': 0, 'clean': 0, 'infected': 0, 'error': 0}
+
+    engine_version = VirusScanner().engine_version()
+    results = [cached_verdict(schematic.file_hash, engine_version) for schematic in batch]
+    unscanned = [index for index, scan_result in enumerate(results) if scan_result is None]
+    readers = {}
+
+    def open_stream(index):
+        stream = open_scan_stream(batch[index].file)
+        if not batch[index].file_hash:
+            stream = readers[index] = HashingReader(stream)
+        return stream
+
+    async def scan_unscanned():
+        # Created inside the running loop so its semaphore binds to it (needed before Python 3.10)
+        scanner = AsyncVirusScanner()
+        return await scanner.scan_many([lambda index=index: open_stream(index) for index in unscanned])
+
+    for index, scan_result in zip(unscanned, asyncio.run(scan_unscanned())):
+        _record_scan_outcome(scan_result)
+        _set_scanned_hash(batch[index], readers.get(index), scan_result)
+        results[index] = scan_result
+        store_verdict(batch[index].file_hash, engine_version, scan_result)
+
+    summary = _apply_batch_verdicts(batch, results)
+    if len(batch) == batch_size and summary['clean'] + summary['infected']:
+        scan_batch_async_task.delay(batch_size)
+    return summary
+
+
+def _rescan_infected(file_hash, scan_result, now):
+    """Mark every clean schematic with this content infected and delete the content"""
+    from apps.storage.blobs import discard_blob
+
+    Schematic = apps.get_model('schematics', 'Schematic')
+    with transaction.atomic():
+        schematics = list(
+            Schematic.objects.select_for_update().filter(file_hash=file_hash, scan_status='clean')
+        )
+        # Files of their own, not shared through the blob
+        own_files = {schematic.file.name: schematic for schematic in schematics if not schematic.blob_id}
+        discard_blob(file_hash)
+        Schematic.objects.filter(id__in=[schematic.id for schematic in schematics]).update(
+            scan_status='infected', scan_result=scan_result, scanned_at=now, blob=None
+        )
+    for schematic in own_files.values():
+        _delete_schematic_file(schematic)
+    logger.warning(
+        f"Rescan found {scan_result['virus_name']} in {file_hash}, "
+        f"marked {len(schematics)} schematics infected"
+    )
+    return len(schematics)
+
+
+@shared_task
+def rescan_sweep_task():
+    """
+    Rescan clean schematics once clamd has new signatures
+
+    Run periodically (CELERY_BEAT_SCHEDULE). Each run compares the clamd
+    engine/signature version with the current RescanSweep, starting a new
+    sweep when it changed, and rescans the next RESCAN_SWEEP_BATCH clean
+    schematics, most downloaded first. Runs are skipped while more than
+    RESCAN_MAX_PENDING uploads wait for their first scan, so the sweep
+    never starves fresh uploads. Each distinct content is scanned once;
+    if it is now infected, every schematic sharing it is handled. A failed
+    scan holds the cursor, and the sweep does not finish until it succeeds.
+    """
+    from django.core.cache import cache
+    from django.db.models import Q
+    from .models import RescanSweep
+    from .scanner import VirusScanner
+
+    Schematic = apps.get_model('schematics', 'Schematic')
+
+    pending = Schematic.objects.filter(scan_status='pending').count()
+    if pending > settings.RESCAN_MAX_PENDING:
+        logger.info(f"Skipping rescan sweep, {pending} uploads are waiting for a scan")
+        return {'status': 'skipped', 'reason': 'uploads_pending'}
+
+    scanner = VirusScanner()
+    engine_version = None if breaker.is_open() else scanner.engine_version()
+    if engine_version is None:
+        return {'status': 'skipped', 'reason': 'clamd_unavailable'}
+
+    # One run at a time; a crashed run's lock expires
+    if not cache.add(RESCAN_LOCK_KEY, 1, timeout=RESCAN_LOCK_TIMEOUT):
+        return {'status': 'skipped', 'reason': 'running'}
+    try:
+        sweep, created = RescanSweep.objects.get_or_create(engine_version=engine_version)
+        if created:
+            logger.info(f"Signatures changed to {engine_version}, starting rescan sweep")
+        if sweep.finished_at:
+            return {'status': 'finished', 'engine_version': engine_version}
+
+        queryset = Schematic.objects.filter(
+            Q(scanned_at__lt=sweep.started_at) | Q(scanned_at__isnull=True),
+            scan_status='clean'
+        ).order_by('-download_count', 'id')
+        if sweep.cursor_id is not None:
+            queryset = queryset.filter(
+                Q(download_count__lt=sweep.cursor_downloads)
+                | Q(download_count=sweep.cursor_downloads, id__gt=sweep.cursor_id)
+            )
+        batch = list(queryset[:settings.RESCAN_SWEEP_BATCH])
+
+        # One scan per distinct content
+        by_hash = {}
+        for schematic in batch:
+            by_hash.setdefault(schematic.file_hash, schematic)
+        representatives = list(by_hash.values())
+        results = _scan_schematics(scanner, representatives, engine_version, settings.SCAN_BATCH_CONCURRENCY)
+        verdicts = {schematic.file_hash: result for schematic, result in zip(representatives, results)}
+
+        now = timezone.now()
+        infected = 0
+        rescanned = []
+        for file_hash, scan_result in verdicts.items():
+            if scan_result['is_infected']:
+                infected += _rescan_infected(file_hash, scan_result, now)
+        # The cursor stops before the first scan error so the next run retries
+        # it; rows after it that completed drop out of the queryset by scanned_at
+        completed, cursor, errors = 0, None, 0
+        for schematic in batch:
+            scan_result = verdicts[schematic.file_hash]
+            if scan_result['status'] == 'error':
+                errors += 1
+                continue
+            completed += 1
+            if not errors:
+                cursor = schematic
+            if scan_result['status'] == 'clean':
+                schematic.scan_result = scan_result
+                schematic.scanned_at = now
+                rescanned.append(schematic)
+        Schematic.objects.bulk_update(rescanned, ['scan_result', 'scanned_at'])
+
+        sweep.scanned += completed
+        sweep.infected += infected
+        if cursor is not None:
+            sweep.cursor_downloads = cursor.download_count
+            sweep.cursor_id = cursor.id
+        if errors:
+            logger.warning(f"Rescan sweep with {engine_version}: {errors} scans failed, retrying next run")
+        elif len(batch) < settings.RESCAN_SWEEP_BATCH:
+            sweep.finished_at = now
+            logger.info(
+                f"Rescan sweep with {engine_version} finished: "
+                f"{sweep.scanned} scanned, {sweep.infected} infected"
+            )
+        sweep.save()
+    finally:
+        cache.delete(RESCAN_LOCK_KEY)
+
+    return {
+        'status': 'finished' if sweep.finished_at else 'running',
+        'engine_version': engine_version,
+        'scanned': completed,
+        'errors': errors,
+        'infected': infected,
+    }
+
+
+@shared_task
+def clamd_probe_task():
+    """
+    Drive the clamd circuit breaker back to closed
+
+    Run every CLAMD_BREAKER_PROBE_INTERVAL (CELERY_BEAT_SCHEDULE). While the
+    breaker is open, clamd is pinged; once it answers, the breaker starts
+    recovering. While recovering, each run releases the next
+    CLAMD_BREAKER_RELEASE_BATCH parked schematics, so the backlog reaches
+    clamd at a controlled rate, and the breaker closes once none are left.
+    """
+    from .scanner import VirusScanner
+
+    Schematic = apps.get_model('schematics', 'Schematic')
+
+    state = breaker.state()
+    if state == breaker.OPEN:
+        if not VirusScanner().ping():
+            return {'state': breaker.OPEN}
+        breaker.recover()
+        state = breaker.RECOVERING
+
+    if state == breaker.RECOVERING:
+        parked = Schematic.objects.filter(
+            scan_status='pending', scan_retry_count__lt=F('max_scan_retries')
+        ).count()
+        if not parked:
+            breaker.close()
+            return {'state': breaker.CLOSED}
+        scan_batch_task.delay(settings.CLAMD_BREAKER_RELEASE_BATCH, drain=False)
+        return {'state': breaker.RECOVERING, 'parked': parked}
+
+    return {'state': state}
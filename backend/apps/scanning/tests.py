@@ -1,8 +1,10 @@
 """
 Unit tests for scanning app
 """
+import io
 import pytest
 from unittest.mock import patch, MagicMock
+from apps.scanning.fakeclamd import FakeClamd
 from apps.schematics.models import Schematic
 from django.contrib.auth import get_user_model
 
@@ -138,18 +140,18 @@ class TestScanFileTask:
         with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class:
             # Mock scanner to return clean result
             mock_scanner = MagicMock()
-            mock_scanner.scan_file.return_value = {
+            mock_scanner.engine_version.return_value = None
+            mock_scanner.scan_stream.return_value = {
                 'is_infected': False,
                 'virus_name': None,
                 'status': 'clean'
             }
             mock_scanner_class.return_value = mock_scanner
 
-            # Mock file.path property
-            with patch.object(
-                type(schematic.file),
-                'path',
-                new_callable=lambda: property(lambda self: '/fake/path')
+            # Mock the stored file content
+            with patch(
+                'apps.scanning.streams.open_scan_stream',
+                return_value=io.BytesIO(b'schematic bytes')
             ):
                 result = scan_file_task(str(schematic.id))
 
@@ -176,18 +178,18 @@ class TestScanFileTask:
         with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class:
             # Mock scanner to return infected result
             mock_scanner = MagicMock()
-            mock_scanner.scan_file.return_value = {
+            mock_scanner.engine_version.return_value = None
+            mock_scanner.scan_stream.return_value = {
                 'is_infected': True,
                 'virus_name': 'TestVirus',
                 'status': 'infected'
             }
             mock_scanner_class.return_value = mock_scanner
 
-            # Mock file.path property
-            with patch.object(
-                type(schematic.file),
-                'path',
-                new_callable=lambda: property(lambda self: '/fake/path')
+            # Mock the stored file content
+            with patch(
+                'apps.scanning.streams.open_scan_stream',
+                return_value=io.BytesIO(b'schematic bytes')
             ):
                 result = scan_file_task(str(schematic.id))
 
@@ -215,7 +217,8 @@ class TestScanFileTask:
         with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class:
             # Mock scanner to return error result
             mock_scanner = MagicMock()
-            mock_scanner.scan_file.return_value = {
+            mock_scanner.engine_version.return_value = None
+            mock_scanner.scan_stream.return_value = {
                 'is_infected': False,
                 'virus_name': None,
                 'status': 'error',
@@ -223,11 +226,10 @@ class TestScanFileTask:
             }
             mock_scanner_class.return_value = mock_scanner
 
-            # Mock file.path property
-            with patch.object(
-                type(schematic.file),
-                'path',
-                new_callable=lambda: property(lambda self: '/fake/path')
+            # Mock the stored file content
+            with patch(
+                'apps.scanning.streams.open_scan_stream',
+                return_value=io.BytesIO(b'schematic bytes')
             ):
                 # The task will raise Retry exception with new logic
                 try:
@@ -241,6 +243,37 @@ class TestScanFileTask:
             # Retry count may be incremented multiple times due to test execution
             assert schematic.scan_retry_count >= 1
 
+    def test_blank_hash_is_taken_from_scanned_stream(self):
+        """Test that a direct upload without a hash gets the SHA-256 of the bytes clamd read"""
+        import hashlib
+        from apps.scanning.tasks import scan_file_task
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Direct Upload',
+            file='quarantine/direct.schem',
+            file_size=15,
+            file_hash='',
+            scan_status='pending'
+        )
+
+        def scan_stream(stream):
+            while stream.read(4):
+                pass
+            return {'is_infected': False, 'virus_name': None, 'status': 'clean'}
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', return_value=io.BytesIO(b'schematic bytes')), \
+                patch('apps.storage.promotion.promote_file'), \
+                patch('apps.schematics.tasks.process_schematic_task'):
+            mock_scanner_class.return_value.engine_version.return_value = None
+            mock_scanner_class.return_value.scan_stream.side_effect = scan_stream
+            assert scan_file_task(str(schematic.id))['status'] == 'clean'
+
+        schematic.refresh_from_db()
+        assert schematic.scan_status == 'clean'
+        assert schematic.file_hash == hashlib.sha256(b'schematic bytes').hexdigest()
+
     def test_scan_file_task_not_found(self):
         """Test scanning task for non-existent schematic"""
         from apps.scanning.tasks import scan_file_task
@@ -264,6 +297,7 @@ class TestScanFileTask:
 
         with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class:
             mock_scanner = MagicMock()
+            mock_scanner.engine_version.return_value = None
 
             def check_status(*args, **kwargs):
                 # Check status during scan
@@ -275,13 +309,988 @@ class TestScanFileTask:
                     'status': 'clean'
                 }
 
-            mock_scanner.scan_file.side_effect = check_status
+            mock_scanner.scan_stream.side_effect = check_status
             mock_scanner_class.return_value = mock_scanner
 
-            # Mock file.path property
-            with patch.object(
-                type(schematic.file),
-                'path',
-                new_callable=lambda: property(lambda self: '/fake/path')
+            # Mock the stored file content
+            with patch(
+                'apps.scanning.streams.open_scan_stream',
+                return_value=io.BytesIO(b'schematic bytes')
             ):
                 scan_file_task(str(schematic.id))
+
+
+class TestClamdSessionPool:
+    """Test pooled persistent clamd sessions"""
+
+    def setup_method(self):
+        """Start a fake clamd"""
+        self.clamd = FakeClamd()
+
+    def teardown_method(self):
+        """Stop the fake clamd"""
+        self.clamd.stop()
+
+    def _pool(self, **kwargs):
+        from apps.scanning.sessions import ClamdSessionPool
+        return ClamdSessionPool('127.0.0.1', self.clamd.port, timeout=5, **kwargs)
+
+    def test_sessions_are_reused(self):
+        """Test that consecutive commands share one IDSESSION connection without PINGs"""
+        import io
+        pool = self._pool()
+
+        assert pool.execute('SCAN /data/a.schem') == '/data/a.schem: OK'
+        assert pool.execute('INSTREAM', stream=io.BytesIO(b'x' * 200000)) == 'stream: OK'
+        assert pool.execute('INSTREAM', stream=io.BytesIO(b'xxEICARxx')) == 'stream: Eicar-Test-Signature FOUND'
+
+        assert self.clamd.connections == 1
+        assert 'zPING' not in self.clamd.commands
+        assert pool.stats() == {'opened': 1, 'reused': 2, 'failed': 0, 'idle': 1}
+        pool.close()
+
+    def test_dead_session_is_replaced(self):
+        """Test that a session clamd has closed is retried once on a new connection"""
+        import io
+        import time
+        self.clamd.close_after_reply = True
+        pool = self._pool()
+
+        assert pool.execute('SCAN /data/a.schem') == '/data/a.schem: OK'
+        time.sleep(0.05)
+        assert pool.execute('INSTREAM', stream=io.BytesIO(b'data')) == 'stream: OK'
+
+        assert self.clamd.connections == 2
+        assert pool.stats()['opened'] == 2
+        assert pool.stats()['failed'] == 1
+        pool.close()
+
+    def test_idle_sessions_expire(self):
+        """Test that sessions idle beyond the timeout are closed rather than reused"""
+        pool = self._pool(idle_timeout=0)
+
+        pool.execute('SCAN /data/a.schem')
+        pool.execute('SCAN /data/b.schem')
+
+        assert self.clamd.connections == 2
+        assert pool.stats()['reused'] == 0
+        pool.close()
+
+    def test_unreachable_clamd(self):
+        """Test that a refused connection raises and is counted as failed"""
+        from apps.scanning.sessions import ClamdSessionPool
+
+        self.clamd.stop()
+        pool = ClamdSessionPool('127.0.0.1', self.clamd.port, timeout=1)
+
+        with pytest.raises(OSError):
+            pool.execute('SCAN /data/a.schem')
+        assert pool.stats()['failed'] == 1
+        self.clamd = FakeClamd()
+
+    def test_scanner_uses_pool(self, settings):
+        """Test VirusScanner verdicts over pooled sessions"""
+        from apps.scanning.scanner import VirusScanner
+
+        settings.CLAMAV_HOST = '127.0.0.1'
+        settings.CLAMAV_PORT = self.clamd.port
+        scanner = VirusScanner()
+
+        assert scanner.scan_stream(b'clean content')['status'] == 'clean'
+        result = scanner.scan_stream(b'EICAR')
+        assert result['is_infected'] is True
+        assert result['virus_name'] == 'Eicar-Test-Signature'
+        assert scanner.scan_file('/data/a.schem')['status'] == 'clean'
+        assert scanner.pool_stats()['opened'] == 1
+        scanner.pool.close()
+
+
+class TestConcurrentStreamScan:
+    """Test INSTREAM scans fed while the data is being read"""
+
+    def setup_method(self):
+        """Start a fake clamd"""
+        self.clamd = FakeClamd()
+
+    def teardown_method(self):
+        """Stop the fake clamd"""
+        self.clamd.stop()
+
+    def _scanner(self, port):
+        from unittest.mock import patch
+        from apps.scanning.scanner import VirusScanner
+
+        with patch('django.conf.settings.CLAMAV_HOST', '127.0.0.1'), \
+                patch('django.conf.settings.CLAMAV_PORT', port):
+            return VirusScanner()
+
+    def test_fed_chunks_are_scanned(self):
+        """Test that chunks fed one by one reach clamd as a single stream"""
+        from apps.scanning.scanner import ConcurrentStreamScan
+
+        scanner = self._scanner(self.clamd.port)
+        scan = ConcurrentStreamScan(scanner, timeout=5)
+        for _ in range(40):
+            scan.feed(b'x' * 65536)
+        assert scan.finish()['status'] == 'clean'
+
+        # The signature spans two chunks
+        scan = ConcurrentStreamScan(scanner, timeout=5)
+        for chunk in (b'y' * 1000 + b'EI', b'CAR', b'z' * 1000):
+            scan.feed(chunk)
+        result = scan.finish()
+        assert result['is_infected'] is True
+        assert result['virus_name'] == 'Eicar-Test-Signature'
+        scanner.pool.close()
+
+    def test_unreachable_clamd_never_blocks_feeding(self):
+        """Test that a failed scan keeps draining so feeding more than the queue holds returns"""
+        from apps.scanning.scanner import ConcurrentStreamScan, QUEUE_CHUNKS
+
+        self.clamd.stop()
+        scan = ConcurrentStreamScan(self._scanner(self.clamd.port), timeout=5)
+        for _ in range(QUEUE_CHUNKS * 4):
+            scan.feed(b'x' * 1024)
+        result = scan.finish()
+        assert result['status'] == 'error'
+        assert result['is_infected'] is False
+
+
+@pytest.mark.django_db
+class TestScanBatchTask:
+    """Test draining pending scans in batches"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _pending(self, name, **kwargs):
+        return Schematic.objects.create(
+            owner=self.user,
+            title=name,
+            file=f'schematics/{name}.schem',
+            file_size=1024,
+            file_hash=f'hash-{name}',
+            scan_status='pending',
+            **kwargs
+        )
+
+    def _content(self, field_file):
+        # Each stored file contains its own name
+        return io.BytesIO(field_file.name.encode())
+
+    def _run(self, verdict, batch_size=None):
+        from apps.scanning.tasks import scan_batch_task
+
+        def scan_stream(stream):
+            path = stream.read().decode()
+            if 'broken' in path:
+                return {'is_infected': False, 'virus_name': None, 'status': 'error', 'error': 'timeout'}
+            if 'virus' in path:
+                return {'is_infected': True, 'virus_name': 'TestVirus', 'status': 'infected'}
+            return {'is_infected': False, 'virus_name': None, 'status': 'clean'}
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', side_effect=self._content), \
+                patch('apps.schematics.tasks.process_schematic_task') as mock_process:
+            mock_scanner_class.return_value.engine_version.return_value = None
+            mock_scanner_class.return_value.scan_stream.side_effect = verdict or scan_stream
+            result = scan_batch_task(batch_size)
+        return result, mock_scanner_class.return_value, mock_process
+
+    def test_batch_writes_all_verdicts(self):
+        """Test that one batch scans every pending row and applies each verdict"""
+        clean = self._pending('castle')
+        infected = self._pending('virus')
+        broken = self._pending('broken')
+        done = self._pending('done')
+        Schematic.objects.filter(id=done.id).update(scan_status='clean')
+
+        result, scanner, mock_process = self._run(None)
+
+        assert result == {'claimed': 3, 'clean': 1, 'infected': 1, 'error': 1}
+        assert scanner.scan_stream.call_count == 3
+        mock_process.delay.assert_called_once_with(str(clean.id))
+
+        clean.refresh_from_db()
+        assert clean.scan_status == 'clean'
+        assert clean.scanned_at is not None
+        assert clean.blob is not None
+        infected.refresh_from_db()
+        assert infected.scan_status == 'infected'
+        assert infected.scan_result['virus_name'] == 'TestVirus'
+        broken.refresh_from_db()
+        assert broken.scan_status == 'pending'
+        assert broken.scan_retry_count == 1
+        self.user.refresh_from_db()
+        assert self.user.infected_upload_count == 1
+
+    def test_batches_drain_backlog(self):
+        """Test that full batches queue the next one until nothing is pending"""
+        for index in range(5):
+            self._pending(f'castle{index}')
+
+        result, scanner, mock_process = self._run(None, batch_size=2)
+
+        assert result['claimed'] == 2
+        assert scanner.scan_stream.call_count == 5
+        assert not Schematic.objects.filter(scan_status='pending').exists()
+
+    def test_failing_batch_stops_and_expires_retries(self):
+        """Test that an all-error batch is not requeued and exhausted rows are given up"""
+        broken = self._pending('broken')
+        last_try = self._pending('broken-last', scan_retry_count=4)
+
+        result, scanner, mock_process = self._run(None, batch_size=2)
+
+        assert result == {'claimed': 2, 'clean': 0, 'infected': 0, 'error': 2}
+        assert scanner.scan_stream.call_count == 2
+        broken.refresh_from_db()
+        assert broken.scan_status == 'pending'
+        last_try.refresh_from_db()
+        assert last_try.scan_status == 'error'
+        assert last_try.scan_retry_count == 5
+
+    def test_scan_file_task_skips_claimed_rows(self):
+        """Test that scan_file_task leaves rows a batch is already scanning alone"""
+        from apps.scanning.tasks import scan_file_task
+
+        schematic = self._pending('castle')
+        Schematic.objects.filter(id=schematic.id).update(scan_status='scanning')
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class:
+            result = scan_file_task(str(schematic.id))
+
+        assert result == {'status': 'scanning', 'reason': 'not_pending'}
+        mock_scanner_class.return_value.scan_stream.assert_not_called()
+
+
+@pytest.mark.django_db
+class TestScanVerdictCache:
+    """Test reusing verdicts per file hash and signature version"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _pending(self, title, file_hash='cafe' * 16):
+        return Schematic.objects.create(
+            owner=self.user,
+            title=title,
+            file=f'schematics/{title}.schem',
+            file_size=1024,
+            file_hash=file_hash,
+            scan_status='pending'
+        )
+
+    def _scan(self, schematic, engine_version):
+        from apps.scanning.tasks import scan_file_task
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', return_value=io.BytesIO(b'schematic bytes')), \
+                patch('apps.schematics.tasks.process_schematic_task'):
+            mock_scanner = mock_scanner_class.return_value
+            mock_scanner.engine_version.return_value = engine_version
+            mock_scanner.scan_stream.return_value = {
+                'is_infected': True,
+                'virus_name': 'TestVirus',
+                'status': 'infected'
+            }
+            result = scan_file_task(str(schematic.id))
+        return result, mock_scanner
+
+    def test_same_content_and_version_is_not_rescanned(self):
+        """Test that a verdict is reused for identical content until the signatures change"""
+        from apps.scanning.models import ScanVerdict
+
+        result, scanner = self._scan(self._pending('first'), 'ClamAV 1.2.1/27112')
+        assert result['virus_name'] == 'TestVirus'
+        assert scanner.scan_stream.call_count == 1
+        assert ScanVerdict.objects.filter(engine_version='ClamAV 1.2.1/27112').count() == 1
+
+        second = self._pending('second')
+        result, scanner = self._scan(second, 'ClamAV 1.2.1/27112')
+        scanner.scan_stream.assert_not_called()
+        second.refresh_from_db()
+        assert second.scan_status == 'infected'
+        assert second.scan_result['virus_name'] == 'TestVirus'
+
+        # New signatures: the old verdict no longer applies
+        result, scanner = self._scan(self._pending('third'), 'ClamAV 1.2.1/27113')
+        assert scanner.scan_stream.call_count == 1
+        assert ScanVerdict.objects.count() == 2
+
+    def test_errors_and_unknown_versions_are_not_cached(self):
+        """Test that only definite verdicts with a known version are stored"""
+        from apps.scanning.models import ScanVerdict
+        from apps.scanning.verdicts import cached_verdict, store_verdict
+
+        store_verdict('beef' * 16, 'ClamAV 1.2.1/27112', {'is_infected': False, 'status': 'error', 'error': 'x'})
+        store_verdict('beef' * 16, None, {'is_infected': False, 'virus_name': None, 'status': 'clean'})
+        assert not ScanVerdict.objects.exists()
+        assert cached_verdict('beef' * 16, None) is None
+
+        self._scan(self._pending('unversioned'), None)
+        assert not ScanVerdict.objects.exists()
+
+    def test_engine_version_is_parsed_and_memoized(self):
+        """Test that VERSION is asked once and the signature date dropped"""
+        from apps.scanning.scanner import VirusScanner
+
+        clamd = FakeClamd()
+        try:
+            with patch('django.conf.settings.CLAMAV_HOST', '127.0.0.1'), \
+                    patch('django.conf.settings.CLAMAV_PORT', clamd.port):
+                scanner = VirusScanner()
+            assert scanner.engine_version() == 'ClamAV 1.2.1/27112'
+            assert scanner.engine_version() == 'ClamAV 1.2.1/27112'
+            assert clamd.commands.count('zVERSION') == 1
+            scanner.pool.close()
+        finally:
+            clamd.stop()
+
+
+class TestScanStreams:
+    """Test streaming stored files to clamd"""
+
+    def setup_method(self):
+        """Set up an in-memory S3 object"""
+        import re
+
+        class FakeS3Object:
+            def __init__(self, data):
+                self.data = data
+                self.content_length = len(data)
+                self.ranges = []
+
+            def get(self, Range):
+                start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+                self.ranges.append((start, end))
+                return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+        self.data = bytes(range(256)) * 1000
+        self.s3_object = FakeS3Object(self.data)
+
+    def test_ranged_reader_streams_in_ranges(self):
+        """Test that S3 objects are read with bounded ranged GETs, never whole"""
+        from apps.scanning.sessions import STREAM_CHUNK_SIZE
+        from apps.scanning.streams import RangedS3Reader
+
+        reader = RangedS3Reader(self.s3_object, len(self.data), range_size=100000)
+        chunks = []
+        while True:
+            chunk = reader.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            assert len(chunk) <= STREAM_CHUNK_SIZE
+            chunks.append(chunk)
+
+        assert b''.join(chunks) == self.data
+        assert self.s3_object.ranges == [(0, 99999), (100000, 199999), (200000, 255999)]
+
+    def test_ranged_reader_rewinds_for_retries(self):
+        """Test that the reader can be rewound, as the session pool does on a retry"""
+        from apps.scanning.streams import RangedS3Reader
+
+        reader = RangedS3Reader(self.s3_object, len(self.data), range_size=4096)
+        assert reader.seekable()
+        start = reader.tell()
+        assert reader.read(5000) == self.data[:4096]
+        reader.seek(start)
+        assert reader.read() == self.data[:4096]
+        assert reader.read(10) == self.data[4096:4106]
+
+    def test_local_storage_is_opened_directly(self):
+        """Test that non-S3 storages are streamed through their own file objects"""
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from django.db.models.fields.files import FieldFile
+        from apps.scanning.streams import open_scan_stream
+
+        name = default_storage.save('schematics/stream-test.schem', ContentFile(self.data))
+        try:
+            field_file = FieldFile(None, Schematic._meta.get_field('file'), name)
+            with open_scan_stream(field_file) as stream:
+                assert stream.read() == self.data
+        finally:
+            default_storage.delete(name)
+
+    def test_scan_stream_reaches_clamd_in_chunks(self):
+        """Test scanning a ranged S3 stream against clamd end to end"""
+        from apps.scanning.scanner import VirusScanner
+        from apps.scanning.streams import RangedS3Reader
+
+        clamd = FakeClamd()
+        try:
+            with patch('django.conf.settings.CLAMAV_HOST', '127.0.0.1'), \
+                    patch('django.conf.settings.CLAMAV_PORT', clamd.port):
+                scanner = VirusScanner()
+            reader = RangedS3Reader(self.s3_object, len(self.data), range_size=100000)
+            assert scanner.scan_stream(reader)['status'] == 'clean'
+            assert len(self.s3_object.ranges) == 3
+            scanner.pool.close()
+        finally:
+            clamd.stop()
+
+
+class TestAsyncVirusScanner:
+    """Test the asyncio clamd client"""
+
+    def setup_method(self):
+        """Start a fake clamd that takes a while to answer"""
+        self.clamd = FakeClamd(delay=0.2)
+
+    def teardown_method(self):
+        """Stop the fake clamd"""
+        self.clamd.stop()
+
+    def _scan_many(self, payloads, **kwargs):
+        import asyncio
+        from apps.scanning.aioscanner import AsyncVirusScanner
+
+        async def run():
+            scanner = AsyncVirusScanner('127.0.0.1', self.clamd.port, **kwargs)
+            return await scanner.scan_many([lambda data=data: io.BytesIO(data) for data in payloads])
+        return asyncio.run(run())
+
+    def test_scans_run_concurrently(self):
+        """Test that slow scans overlap and results keep their order"""
+        import time
+
+        payloads = [b'x' * 100000] * 19 + [b'xx EICAR xx']
+        started = time.monotonic()
+        results = self._scan_many(payloads, concurrency=50, timeout=5)
+        elapsed = time.monotonic() - started
+
+        assert [result['status'] for result in results] == ['clean'] * 19 + ['infected']
+        assert results[-1]['virus_name'] == 'Eicar-Test-Signature'
+        # Sequentially this would take 20 * 0.2s
+        assert elapsed < 2
+        assert self.clamd.commands.count('zINSTREAM') == 20
+
+    def test_semaphore_bounds_scans_in_flight(self):
+        """Test that no more than `concurrency` scans run at once"""
+        import time
+
+        started = time.monotonic()
+        results = self._scan_many([b'data'] * 4, concurrency=2, timeout=5)
+
+        assert all(result['status'] == 'clean' for result in results)
+        assert time.monotonic() - started >= 0.4
+
+    def test_each_scan_has_a_timeout(self):
+        """Test that a scan clamd does not answer in time becomes an error result"""
+        results = self._scan_many([b'data'], concurrency=2, timeout=0.05)
+
+        assert results == [{
+            'is_infected': False,
+            'virus_name': None,
+            'status': 'error',
+            'error': 'Scan timed out'
+        }]
+
+
+@pytest.mark.django_db
+class TestScanBatchAsyncTask:
+    """Test draining pending scans on one event loop"""
+
+    def setup_method(self):
+        """Set up test data and a fake clamd"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.clamd = FakeClamd()
+
+    def teardown_method(self):
+        """Stop the fake clamd"""
+        from apps.scanning.sessions import get_session_pool
+
+        get_session_pool('127.0.0.1', self.clamd.port).close()
+        self.clamd.stop()
+
+    def test_batch_is_scanned_on_event_loop(self):
+        """Test that every claimed file is streamed to clamd and its verdict applied"""
+        from django.core.files.base import ContentFile
+        from apps.scanning.tasks import scan_batch_async_task
+
+        schematics = []
+        for index, data in enumerate([b'clean one', b'clean two', b'xx EICAR xx']):
+            schematic = Schematic(
+                owner=self.user,
+                title=f'Batch {index}',
+                file_size=len(data),
+                file_hash=f'async-{index}',
+                scan_status='pending'
+            )
+            schematic.file.save(f'async-{index}.schem', ContentFile(data), save=False)
+            schematic.save()
+            schematics.append(schematic)
+
+        with patch('django.conf.settings.CLAMAV_HOST', '127.0.0.1'), \
+                patch('django.conf.settings.CLAMAV_PORT', self.clamd.port), \
+                patch('apps.schematics.tasks.process_schematic_task') as mock_process:
+            result = scan_batch_async_task(10)
+
+        assert result == {'claimed': 3, 'clean': 2, 'infected': 1, 'error': 0}
+        assert self.clamd.commands.count('zINSTREAM') == 3
+        assert mock_process.delay.call_count == 2
+        statuses = [Schematic.objects.get(id=schematic.id).scan_status for schematic in schematics]
+        assert statuses == ['clean', 'clean', 'infected']
+        for schematic in schematics[:2]:
+            schematic.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestRescanSweep:
+    """Test rescanning clean schematics after signature updates"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _clean(self, title, downloads, **kwargs):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        defaults = {
+            'file': f'schematics/{title}.schem',
+            'file_hash': f'hash-{title}',
+        }
+        defaults.update(kwargs)
+        return Schematic.objects.create(
+            owner=self.user,
+            title=title,
+            file_size=1024,
+            download_count=downloads,
+            scan_status='clean',
+            scan_result={'is_infected': False, 'virus_name': None, 'status': 'clean'},
+            scanned_at=timezone.now() - timedelta(days=1),
+            **defaults
+        )
+
+    def _sweep(self, settings, engine_version='ClamAV 1.2.1/27113', verdict=None, batch=2, failing=()):
+        from apps.scanning.tasks import rescan_sweep_task
+
+        settings.RESCAN_SWEEP_BATCH = batch
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', side_effect=lambda f: io.BytesIO(f.name.encode())):
+            mock_scanner = mock_scanner_class.return_value
+            mock_scanner.engine_version.return_value = engine_version
+            self.scanned = []
+
+            def scan_stream(stream):
+                name = stream.read().decode()
+                self.scanned.append(name)
+                if name in failing:
+                    return {'is_infected': False, 'virus_name': None, 'status': 'error', 'error': 'timed out'}
+                return verdict or {'is_infected': False, 'virus_name': None, 'status': 'clean'}
+            mock_scanner.scan_stream.side_effect = scan_stream
+            result = rescan_sweep_task()
+        return result, mock_scanner
+
+    def test_sweep_resumes_most_downloaded_first(self, settings):
+        """Test that each run rescans the next slice by download count and keeps a cursor"""
+        from apps.scanning.models import RescanSweep
+
+        schematics = {title: self._clean(title, downloads) for title, downloads in
+                      [('rare', 1), ('popular', 500), ('famous', 900), ('known', 50), ('new', 0)]}
+
+        result, scanner = self._sweep(settings)
+        assert result['scanned'] == 2
+        assert set(self.scanned) == {'schematics/famous.schem', 'schematics/popular.schem'}
+        sweep = RescanSweep.objects.get()
+        assert sweep.cursor_downloads == 500
+        assert sweep.cursor_id == schematics['popular'].id
+
+        # A fresh worker continues from the stored cursor
+        result, scanner = self._sweep(settings)
+        assert result == {
+            'status': 'running', 'engine_version': 'ClamAV 1.2.1/27113', 'scanned': 2, 'errors': 0, 'infected': 0
+        }
+        result, scanner = self._sweep(settings)
+        assert result['status'] == 'finished'
+        assert result['scanned'] == 1
+
+        result, scanner = self._sweep(settings)
+        assert result == {'status': 'finished', 'engine_version': 'ClamAV 1.2.1/27113'}
+        scanner.scan_stream.assert_not_called()
+        sweep.refresh_from_db()
+        assert sweep.scanned == 5
+        for schematic in schematics.values():
+            schematic.refresh_from_db()
+            assert schematic.scanned_at > sweep.started_at
+
+        # New signatures start over
+        result, scanner = self._sweep(settings, engine_version='ClamAV 1.2.1/27114', batch=10)
+        assert result['scanned'] == 5
+        assert RescanSweep.objects.count() == 2
+
+    def test_sweep_retries_failed_scans(self, settings):
+        """Test that the cursor stops before a failed scan and only completed scans are counted"""
+        from apps.scanning.models import RescanSweep
+
+        schematics = {title: self._clean(title, downloads) for title, downloads in
+                      [('rare', 1), ('popular', 500), ('famous', 900), ('known', 50)]}
+
+        result, scanner = self._sweep(settings, batch=10, failing={'schematics/popular.schem'})
+        assert result['status'] == 'running'
+        assert (result['scanned'], result['errors']) == (3, 1)
+        sweep = RescanSweep.objects.get()
+        assert sweep.scanned == 3
+        assert sweep.cursor_id == schematics['famous'].id
+        assert sweep.finished_at is None
+
+        result, scanner = self._sweep(settings, batch=10)
+        assert self.scanned == ['schematics/popular.schem']
+        assert result['status'] == 'finished'
+        sweep.refresh_from_db()
+        assert sweep.scanned == 4
+        schematics['popular'].refresh_from_db()
+        assert schematics['popular'].scanned_at > sweep.started_at
+
+    def test_infected_blob_is_discarded_for_every_sharer(self, settings, django_capture_on_commit_callbacks):
+        """Test that newly detected content is removed for all schematics sharing it"""
+        from django.core.files.base import ContentFile
+        from apps.storage.blobs import acquire_blob, register_blob
+        from apps.storage.models import FileBlob
+
+        original = self._clean('original', 10, file='', file_hash='f' * 64)
+        original.file.save('original.schem', ContentFile(b'newly detected'), save=False)
+        original.save()
+        register_blob(original)
+        copy = self._clean('copy', 0, file=original.file.name, file_hash='f' * 64, blob=acquire_blob('f' * 64))
+        storage, name = original.file.storage, original.file.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            result, scanner = self._sweep(settings, batch=10, verdict={
+                'is_infected': True, 'virus_name': 'NewSignature', 'status': 'infected'
+            })
+
+        assert result['infected'] == 2
+        assert scanner.scan_stream.call_count == 1
+        for schematic in (original, copy):
+            schematic.refresh_from_db()
+            assert schematic.scan_status == 'infected'
+            assert schematic.scan_result['virus_name'] == 'NewSignature'
+            assert schematic.blob is None
+        assert not FileBlob.objects.exists()
+        assert not storage.exists(name)
+        self.user.refresh_from_db()
+        assert self.user.infected_upload_count == 0
+
+    def test_sweep_yields_to_pending_uploads(self, settings):
+        """Test that the sweep pauses while fresh uploads wait and without clamd"""
+        from apps.scanning.models import RescanSweep
+
+        self._clean('castle', 5)
+        settings.RESCAN_MAX_PENDING = 1
+        for index in range(2):
+            Schematic.objects.create(
+                owner=self.user, title=f'upload {index}', file='x.schem',
+                file_size=1, file_hash=f'pending-{index}', scan_status='pending'
+            )
+
+        result, scanner = self._sweep(settings)
+        assert result == {'status': 'skipped', 'reason': 'uploads_pending'}
+
+        settings.RESCAN_MAX_PENDING = 20
+        result, scanner = self._sweep(settings, engine_version=None)
+        assert result == {'status': 'skipped', 'reason': 'clamd_unavailable'}
+        assert not RescanSweep.objects.exists()
+
+
+@pytest.mark.django_db
+class TestScanRouting:
+    """Test routing scans to the fast and bulk queues"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _schematic(self, file_size, scan_status='pending'):
+        return Schematic.objects.create(
+            owner=self.user,
+            title='Castle',
+            file='quarantine/castle.schem',
+            file_size=file_size,
+            file_hash='r' * 64,
+            scan_status=scan_status
+        )
+
+    def test_small_files_from_trusted_uploaders_take_fast_lane(self, settings):
+        """Test that size and upload history both decide the queue"""
+        from apps.scanning.routing import scan_queue
+
+        settings.SCAN_FAST_MAX_SIZE = 1024
+        settings.SCAN_TRUSTED_MIN_CLEAN_UPLOADS = 1
+        small = self._schematic(512)
+        large = self._schematic(4096)
+
+        # No clean uploads yet
+        assert scan_queue(small) == 'scan-bulk'
+
+        self._schematic(100, scan_status='clean')
+        assert scan_queue(small) == 'scan-fast'
+        assert scan_queue(large) == 'scan-bulk'
+
+        self.user.infected_upload_count = 1
+        self.user.save()
+        small.refresh_from_db()
+        assert scan_queue(small) == 'scan-bulk'
+
+    def test_queue_scan_sends_to_routed_queue(self, settings):
+        """Test that queue_scan passes the queue to apply_async"""
+        from apps.scanning.routing import queue_scan
+
+        settings.SCAN_TRUSTED_MIN_CLEAN_UPLOADS = 0
+        schematic = self._schematic(512)
+
+        with patch('apps.scanning.tasks.scan_file_task.apply_async') as apply_async:
+            queue_scan(schematic)
+
+        apply_async.assert_called_once_with(args=[str(schematic.id)], queue='scan-fast')
+
+    def test_batch_tasks_are_routed_to_bulk_queue(self):
+        """Test that background scan tasks never occupy the fast lane"""
+        from django.conf import settings
+
+        for task in ('scan_batch_task', 'scan_batch_async_task', 'rescan_sweep_task'):
+            assert settings.CELERY_TASK_ROUTES[f'apps.scanning.tasks.{task}'] == {'queue': 'scan-bulk'}
+
+    def test_probe_task_is_scheduled_on_fast_queue(self):
+        """Test that the breaker probe runs periodically next to interactive scans"""
+        from django.conf import settings
+
+        assert settings.CELERY_BEAT_SCHEDULE['clamd-probe']['task'] == 'apps.scanning.tasks.clamd_probe_task'
+        assert settings.CELERY_TASK_ROUTES['apps.scanning.tasks.clamd_probe_task'] == {'queue': 'scan-fast'}
+
+
+@pytest.mark.django_db
+class TestClamdCircuitBreaker:
+    """Test parking scans while clamd is down and releasing them afterwards"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _use_cache(self, settings):
+        # The breaker needs a real cache; tests default to DummyCache
+        from django.core.cache import cache
+
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'clamd-breaker-tests',
+            }
+        }
+        cache.clear()
+
+    def _pending(self, name):
+        return Schematic.objects.create(
+            owner=self.user,
+            title=name,
+            file=f'schematics/{name}.schem',
+            file_size=1024,
+            file_hash=f'hash-{name}',
+            scan_status='pending'
+        )
+
+    def _scan(self, schematic, scan_result):
+        from celery.exceptions import Retry
+        from apps.scanning.tasks import scan_file_task
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', side_effect=lambda f: io.BytesIO(b'x')), \
+                patch('apps.schematics.tasks.process_schematic_task'):
+            mock_scanner = mock_scanner_class.return_value
+            mock_scanner.engine_version.return_value = None
+            mock_scanner.scan_stream.return_value = scan_result
+            try:
+                return scan_file_task(str(schematic.id)), mock_scanner
+            except Retry:
+                return None, mock_scanner
+
+    def test_batches_park_scans_during_outage(self, settings):
+        """Test that batches run during a clamd outage never spend retries or expire uploads"""
+        from apps.scanning import breaker
+        from apps.scanning.tasks import scan_batch_task
+
+        self._use_cache(settings)
+        settings.CLAMD_BREAKER_THRESHOLD = 2
+        error = {'is_infected': False, 'virus_name': None, 'status': 'error', 'error': 'Connection refused'}
+        schematics = [self._pending(f'upload-{index}') for index in range(3)]
+        Schematic.objects.update(max_scan_retries=2)
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', side_effect=lambda f: io.BytesIO(b'x')), \
+                patch.object(scan_batch_task, 'delay'):
+            mock_scanner = mock_scanner_class.return_value
+            mock_scanner.engine_version.return_value = None
+            mock_scanner.scan_stream.return_value = error
+            # The first batch's own failures open the breaker
+            assert scan_batch_task(10)['error'] == 3
+            assert breaker.is_open()
+            # Later batches while clamd stays down claim nothing
+            for _ in range(3):
+                assert scan_batch_task(10)['claimed'] == 0
+            # A probe lets a batch through while recovering; it fails and reopens the breaker
+            breaker.recover()
+            assert scan_batch_task(10, drain=False)['error'] == 3
+            assert breaker.is_open()
+
+        for schematic in schematics:
+            schematic.refresh_from_db()
+            assert schematic.scan_status == 'pending'
+            assert schematic.scan_retry_count == 0
+        assert mock_scanner.scan_stream.call_count == 6
+
+    def test_failures_open_breaker_and_park_scans(self, settings):
+        """Test that repeated clamd errors park scans without spending retries"""
+        from apps.scanning import breaker
+
+        self._use_cache(settings)
+        settings.CLAMD_BREAKER_THRESHOLD = 3
+        error = {'is_infected': False, 'virus_name': None, 'status': 'error', 'error': 'Connection refused'}
+
+        first, second = self._pending('first'), self._pending('second')
+        self._scan(first, error)
+        self._scan(first, error)
+        first.refresh_from_db()
+        retries = first.scan_retry_count
+        assert retries >= 2
+        assert breaker.state() == breaker.CLOSED
+
+        # The third failure opens the breaker; this scan is parked, not retried
+        result, _ = self._scan(second, error)
+        assert result == {'status': 'parked', 'reason': 'clamd_unavailable'}
+        assert breaker.is_open()
+        second.refresh_from_db()
+        assert second.scan_status == 'pending'
+        assert second.scan_retry_count == 0
+
+        # Further scans do not contact clamd at all
+        result, scanner = self._scan(first, error)
+        assert result['status'] == 'parked'
+        scanner.scan_stream.assert_not_called()
+        first.refresh_from_db()
+        assert first.scan_retry_count == retries
+
+    def test_success_resets_failure_count(self, settings):
+        """Test that failures only open the breaker when they come in a row"""
+        from apps.scanning import breaker
+
+        self._use_cache(settings)
+        settings.CLAMD_BREAKER_THRESHOLD = 2
+        breaker.record_failure()
+        breaker.record_success()
+        assert not breaker.record_failure()
+        assert breaker.record_failure()
+        assert breaker.is_open()
+
+    def test_probe_releases_backlog_at_controlled_rate(self, settings):
+        """Test that the probe reopens scanning and releases parked scans in batches"""
+        from apps.scanning import breaker
+        from apps.scanning.tasks import clamd_probe_task
+
+        self._use_cache(settings)
+        settings.CLAMD_BREAKER_RELEASE_BATCH = 2
+        settings.SCAN_BATCH_CONCURRENCY = 1
+        for index in range(3):
+            self._pending(f'parked{index}')
+        breaker.record_failure()
+        from django.core.cache import cache
+        cache.set(breaker.STATE_KEY, breaker.OPEN)
+
+        def probe(ping):
+            with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                    patch('apps.scanning.streams.open_scan_stream', side_effect=lambda f: io.BytesIO(b'x')), \
+                    patch('apps.schematics.tasks.process_schematic_task'):
+                mock_scanner = mock_scanner_class.return_value
+                mock_scanner.ping.return_value = ping
+                mock_scanner.engine_version.return_value = None
+                mock_scanner.scan_stream.return_value = {
+                    'is_infected': False, 'virus_name': None, 'status': 'clean'
+                }
+                return clamd_probe_task()
+
+        # Still down: nothing is released
+        assert probe(False) == {'state': 'open'}
+        assert Schematic.objects.filter(scan_status='pending').count() == 3
+
+        # Back: one batch per probe, without the batch draining the rest
+        assert probe(True) == {'state': 'recovering', 'parked': 3}
+        assert Schematic.objects.filter(scan_status='clean').count() == 2
+        assert probe(True) == {'state': 'recovering', 'parked': 1}
+        assert Schematic.objects.filter(scan_status='clean').count() == 3
+        assert probe(True) == {'state': 'closed'}
+        assert breaker.state() == breaker.CLOSED
+
+
+@pytest.mark.django_db(transaction=True)
+class TestScanningBenchmark:
+    """Test the fake clamd options and the scanning benchmark command"""
+
+    def test_fake_clamd_infection_rate_is_deterministic(self):
+        """Test that the fake clamd infects about the configured share, always the same content"""
+        import hashlib
+
+        fake = FakeClamd(infection_rate=0.25)
+        try:
+            digests = [hashlib.sha256(str(index).encode()).digest() for index in range(2000)]
+            infected = [fake.is_infected(digest) for digest in digests]
+            assert 400 < sum(infected) < 600
+            assert infected == [fake.is_infected(digest) for digest in digests]
+            assert fake.is_infected(digests[0], eicar=True)
+        finally:
+            fake.stop()
+
+    def test_benchmark_reports_and_cleans_up(self):
+        """Test that every mode drains its backlog, reports percentiles and leaves nothing behind"""
+        from django.core.management import call_command
+        from apps.storage.models import FileBlob
+
+        out = io.StringIO()
+        call_command(
+            'benchmark_scanning', files=12, size=256, workers=1, batch_size=5,
+            delay=0, infection_rate=0.3, allow_live=True, stdout=out
+        )
+
+        output = out.getvalue()
+        for mode in ('file', 'batch', 'async'):
+            assert f'\n{mode}\n' in output
+        assert output.count('12 scans in') == 3
+        assert 'p99' in output
+        assert not Schematic.objects.exists()
+        assert not FileBlob.objects.exists()
+        assert not User.objects.filter(username__startswith='scan-benchmark-').exists()
+
+    def test_benchmark_refuses_live_settings(self, settings):
+        """Test that without DEBUG the benchmark only runs with --allow-live"""
+        from django.core.management import CommandError, call_command
+
+        settings.DEBUG = False
+        with pytest.raises(CommandError, match='--allow-live'):
+            call_command('benchmark_scanning', files=1)
+        assert not User.objects.filter(username__startswith='scan-benchmark-').exists()
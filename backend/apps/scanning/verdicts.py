@@ -0,0 +1,51 @@
+"""
+Scan verdict cache
+
+Verdicts are remembered per file hash and clamd engine/signature version,
+in Redis for fast hits and in the database (ScanVerdict) so they outlive
+cache evictions. A signature update changes the version, so older entries
+simply stop matching. Only definite verdicts (clean or infected) are kept.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ScanVerdict
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'scanning:verdict:{}:{}'
+
+
+def _key(file_hash, engine_version):
+    # Versions contain spaces, which memcached-style keys reject
+    return CACHE_KEY.format(engine_version.replace(' ', '_'), file_hash)
+
+
+def cached_verdict(file_hash, engine_version):
+    """Scan result remembered for this content and version, or None"""
+    if not file_hash or not engine_version:
+        return None
+    key = _key(file_hash, engine_version)
+    scan_result = cache.get(key)
+    if scan_result is not None:
+        return scan_result
+
+    verdict = ScanVerdict.objects.filter(file_hash=file_hash, engine_version=engine_version).first()
+    if verdict is None:
+        return None
+    cache.set(key, verdict.scan_result, timeout=settings.SCAN_VERDICT_CACHE_TIMEOUT)
+    return verdict.scan_result
+
+
+def store_verdict(file_hash, engine_version, scan_result):
+    """Remember a clean or infected scan result; errors are never cached"""
+    if not file_hash or not engine_version or scan_result.get('status') not in ('clean', 'infected'):
+        return
+    ScanVerdict.objects.get_or_create(
+        file_hash=file_hash,
+        engine_version=engine_version,
+        defaults={'scan_result': scan_result}
+    )
+    cache.set(_key(file_hash, engine_version), scan_result, timeout=settings.SCAN_VERDICT_CACHE_TIMEOUT)
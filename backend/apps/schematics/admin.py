@@ -2,6 +2,8 @@
 Schematic admin
 """
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 from .models import Schematic, Tag, SchematicComment, SchematicLike, SchematicImage
 
 
@@ -26,10 +28,25 @@ class SchematicAdmin(admin.ModelAdmin):
     ]
     list_filter = ['scan_status', 'is_public', 'category', 'created_at']
     search_fields = ['title', 'description', 'owner__username']
-    readonly_fields = ['id', 'file_hash', 'download_count', 'view_count', 'created_at', 'updated_at']
+    readonly_fields = [
+        'id', 'file_hash', 'blob', 'download_count', 'view_count',
+        'possible_duplicates', 'created_at', 'updated_at'
+    ]
     filter_horizontal = ['tags']
     inlines = [SchematicImageInline]
 
+    @admin.display(description='Possible duplicates')
+    def possible_duplicates(self, obj):
+        from .similarity import find_near_duplicates
+        matches = find_near_duplicates(obj) if obj.pk else []
+        if not matches:
+            return '-'
+        return format_html('<ul>{}</ul>', format_html_join('', '<li><a href="{}">{}</a> by {} ({}%)</li>', (
+            (reverse('admin:schematics_schematic_change', args=[other.pk]), other.title,
+             other.owner.username, round(similarity * 100))
+            for other, similarity in matches
+        )))
+
 
 @admin.register(SchematicComment)
 class SchematicCommentAdmin(admin.ModelAdmin):
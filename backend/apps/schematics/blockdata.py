@@ -0,0 +1,159 @@
+"""
+Vectorized block data decoding and encoding
+
+Converts between uint32 palette-index arrays and the two block array
+encodings used by schematic formats with NumPy instead of per-byte Python
+loops:
+
+- Sponge (.schem): unsigned LEB128 varints, one per block
+- Litematica (.litematic): fixed-width indices bit-packed across 64-bit longs
+"""
+import numpy as np
+
+from .nbt import NBTError
+
+# Palette indices are uint32, so a varint never needs more than 5 bytes
+MAX_VARINT_BYTES = 5
+
+# Number of packed entries unpacked per step; bounds the uint64 temporaries
+UNPACK_BATCH = 1 << 20
+
+
+def decode_varints(data, allow_partial=False):
+    """
+    Decode a buffer of unsigned varints into a uint32 array
+
+    Args:
+        data: bytes-like object or uint8 ndarray
+        allow_partial: return a trailing incomplete varint as unconsumed
+            instead of raising, for chunked decoding
+
+    Returns:
+        tuple: (values ndarray[uint32], number of bytes consumed)
+    """
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    # Leading zero bytes act as terminators so look-behind never leaves the buffer
+    padded = np.concatenate([np.zeros(MAX_VARINT_BYTES, dtype=np.uint8), buf])
+    ends = np.flatnonzero(buf < 0x80) + MAX_VARINT_BYTES
+    consumed = int(ends[-1]) + 1 - MAX_VARINT_BYTES if ends.size else 0
+    if consumed != buf.size and not allow_partial:
+        raise NBTError('Truncated varint in block data')
+
+    # Start from each terminating byte and fold in preceding continuation bytes,
+    # one byte position per step for every varint at once
+    values = padded[ends].astype(np.uint32)
+    chain = np.ones(ends.size, dtype=bool)
+    for back in range(1, MAX_VARINT_BYTES + 1):
+        previous = padded[ends - back]
+        chain &= previous >= 0x80
+        if not chain.any():
+            break
+        if back == MAX_VARINT_BYTES:
+            raise NBTError('Varint exceeds 32 bits')
+        values = np.where(chain, (values << np.uint32(7)) | (previous & 0x7F), values)
+    return values, consumed
+
+
+class VarintDecoder:
+    """Incremental varint decoder carrying partial values across chunk boundaries"""
+
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, chunk):
+        data = self._pending + chunk if self._pending else chunk
+        values, consumed = decode_varints(data, allow_partial=True)
+        self._pending = bytes(data[consumed:])
+        return values
+
+    def close(self):
+        if self._pending:
+            raise NBTError('Truncated varint in block data')
+
+
+def varint_lengths(values):
+    """Encoded size in bytes of each value"""
+    lengths = np.ones(values.size, dtype=np.uint8)
+    for shift in range(7, 7 * MAX_VARINT_BYTES, 7):
+        lengths += values >= (1 << shift)
+    return lengths
+
+
+def encode_varints(values):
+    """Encode a uint32 array as concatenated unsigned varints"""
+    values = np.asarray(values, dtype=np.uint32)
+    lengths = varint_lengths(values)
+    starts = np.concatenate([[0], np.cumsum(lengths[:-1], dtype=np.int64)])
+    out = np.empty(int(lengths.sum(dtype=np.int64)), dtype=np.uint8)
+    for byte in range(MAX_VARINT_BYTES):
+        present = lengths > byte
+        if not present.any():
+            break
+        chunk = (values[present] >> np.uint32(7 * byte)) & 0x7F
+        more = lengths[present] > byte + 1
+        out[starts[present] + byte] = chunk | (more.astype(np.uint32) << 7)
+    return out.tobytes()
+
+
+def bits_for_palette(palette_size):
+    """Entry width Litematica uses for a palette of the given size (minimum 2 bits)"""
+    return max(2, (palette_size - 1).bit_length())
+
+
+def unpack_bits(data, bits, count):
+    """
+    Unpack `count` entries of `bits` width from a Litematica long array
+
+    Entries are packed LSB first and may straddle two longs.
+
+    Args:
+        data: raw big-endian bytes of the NBT long array
+        bits: width of each entry
+        count: number of entries (the region volume)
+
+    Returns:
+        ndarray[uint32] of palette indices
+    """
+    if not 1 <= bits <= 32:
+        raise NBTError(f'Invalid packed entry width {bits}')
+    longs = np.frombuffer(data, dtype='>u8')
+    if longs.size * 64 < count * bits:
+        raise NBTError('Packed block array is shorter than the region volume')
+    # Native byte order plus one zero long so straddling reads never go out of bounds
+    longs = np.concatenate([longs.astype(np.uint64), np.zeros(1, dtype=np.uint64)])
+
+    mask = np.uint64((1 << bits) - 1)
+    out = np.empty(count, dtype=np.uint32)
+    for begin in range(0, count, UNPACK_BATCH):
+        end = min(count, begin + UNPACK_BATCH)
+        bit_index = np.arange(begin, end, dtype=np.uint64) * np.uint64(bits)
+        start = bit_index >> np.uint64(6)
+        offset = bit_index & np.uint64(63)
+        values = longs[start] >> offset
+        straddle = offset > np.uint64(64 - bits)
+        if straddle.any():
+            values[straddle] |= longs[start[straddle] + np.uint64(1)] << (np.uint64(64) - offset[straddle])
+        out[begin:end] = values & mask
+    return out
+
+
+def pack_bits(values, bits):
+    """
+    Pack entries of `bits` width into Litematica longs, LSB first
+
+    Returns the big-endian bytes of ceil(len(values) * bits / 64) longs.
+    Packing a volume in pieces gives the same bytes as long as every piece
+    but the last holds a multiple of 64 entries.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    longs = np.zeros((values.size * bits + 63) // 64, dtype=np.uint64)
+    for begin in range(0, values.size, UNPACK_BATCH):
+        batch = values[begin:begin + UNPACK_BATCH]
+        bit_index = np.arange(begin, begin + batch.size, dtype=np.uint64) * np.uint64(bits)
+        start = (bit_index >> np.uint64(6)).astype(np.intp)
+        offset = bit_index & np.uint64(63)
+        np.bitwise_or.at(longs, start, batch << offset)
+        straddle = offset > np.uint64(64 - bits)
+        if straddle.any():
+            np.bitwise_or.at(longs, start[straddle] + 1, batch[straddle] >> (np.uint64(64) - offset[straddle]))
+    return longs.astype('>u8').tobytes()
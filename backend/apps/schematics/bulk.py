@@ -0,0 +1,182 @@
+"""
+Bulk upload of schematics from a zip archive
+
+Members are streamed out of the archive one at a time, hashed while they
+are spooled and stored in quarantine, then every schematic of the archive
+is created with one bulk_create. Metadata comes from a manifest:
+
+    {
+        "defaults": {"is_public": true, "tag_names": ["castle"]},
+        "files": {"builds/keep.schem": {"title": "The Keep"}}
+    }
+
+Members without an entry are titled after their file name. Problems with
+one member (type, size, metadata, corruption) are reported for that
+member and the others are still imported.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from apps.storage.blobs import acquire_blob
+from apps.storage.promotion import save_to_quarantine
+from .models import Schematic, Tag
+from .serializers import UploadFinalizeSerializer
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+# What a damaged, truncated or unsupported member raises while it is read
+MEMBER_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError)
+
+
+class ArchiveError(Exception):
+    """The archive as a whole cannot be imported"""
+
+
+def schematic_members(archive):
+    """Members of the archive that are meant as schematics (no folders or macOS metadata)"""
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+        and not os.path.basename(info.filename).startswith('._')
+    ]
+
+
+def _member_metadata(manifest, name):
+    data = {'title': os.path.splitext(os.path.basename(name))[0]}
+    data.update(manifest.get('defaults') or {})
+    data.update((manifest.get('files') or {}).get(name) or {})
+    return UploadFinalizeSerializer(data=data)
+
+
+def _size_error(info):
+    if info.file_size < 1:
+        return 'The file is empty'
+    if info.file_size > settings.MAX_UPLOAD_SIZE:
+        return f"File size must not exceed {settings.MAX_UPLOAD_SIZE / (1024 * 1024)}MB"
+    return None
+
+
+def _extract(archive, info):
+    """Spool one member, hashing it; its CRC is checked once it is read to the end"""
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    sha256 = hashlib.sha256()
+    try:
+        with archive.open(info) as member:
+            while True:
+                data = member.read(READ_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+                spool.write(data)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, sha256.hexdigest()
+
+
+def import_archive(owner, archive, manifest):
+    """
+    Store the schematics of a zip archive and create their rows
+
+    Returns:
+        (schematics, members): the created schematics, and one report per
+        member in archive order with its name, status (created, skipped or
+        failed), schematic id or error
+    """
+    try:
+        archive = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise ArchiveError('Not a zip archive')
+
+    with archive:
+        infos = schematic_members(archive)
+        if len(infos) > settings.BULK_UPLOAD_MAX_FILES:
+            raise ArchiveError(f'Archives may hold at most {settings.BULK_UPLOAD_MAX_FILES} files')
+        # Declared sizes bound what extraction can write: members never inflate past them
+        if sum(info.file_size for info in infos) > settings.BULK_UPLOAD_MAX_SIZE:
+            raise ArchiveError(
+                f"Archive contents must not exceed {settings.BULK_UPLOAD_MAX_SIZE / (1024 * 1024)}MB"
+            )
+
+        members, stored = [], []
+        for info in infos:
+            report = {'name': info.filename}
+            members.append(report)
+            if os.path.splitext(info.filename)[1].lower() not in settings.ALLOWED_SCHEMATIC_EXTENSIONS:
+                report.update(status='skipped', error='Not a schematic file')
+                continue
+            error = _size_error(info)
+            if error:
+                report.update(status='failed', error=error)
+                continue
+            metadata = _member_metadata(manifest, info.filename)
+            if not metadata.is_valid():
+                report.update(status='failed', error=metadata.errors)
+                continue
+            try:
+                spool, file_hash = _extract(archive, info)
+            except MEMBER_ERRORS as e:
+                report.update(status='failed', error=f'Unreadable member: {e}')
+                continue
+            with spool:
+                name = save_to_quarantine(File(spool, name=os.path.basename(info.filename)))
+            stored.append((report, metadata.validated_data, name, info.file_size, file_hash))
+            logger.info(f"Bulk upload by {owner.username}: stored {info.filename}")
+
+    try:
+        schematics = _create_schematics(owner, stored)
+    except Exception:
+        for _, _, name, _, _ in stored:
+            default_storage.delete(name)
+        raise
+    for (report, _, _, _, _), schematic in zip(stored, schematics):
+        report.update(status='created', id=str(schematic.id))
+    return schematics, members
+
+
+@transaction.atomic
+def _create_schematics(owner, stored):
+    """One bulk_create for every stored member; content already scanned clean shares its blob"""
+    schematics, tag_names = [], []
+    for _, fields, name, file_size, file_hash in stored:
+        fields = dict(fields)
+        tag_names.append([tag_name.lower() for tag_name in fields.pop('tag_names', [])])
+        blob = acquire_blob(file_hash)
+        if blob:
+            schematics.append(Schematic(
+                owner=owner, file=blob.file.name, file_size=file_size, file_hash=file_hash, blob=blob,
+                scan_status='clean', scan_result=blob.scan_result, scanned_at=blob.scanned_at, **fields
+            ))
+            transaction.on_commit(lambda name=name: default_storage.delete(name))
+        else:
+            # Kept in quarantine until the batch scan promotes it
+            schematics.append(Schematic(
+                owner=owner, file=name, file_size=file_size, file_hash=file_hash, **fields
+            ))
+    Schematic.objects.bulk_create(schematics)
+
+    tags = {}
+    for tag_name in {tag_name for names in tag_names for tag_name in names}:
+        tags[tag_name], _ = Tag.objects.get_or_create(
+            name=tag_name, defaults={'slug': tag_name.replace(' ', '-')}
+        )
+    Schematic.tags.through.objects.bulk_create([
+        Schematic.tags.through(schematic_id=schematic.id, tag_id=tags[tag_name].id)
+        for schematic, names in zip(schematics, tag_names)
+        for tag_name in set(names)
+    ])
+
+    owner.storage_used += sum(file_size for _, _, _, file_size, _ in stored)
+    owner.save()
+    return schematics
@@ -0,0 +1,321 @@
+"""
+Schematic format conversion
+
+Writes a decoded BlockVolume as Sponge v2 (.schem), Litematica (.litematic)
+or MCEdit (.schematic). Block arrays are encoded and written in batches
+straight into the gzip stream. Only blocks are converted; block entities
+and entities are not carried over.
+
+Converted files are cached in the schematic storage under
+converted/<file_hash>/, so identical content is converted once. Formats that
+embed the title get one copy per title. The folder is deleted together with
+the blob of its content.
+"""
+import gzip
+import hashlib
+import re
+import tempfile
+import time
+
+import numpy as np
+from django.core.files import File
+
+from .blockdata import bits_for_palette, encode_varints, pack_bits, varint_lengths
+from .formats import AIR, AIR_BLOCKS, block_name, read_blocks
+from .legacy import LEGACY_BLOCK_NAMES
+from .nbt import (
+    NBTWriter, TAG_BYTE_ARRAY, TAG_COMPOUND, TAG_INT, TAG_INT_ARRAY, TAG_LONG, TAG_LONG_ARRAY,
+    TAG_SHORT, TAG_STRING,
+)
+
+# Download format -> file extension
+CONVERSION_FORMATS = {
+    'schem': '.schem',
+    'litematic': '.litematic',
+    'schematic': '.schematic',
+}
+
+# Decoded source format -> download format that needs no conversion
+NATIVE_FORMATS = {
+    'sponge': 'schem',
+    'litematic': 'litematic',
+    'mcedit': 'schematic',
+}
+
+# Minecraft 1.12.2, the last version with numeric block ids
+LEGACY_DATA_VERSION = 1343
+
+# Minecraft 1.13, the first version with flattened block names
+FLATTENING_DATA_VERSION = 1519
+
+# Formats whose writer embeds the schematic title
+TITLED_FORMATS = {'litematic'}
+
+CONVERTED_DIR = 'converted'
+
+LITEMATIC_VERSION = 6
+
+# Entries encoded per step; a multiple of 64 keeps packed longs aligned
+ENCODE_BATCH = 1 << 20
+
+# zlib's default; level 9 (gzip's default) is several times slower on block arrays
+COMPRESS_LEVEL = 6
+
+# Converted files larger than this spill from memory to disk while writing
+SPOOL_SIZE = 16 * 1024 * 1024
+
+LEGACY_BLOCK_IDS = {f'minecraft:{name}': block_id for block_id, name in LEGACY_BLOCK_NAMES.items()}
+LEGACY_PLACEHOLDER = re.compile(r'^minecraft:legacy_(\d+)$')
+
+
+class ConversionError(Exception):
+    """Raised when a schematic cannot be represented in the target format"""
+
+
+def parse_state(state):
+    """Split minecraft:stairs[facing=north,half=top] into a name and a property dict"""
+    name, _, properties = state.partition('[')
+    properties = properties.rstrip(']')
+    return name, dict(
+        prop.split('=', 1) for prop in properties.split(',') if '=' in prop
+    )
+
+
+def _remap(volume, order):
+    """Palette reordered as `order` (unique states) plus a lookup from old to new indices"""
+    index = {state: position for position, state in enumerate(order)}
+    lookup = np.array([index[state] for state in volume.palette] or [0], dtype=np.uint32)
+    return order, lookup
+
+
+def _batches(volume, lookup):
+    """Palette indices in (y, z, x) order, remapped, ENCODE_BATCH at a time"""
+    flat = volume.blocks.reshape(-1)
+    for begin in range(0, flat.size, ENCODE_BATCH):
+        yield lookup[flat[begin:begin + ENCODE_BATCH]]
+
+
+def _check_dimensions(volume, limit):
+    for axis, size in (('width', volume.width), ('height', volume.height), ('length', volume.length)):
+        if size > limit:
+            raise ConversionError(f'{axis} {size} exceeds the {limit} block limit of the target format')
+
+
+def is_legacy(volume):
+    """Whether the volume holds pre-1.13 block names"""
+    if volume.format == 'mcedit':
+        return True
+    return volume.data_version is not None and volume.data_version < FLATTENING_DATA_VERSION
+
+
+def data_version(volume):
+    """DataVersion written for the volume, 1.12.2 or 1.13 for files that do not record one"""
+    if volume.data_version:
+        return volume.data_version
+    return LEGACY_DATA_VERSION if is_legacy(volume) else FLATTENING_DATA_VERSION
+
+
+def write_sponge(volume, stream, name=''):
+    """
+    Sponge schematic version 2
+
+    Sponge palettes hold flattened (1.13+) names. Pre-1.13 blocks are not
+    written: their data values are not decoded, so variants such as wool
+    colors cannot be mapped to flattened names.
+    """
+    if is_legacy(volume):
+        raise ConversionError('Pre-1.13 blocks cannot be written as Sponge, which needs 1.13+ block names')
+    _check_dimensions(volume, 0xFFFF)
+    palette, lookup = _remap(volume, list(dict.fromkeys(volume.palette)))
+    writer = NBTWriter(stream)
+
+    writer.begin_compound('Schematic')
+    writer.write_tag(TAG_INT, 'Version', 2)
+    writer.write_tag(TAG_INT, 'DataVersion', data_version(volume))
+    # Dimensions are unsigned shorts stored in a signed tag
+    for tag, size in (('Width', volume.width), ('Height', volume.height), ('Length', volume.length)):
+        writer.write_tag(TAG_SHORT, tag, size - 0x10000 if size > 0x7FFF else size)
+    writer.write_tag(TAG_INT_ARRAY, 'Offset', [0, 0, 0])
+    writer.write_tag(TAG_INT, 'PaletteMax', len(palette))
+    writer.write_tag(TAG_COMPOUND, 'Palette', {state: (TAG_INT, index) for index, state in enumerate(palette)})
+
+    size = sum(int(varint_lengths(batch).sum(dtype=np.int64)) for batch in _batches(volume, lookup))
+    writer.begin_array(TAG_BYTE_ARRAY, 'BlockData', size)
+    for batch in _batches(volume, lookup):
+        writer.write_raw(encode_varints(batch))
+
+    writer.write_empty_list('BlockEntities')
+    writer.end_compound()
+
+
+def write_litematic(volume, stream, name=''):
+    """Single-region Litematica schematic"""
+    # Litematica expects air at palette index 0
+    order = [AIR] + [state for state in dict.fromkeys(volume.palette) if state != AIR]
+    palette, lookup = _remap(volume, order)
+    bits = bits_for_palette(len(palette))
+    total = volume.width * volume.height * volume.length
+    now = int(time.time() * 1000)
+    size = {'x': (TAG_INT, volume.width), 'y': (TAG_INT, volume.height), 'z': (TAG_INT, volume.length)}
+    writer = NBTWriter(stream)
+
+    writer.begin_compound('')
+    writer.write_tag(TAG_INT, 'MinecraftDataVersion', data_version(volume))
+    writer.write_tag(TAG_INT, 'Version', LITEMATIC_VERSION)
+    writer.write_tag(TAG_COMPOUND, 'Metadata', {
+        'Name': (TAG_STRING, name),
+        'Author': (TAG_STRING, ''),
+        'Description': (TAG_STRING, ''),
+        'RegionCount': (TAG_INT, 1),
+        'TotalVolume': (TAG_INT, total),
+        'TotalBlocks': (TAG_INT, volume.block_count),
+        'TimeCreated': (TAG_LONG, now),
+        'TimeModified': (TAG_LONG, now),
+        'EnclosingSize': (TAG_COMPOUND, size),
+    })
+
+    writer.begin_compound('Regions')
+    writer.begin_compound(name or 'Main')
+    writer.write_tag(TAG_COMPOUND, 'Position', {'x': (TAG_INT, 0), 'y': (TAG_INT, 0), 'z': (TAG_INT, 0)})
+    writer.write_tag(TAG_COMPOUND, 'Size', size)
+    writer.begin_list('BlockStatePalette', TAG_COMPOUND, len(palette))
+    for state in palette:
+        block, properties = parse_state(state)
+        entry = {'Name': (TAG_STRING, block)}
+        if properties:
+            entry['Properties'] = (TAG_COMPOUND, {key: (TAG_STRING, value) for key, value in properties.items()})
+        writer.write_payload(TAG_COMPOUND, entry)
+
+    writer.begin_array(TAG_LONG_ARRAY, 'BlockStates', (total * bits + 63) // 64)
+    for batch in _batches(volume, lookup):
+        writer.write_raw(pack_bits(batch, bits))
+
+    for tag in ('TileEntities', 'Entities', 'PendingBlockTicks', 'PendingFluidTicks'):
+        writer.write_empty_list(tag)
+    writer.end_compound()
+    writer.end_compound()
+    writer.end_compound()
+
+
+def legacy_block_id(state):
+    """Numeric pre-1.13 id of a block state, or None"""
+    name = block_name(state)
+    if name in AIR_BLOCKS:
+        return 0
+    match = LEGACY_PLACEHOLDER.match(name)
+    if match:
+        return int(match.group(1))
+    return LEGACY_BLOCK_IDS.get(name)
+
+
+def write_mcedit(volume, stream, name=''):
+    """
+    MCEdit (pre-1.13) schematic
+
+    Blocks are matched by name only and written with data value 0, so
+    variants such as wool colors collapse. Modern blocks without a numeric
+    id cannot be written.
+    """
+    _check_dimensions(volume, 0x7FFF)
+    ids = [legacy_block_id(state) for state in volume.palette]
+    missing = sorted({block_name(state) for state, block_id in zip(volume.palette, ids) if block_id is None})
+    if missing:
+        raise ConversionError(
+            f'{len(missing)} block types have no pre-1.13 id, e.g. {", ".join(missing[:5])}'
+        )
+    lookup = np.array(ids or [0], dtype=np.uint32)
+    total = volume.width * volume.height * volume.length
+    writer = NBTWriter(stream)
+
+    writer.begin_compound('Schematic')
+    writer.write_tag(TAG_SHORT, 'Width', volume.width)
+    writer.write_tag(TAG_SHORT, 'Height', volume.height)
+    writer.write_tag(TAG_SHORT, 'Length', volume.length)
+    writer.write_tag(TAG_STRING, 'Materials', 'Alpha')
+
+    writer.begin_array(TAG_BYTE_ARRAY, 'Blocks', total)
+    for batch in _batches(volume, lookup):
+        writer.write_raw((batch & 0xFF).astype(np.uint8).tobytes())
+
+    writer.begin_array(TAG_BYTE_ARRAY, 'Data', total)
+    for begin in range(0, total, ENCODE_BATCH):
+        writer.write_raw(bytes(min(ENCODE_BATCH, total - begin)))
+
+    if int(lookup.max()) > 0xFF:
+        # High id nibbles, two blocks per byte, even index in the upper half
+        writer.begin_array(TAG_BYTE_ARRAY, 'AddBlocks', (total + 1) // 2)
+        for batch in _batches(volume, lookup):
+            high = (batch >> 8).astype(np.uint8)
+            if high.size % 2:
+                high = np.append(high, np.uint8(0))
+            writer.write_raw(((high[0::2] << 4) | high[1::2]).tobytes())
+
+    writer.write_empty_list('Entities')
+    writer.write_empty_list('TileEntities')
+    writer.end_compound()
+
+
+WRITERS = {
+    'schem': write_sponge,
+    'litematic': write_litematic,
+    'schematic': write_mcedit,
+}
+
+
+def convert(volume, target, stream, name=''):
+    """Write a BlockVolume to `stream` as a gzip compressed file of the target format"""
+    with gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=COMPRESS_LEVEL) as compressed:
+        WRITERS[target](volume, compressed, name=name)
+
+
+def converted_name(file_hash, target, title=''):
+    """Storage name of the cached conversion of some content"""
+    extension = CONVERSION_FORMATS[target]
+    if target in TITLED_FORMATS:
+        key = hashlib.sha256(title.encode()).hexdigest()[:16]
+        return f'{CONVERTED_DIR}/{file_hash}/{key}{extension}'
+    return f'{CONVERTED_DIR}/{file_hash}/content{extension}'
+
+
+def delete_converted(storage, file_hash):
+    """Delete every cached conversion of some content"""
+    directory = f'{CONVERTED_DIR}/{file_hash}'
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file_name in files:
+        storage.delete(f'{directory}/{file_name}')
+
+
+def converted_file(schematic, target):
+    """
+    Storage name of the schematic's file in the target format
+
+    Returns the original file name when the file already is in that format,
+    judged by its extension so the file is not decoded; otherwise converts
+    once and serves the cached copy afterwards.
+
+    Raises:
+        NBTError: if the source file cannot be decoded
+        ConversionError: if the content does not fit the target format
+    """
+    if schematic.file.name.lower().endswith(CONVERSION_FORMATS[target]):
+        return schematic.file.name
+
+    storage = schematic.file.storage
+    name = converted_name(schematic.file_hash, target, schematic.title)
+    if storage.exists(name):
+        return name
+
+    with schematic.file.open('rb') as file_obj:
+        volume = read_blocks(file_obj)
+    # Content saved under another format's extension
+    if NATIVE_FORMATS.get(volume.format) == target:
+        return schematic.file.name
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as output:
+        convert(volume, target, output, name=schematic.title)
+        del volume
+        output.seek(0)
+        return storage.save(name, File(output))
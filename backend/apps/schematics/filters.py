@@ -0,0 +1,45 @@
+"""
+Schematic filters
+"""
+import django_filters
+from django.db.models import Sum
+
+from .histogram import normalize_block_query
+from .models import Schematic, SchematicBlockCount
+
+
+class SchematicFilter(django_filters.FilterSet):
+    """
+    Filters for the schematic list
+
+    ?contains=minecraft:redstone_block&min_count=100 matches schematics with
+    at least 100 redstone blocks. A bare block id matches every state of that
+    block; a full state such as minecraft:oak_stairs[facing=north,...] only
+    matches that state.
+    """
+    contains = django_filters.CharFilter(method='filter_contains')
+    min_count = django_filters.NumberFilter(method='filter_min_count', min_value=1)
+
+    class Meta:
+        model = Schematic
+        fields = ['category', 'scan_status', 'is_public', 'owner']
+
+    def filter_contains(self, queryset, name, value):
+        block = normalize_block_query(value)
+        if not block:
+            return queryset
+
+        if '[' in block:
+            entries = SchematicBlockCount.objects.filter(block_state__name=block)
+        else:
+            entries = SchematicBlockCount.objects.filter(block_state__block=block)
+
+        min_count = self.form.cleaned_data.get('min_count') or 1
+        matching = entries.order_by().values('schematic').annotate(
+            total=Sum('count')
+        ).filter(total__gte=min_count).values('schematic')
+        return queryset.filter(id__in=matching)
+
+    def filter_min_count(self, queryset, name, value):
+        # Only meaningful together with `contains`, which reads it from cleaned_data
+        return queryset
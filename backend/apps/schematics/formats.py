@@ -0,0 +1,589 @@
+"""
+Schematic format readers
+
+Supports Sponge (.schem), MCEdit/legacy WorldEdit (.schematic), Litematica
+(.litematic) and vanilla structure (.nbt) files. The format is sniffed from
+the tag layout rather than trusted from the file extension, and the tag
+stream is walked once.
+
+read_metadata() never loads block arrays: they are decoded chunk by chunk
+into a palette histogram. read_blocks() decodes them into a full uint32
+palette-index volume for downstream analysis. Both read under the
+SCHEMATIC_MAX_* NBTLimits unless given others, which also cap the number of
+blocks in a decoded volume.
+"""
+import bisect
+import zlib
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.conf import settings
+
+from .blockdata import VarintDecoder, bits_for_palette, unpack_bits
+from .legacy import legacy_block_state
+from .nbt import (
+    NBTReader, NBTError, NBTLimitError, NBTLimits, open_nbt,
+    TAG_BYTE_ARRAY, TAG_COMPOUND, TAG_INT, TAG_LIST, TAG_LONG_ARRAY, TAG_SHORT,
+)
+
+AIR_BLOCKS = frozenset({'minecraft:air', 'minecraft:cave_air', 'minecraft:void_air'})
+AIR = 'minecraft:air'
+
+# (DataVersion, release) pairs used to label uploads with a Minecraft version
+DATA_VERSIONS = [
+    (169, '1.9'), (510, '1.10'), (819, '1.11'), (1139, '1.12'), (1343, '1.12.2'),
+    (1519, '1.13'), (1631, '1.13.2'), (1952, '1.14'), (1976, '1.14.4'),
+    (2225, '1.15'), (2230, '1.15.2'), (2566, '1.16'), (2586, '1.16.5'),
+    (2724, '1.17'), (2730, '1.17.1'), (2860, '1.18'), (2975, '1.18.2'),
+    (3105, '1.19'), (3120, '1.19.2'), (3218, '1.19.3'), (3337, '1.19.4'),
+    (3463, '1.20'), (3465, '1.20.1'), (3578, '1.20.2'), (3700, '1.20.4'),
+    (3839, '1.20.6'), (3953, '1.21'), (3955, '1.21.1'), (4082, '1.21.3'),
+    (4189, '1.21.4'), (4325, '1.21.5'),
+]
+_DATA_VERSION_KEYS = [data_version for data_version, _ in DATA_VERSIONS]
+
+
+def ingest_limits():
+    """NBTLimits for uploaded schematics, from settings"""
+    return NBTLimits(
+        max_expansion_ratio=settings.SCHEMATIC_MAX_EXPANSION_RATIO,
+        max_inflated_size=settings.SCHEMATIC_MAX_INFLATED_SIZE,
+        max_depth=settings.SCHEMATIC_MAX_NBT_DEPTH,
+        max_array_length=settings.SCHEMATIC_MAX_ARRAY_LENGTH,
+    )
+
+
+def minecraft_version_for(data_version):
+    """Map a DataVersion to the newest release at or below it"""
+    if data_version is None:
+        return ''
+    index = bisect.bisect_right(_DATA_VERSION_KEYS, data_version)
+    if index == 0:
+        return ''
+    return DATA_VERSIONS[index - 1][1]
+
+
+def block_name(state):
+    """Strip block state properties, e.g. minecraft:oak_stairs[facing=north] -> minecraft:oak_stairs"""
+    return state.split('[', 1)[0]
+
+
+def count_non_air(palette, counts):
+    """Sum a per-palette-index histogram, leaving out air"""
+    return int(sum(
+        int(count) for index, count in enumerate(counts)
+        if count and block_name(palette[index] if index < len(palette) else '') not in AIR_BLOCKS
+    ))
+
+
+def _format_state(entry):
+    """Render a {Name, Properties} palette compound as a block state string"""
+    name = entry.get('Name', AIR)
+    properties = entry.get('Properties')
+    if properties:
+        name += '[' + ','.join(f'{key}={value}' for key, value in sorted(properties.items())) + ']'
+    return name
+
+
+@dataclass
+class BlockVolume:
+    """
+    Decoded block content of a schematic
+
+    `blocks` holds palette indices in (y, z, x) order, i.e. shape
+    (height, length, width). `counts` is the per-index histogram when the
+    decoder already computed it.
+    """
+    format: str
+    palette: list
+    blocks: np.ndarray
+    data_version: int = None
+    counts: np.ndarray = field(default=None, repr=False)
+
+    @property
+    def width(self):
+        return self.blocks.shape[2]
+
+    @property
+    def height(self):
+        return self.blocks.shape[0]
+
+    @property
+    def length(self):
+        return self.blocks.shape[1]
+
+    def histogram(self):
+        """Number of blocks per palette index"""
+        if self.counts is not None:
+            return self.counts
+        return np.bincount(self.blocks.ravel(), minlength=len(self.palette))
+
+    @property
+    def block_count(self):
+        return count_non_air(self.palette, self.histogram())
+
+
+def decode_litematic_region(region):
+    """
+    Decode one Litematica region
+
+    Args:
+        region: dict with 'size' (x, y, z), 'palette' (list of states) and
+            'states' (raw big-endian bytes of the BlockStates long array)
+
+    Returns:
+        ndarray[uint32] of region palette indices shaped (y, z, x)
+    """
+    size_x, size_y, size_z = (abs(value) for value in region['size'])
+    volume = size_x * size_y * size_z
+    palette_size = max(len(region['palette']), 1)
+    indices = unpack_bits(region['states'], bits_for_palette(palette_size), volume)
+    if volume and int(indices.max()) >= palette_size:
+        raise NBTError('Block data references an index outside the palette')
+    return indices.reshape(size_y, size_z, size_x)
+
+
+def region_origin(region):
+    """Minimum corner of a Litematica region; negative sizes extend towards -inf"""
+    return tuple(
+        position + size + 1 if size < 0 else position
+        for position, size in zip(region['position'], region['size'])
+    )
+
+
+def litematic_bounds(regions):
+    """
+    Region origins, minimum corner and (height, length, width) of the box
+    enclosing all Litematica regions
+    """
+    if not regions:
+        raise NBTError('Litematica file has no regions')
+
+    origins = [region_origin(region) for region in regions]
+    low = [min(origin[axis] for origin in origins) for axis in range(3)]
+    high = [
+        max(origin[axis] + abs(region['size'][axis]) for origin, region in zip(origins, regions))
+        for axis in range(3)
+    ]
+    width, height, length = (high[axis] - low[axis] for axis in range(3))
+    return origins, low, (height, length, width)
+
+
+def merge_litematic_palettes(regions):
+    """
+    Shared palette of all Litematica regions, with air at index 0
+
+    Returns:
+        tuple: (palette list, per-region uint32 lookup from region to shared indices)
+    """
+    palette = [AIR]
+    palette_index = {AIR: 0}
+    lookups = []
+    for region in regions:
+        for state in region['palette']:
+            if state not in palette_index:
+                palette_index[state] = len(palette)
+                palette.append(state)
+        lookups.append(np.array([palette_index[state] for state in region['palette']] or [0], dtype=np.uint32))
+    return palette, lookups
+
+
+def region_offset(origin, low):
+    """(y, z, x) index of a region's minimum corner in the assembled volume"""
+    x, y, z = (origin[axis] - low[axis] for axis in range(3))
+    return y, z, x
+
+
+def assemble_litematic(regions, decoded):
+    """Merge decoded Litematica regions into one volume with a shared palette"""
+    origins, low, shape = litematic_bounds(regions)
+    palette, lookups = merge_litematic_palettes(regions)
+    blocks = np.zeros(shape, dtype=np.uint32)
+
+    for origin, lookup, indices in zip(origins, lookups, decoded):
+        region_blocks = lookup[indices]
+        y, z, x = region_offset(origin, low)
+        size_y, size_z, size_x = region_blocks.shape
+        target = blocks[y:y + size_y, z:z + size_z, x:x + size_x]
+        placed = region_blocks != 0
+        target[placed] = region_blocks[placed]
+
+    return palette, blocks
+
+
+class _SchematicWalker:
+    """
+    Single pass over the root compound of a schematic
+
+    With load_blocks=False block arrays are only histogrammed; with
+    load_blocks=True they are decoded and kept for read_blocks().
+    """
+
+    def __init__(self, reader, load_blocks=False):
+        self.reader = reader
+        self.load_blocks = load_blocks
+        self.format = None
+        self.width = self.height = self.length = None
+        self.data_version = None
+        self.block_count = None
+        # palette index -> block state
+        self.palette = {}
+        # palette index -> number of blocks
+        self.index_counts = np.zeros(0, dtype=np.int64)
+        # Decoded arrays, only populated with load_blocks
+        self._index_chunks = []
+        self._legacy_ids = None
+        self._legacy_add = None
+        self._structure_blocks = []
+        self.regions = []
+
+    def walk(self, container='root'):
+        reader = self.reader
+        for tag_type, name in reader.iter_compound():
+            handler = getattr(self, f'_visit_{name}', None)
+            if handler is None or not handler(tag_type, container):
+                reader.skip_payload(tag_type)
+
+    def _count(self, indices):
+        if indices.size:
+            # bincount allocates up to the largest index; palettes are never that large
+            self._check_blocks(int(indices.max()) + 1, 'Palette size')
+        counts = np.bincount(indices)
+        if counts.size > self.index_counts.size:
+            counts[:self.index_counts.size] += self.index_counts
+            self.index_counts = counts
+        else:
+            self.index_counts[:counts.size] += counts
+
+    def _check_blocks(self, count, kind='Block volume'):
+        limit = self.reader.limits.max_array_length
+        if limit is not None and count > limit:
+            raise NBTLimitError(f'{kind} {count} exceeds {limit}')
+
+    def _read_array_bytes(self, tag_type):
+        length = self.reader.read_array_length()
+        return b''.join(self.reader.iter_array_chunks(tag_type, length))
+
+    # Shared keys
+
+    def _visit_Width(self, tag_type, container):
+        return self._read_dimension(tag_type, 'width')
+
+    def _visit_Height(self, tag_type, container):
+        return self._read_dimension(tag_type, 'height')
+
+    def _visit_Length(self, tag_type, container):
+        return self._read_dimension(tag_type, 'length')
+
+    def _read_dimension(self, tag_type, attr):
+        if tag_type != TAG_SHORT:
+            return False
+        # Dimensions are stored as signed shorts but are unsigned by spec
+        setattr(self, attr, self.reader.read_payload(tag_type) & 0xFFFF)
+        return True
+
+    def _visit_DataVersion(self, tag_type, container):
+        if tag_type != TAG_INT:
+            return False
+        self.data_version = self.reader.read_payload(tag_type)
+        return True
+
+    _visit_MinecraftDataVersion = _visit_DataVersion
+
+    # Sponge (.schem) v1-v3
+
+    def _visit_Schematic(self, tag_type, container):
+        # Sponge v3 nests everything under a "Schematic" compound
+        if tag_type != TAG_COMPOUND:
+            return False
+        self.walk('schematic')
+        return True
+
+    def _visit_Palette(self, tag_type, container):
+        if tag_type != TAG_COMPOUND:
+            return False
+        self.palette = {index: state for state, index in self.reader.read_payload(tag_type).items()}
+        return True
+
+    def _visit_BlockData(self, tag_type, container):
+        if tag_type != TAG_BYTE_ARRAY:
+            return False
+        self.format = 'sponge'
+        length = self.reader.read_array_length()
+        decoder = VarintDecoder()
+        for chunk in self.reader.iter_array_chunks(tag_type, length):
+            indices = decoder.feed(chunk)
+            if self.load_blocks:
+                self._index_chunks.append(indices)
+            else:
+                self._count(indices)
+        decoder.close()
+        return True
+
+    def _visit_Data(self, tag_type, container):
+        # Sponge v3 block data lives in Blocks.Data; MCEdit Data holds block metadata nibbles
+        if container != 'blocks':
+            return False
+        return self._visit_BlockData(tag_type, container)
+
+    def _visit_Blocks(self, tag_type, container):
+        if tag_type == TAG_COMPOUND:
+            self.walk('blocks')
+            return True
+        if tag_type != TAG_BYTE_ARRAY:
+            return False
+        # MCEdit: one byte block id per voxel, 0 is air
+        self.format = 'mcedit'
+        if self.load_blocks:
+            self._legacy_ids = np.frombuffer(self._read_array_bytes(tag_type), dtype=np.uint8)
+            return True
+        length = self.reader.read_array_length()
+        non_air = 0
+        for chunk in self.reader.iter_array_chunks(tag_type, length):
+            non_air += len(chunk) - chunk.count(0)
+        self.block_count = non_air
+        return True
+
+    def _visit_AddBlocks(self, tag_type, container):
+        # Upper 4 bits of MCEdit block ids above 255, two voxels per byte
+        if tag_type != TAG_BYTE_ARRAY or not self.load_blocks:
+            return False
+        self._legacy_add = np.frombuffer(self._read_array_bytes(tag_type), dtype=np.uint8)
+        return True
+
+    # Litematica (.litematic)
+
+    def _visit_Metadata(self, tag_type, container):
+        if tag_type != TAG_COMPOUND or container != 'root':
+            return False
+        metadata = self.reader.read_payload(tag_type)
+        size = metadata.get('EnclosingSize')
+        if isinstance(size, dict):
+            self.format = 'litematic'
+            self.width = abs(size.get('x', 0))
+            self.height = abs(size.get('y', 0))
+            self.length = abs(size.get('z', 0))
+            self.block_count = metadata.get('TotalBlocks')
+        return True
+
+    def _visit_Regions(self, tag_type, container):
+        if tag_type != TAG_COMPOUND:
+            return False
+        self.format = 'litematic'
+        if not self.load_blocks:
+            return False
+        for region_type, _ in self.reader.iter_compound():
+            if region_type == TAG_COMPOUND:
+                self.regions.append(self._read_region())
+            else:
+                self.reader.skip_payload(region_type)
+        return True
+
+    def _read_region(self):
+        region = {'position': (0, 0, 0), 'size': (0, 0, 0), 'palette': [], 'states': b''}
+        for tag_type, name in self.reader.iter_compound():
+            if name in ('Position', 'Size') and tag_type == TAG_COMPOUND:
+                value = self.reader.read_payload(tag_type)
+                region[name.lower()] = (value.get('x', 0), value.get('y', 0), value.get('z', 0))
+            elif name == 'BlockStatePalette' and tag_type == TAG_LIST:
+                region['palette'] = [_format_state(entry) for entry in self.reader.read_payload(tag_type)]
+            elif name == 'BlockStates' and tag_type == TAG_LONG_ARRAY:
+                region['states'] = self._read_array_bytes(tag_type)
+            else:
+                self.reader.skip_payload(tag_type)
+        return region
+
+    # Vanilla structure (.nbt)
+
+    def _visit_size(self, tag_type, container):
+        if tag_type != TAG_LIST:
+            return False
+        size = self.reader.read_payload(tag_type)
+        if len(size) == 3:
+            self.format = 'structure'
+            self.width, self.height, self.length = size
+        return True
+
+    def _visit_palette(self, tag_type, container):
+        if tag_type != TAG_LIST:
+            return False
+        self.palette = dict(enumerate(self._read_structure_palette()))
+        return True
+
+    def _visit_palettes(self, tag_type, container):
+        # Structures with random variants (shipwrecks) carry several palettes; use the first
+        if tag_type != TAG_LIST:
+            return False
+        element_type, length = self.reader.read_list_header()
+        for index in range(length):
+            if index == 0 and element_type == TAG_LIST:
+                self.palette = dict(enumerate(self._read_structure_palette()))
+            else:
+                self.reader.skip_payload(element_type)
+        return True
+
+    def _read_structure_palette(self):
+        element_type, length = self.reader.read_list_header()
+        return [_format_state(self.reader.read_payload(element_type)) for _ in range(length)]
+
+    def _visit_blocks(self, tag_type, container):
+        if tag_type != TAG_LIST:
+            return False
+        element_type, length = self.reader.read_list_header()
+        states = []
+        for _ in range(length):
+            if element_type != TAG_COMPOUND:
+                self.reader.skip_payload(element_type)
+                continue
+            state = pos = None
+            for child_type, name in self.reader.iter_compound():
+                if name == 'state' and child_type == TAG_INT:
+                    state = self.reader.read_payload(child_type)
+                elif name == 'pos' and child_type == TAG_LIST and self.load_blocks:
+                    pos = self.reader.read_payload(child_type)
+                else:
+                    self.reader.skip_payload(child_type)
+            if state is None:
+                continue
+            states.append(state)
+            if self.load_blocks and pos is not None and len(pos) == 3:
+                self._structure_blocks.append((*pos, state))
+        if states and not self.load_blocks:
+            self._count(np.array(states, dtype=np.uint32))
+        return True
+
+    # Results
+
+    def palette_list(self):
+        """Palette as a dense list indexed by palette index"""
+        size = max(self.palette, default=-1) + 1
+        palette = [AIR] * size
+        for index, state in self.palette.items():
+            palette[index] = state
+        return palette
+
+    def metadata(self):
+        if self.format is None:
+            raise NBTError('Unrecognized schematic format')
+
+        block_count = self.block_count
+        if block_count is None and self.index_counts.size:
+            block_count = count_non_air(self.palette_list(), self.index_counts)
+
+        return {
+            'format': self.format,
+            'width': self.width,
+            'height': self.height,
+            'length': self.length,
+            'block_count': block_count,
+            'data_version': self.data_version,
+            'minecraft_version': minecraft_version_for(self.data_version),
+        }
+
+    def volume(self, workers=1):
+        if self.format is None:
+            raise NBTError('Unrecognized schematic format')
+
+        if self.format == 'litematic':
+            height, length, width = litematic_bounds(self.regions)[2]
+            self._check_blocks(height * length * width)
+            if workers > 1:
+                from .parallel import decode_regions
+                assembled = decode_regions(self.regions, workers)
+                if assembled is not None:
+                    palette, blocks, counts = assembled
+                    return BlockVolume(self.format, palette, blocks, self.data_version, counts)
+            palette, blocks = assemble_litematic(
+                self.regions, [decode_litematic_region(region) for region in self.regions]
+            )
+            return BlockVolume(self.format, palette, blocks, self.data_version)
+
+        shape = (self.height or 0, self.length or 0, self.width or 0)
+        volume = shape[0] * shape[1] * shape[2]
+        self._check_blocks(volume)
+
+        if self.format == 'sponge':
+            indices = np.concatenate(self._index_chunks) if self._index_chunks else np.zeros(0, np.uint32)
+            palette = self.palette_list()
+            if indices.size and int(indices.max()) >= len(palette):
+                raise NBTError('Block data references an index outside the palette')
+        elif self.format == 'mcedit':
+            ids = self._legacy_ids.astype(np.uint32) if self._legacy_ids is not None else np.zeros(0, np.uint32)
+            if self._legacy_add is not None:
+                high = np.empty(self._legacy_add.size * 2, dtype=np.uint32)
+                high[0::2] = self._legacy_add >> 4
+                high[1::2] = self._legacy_add & 0x0F
+                ids[:min(ids.size, high.size)] |= high[:ids.size] << 8
+            # Re-index the numeric ids into a compact palette
+            unique_ids, indices = np.unique(ids, return_inverse=True)
+            indices = indices.astype(np.uint32)
+            palette = [legacy_block_state(int(block_id)) for block_id in unique_ids]
+        else:
+            palette = self.palette_list()
+            if AIR not in palette:
+                palette.append(AIR)
+            indices = np.full(volume, palette.index(AIR), dtype=np.uint32)
+            if self._structure_blocks:
+                entries = np.array(self._structure_blocks, dtype=np.int64)
+                x, y, z, state = entries.T
+                if (
+                    (x < 0).any() or (y < 0).any() or (z < 0).any()
+                    or (x >= shape[2]).any() or (y >= shape[0]).any() or (z >= shape[1]).any()
+                    or (state < 0).any() or (state >= len(palette)).any()
+                ):
+                    raise NBTError('Structure block outside of the declared size or palette')
+                indices[(y * shape[1] + z) * shape[2] + x] = state
+
+        if indices.size != volume:
+            raise NBTError(f'Block data holds {indices.size} entries, expected {volume}')
+        return BlockVolume(self.format, palette, indices.reshape(shape), self.data_version)
+
+
+def _walk(fileobj, load_blocks, limits=None):
+    limits = limits or ingest_limits()
+    reader = NBTReader(open_nbt(fileobj, limits), limits=limits)
+    walker = _SchematicWalker(reader, load_blocks=load_blocks)
+    try:
+        reader.read_root()
+        walker.walk()
+    except (EOFError, zlib.error, OSError) as e:
+        # Corrupt or truncated gzip member
+        raise NBTError(f'Unreadable schematic data: {e}') from e
+    return walker
+
+
+def read_metadata(fileobj, limits=None):
+    """
+    Extract dimensions, block count and version from a schematic file
+
+    Returns:
+        dict: {
+            'format': 'sponge' | 'mcedit' | 'litematic' | 'structure',
+            'width': int, 'height': int, 'length': int,
+            'block_count': int or None,
+            'data_version': int or None,
+            'minecraft_version': str
+        }
+
+    Raises:
+        NBTError: if the file is not a readable schematic
+        NBTLimitError: if reading it would exceed `limits`
+    """
+    return _walk(fileobj, load_blocks=False, limits=limits).metadata()
+
+
+def read_blocks(fileobj, limits=None, workers=1):
+    """
+    Decode the full block content of a schematic
+
+    With workers > 1, the regions of large multi-region Litematica files are
+    decoded in a process pool (see parallel.py).
+
+    Returns:
+        BlockVolume
+
+    Raises:
+        NBTError: if the file is not a readable schematic
+        NBTLimitError: if reading it would exceed `limits`
+    """
+    return _walk(fileobj, load_blocks=True, limits=limits).volume(workers)
@@ -0,0 +1,67 @@
+"""
+Block material histograms
+
+Each clean schematic's block-state histogram is stored as interned
+BlockState ids plus counts (SchematicBlockCount rows), indexed on
+(block_state, count) so "contains at least N of block X" is a single
+index range scan.
+"""
+import numpy as np
+from django.db import transaction
+
+from .formats import AIR_BLOCKS, block_name
+from .models import BlockState, SchematicBlockCount
+
+MAX_STATE_LENGTH = BlockState._meta.get_field('name').max_length
+
+
+def block_histogram(volume):
+    """
+    Count the non-air blocks of a BlockVolume per block state
+
+    Returns:
+        dict: {block state: count}
+    """
+    counts = volume.histogram()
+    histogram = {}
+    for index in np.flatnonzero(counts):
+        state = volume.palette[index]
+        if block_name(state) in AIR_BLOCKS:
+            continue
+        if len(state) > MAX_STATE_LENGTH:
+            # Pathologically long property lists collapse onto the bare block
+            state = block_name(state)[:MAX_STATE_LENGTH]
+        histogram[state] = histogram.get(state, 0) + int(counts[index])
+    return histogram
+
+
+def intern_block_states(names):
+    """Return {name: BlockState id} for the given state names, creating missing ones"""
+    ids = dict(BlockState.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        BlockState.objects.bulk_create(
+            [BlockState(name=name, block=block_name(name)) for name in missing],
+            ignore_conflicts=True
+        )
+        ids.update(BlockState.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+@transaction.atomic
+def save_block_histogram(schematic, histogram):
+    """Replace the stored histogram of a schematic"""
+    ids = intern_block_states(list(histogram))
+    SchematicBlockCount.objects.filter(schematic=schematic).delete()
+    SchematicBlockCount.objects.bulk_create([
+        SchematicBlockCount(schematic=schematic, block_state_id=ids[name], count=count)
+        for name, count in histogram.items()
+    ])
+
+
+def normalize_block_query(value):
+    """Default the namespace of a block query, e.g. redstone_block -> minecraft:redstone_block"""
+    value = value.strip().lower()
+    if value and ':' not in block_name(value):
+        value = f'minecraft:{value}'
+    return value
@@ -0,0 +1,120 @@
+"""
+Benchmark vectorized block data decoding against a per-byte Python loop
+
+Usage:
+    python manage.py benchmark_blockdata --blocks 2000000 --palette 300
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.schematics.blockdata import bits_for_palette, decode_varints, unpack_bits
+
+
+def decode_varints_naive(data):
+    """Reference per-byte varint decoder"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def unpack_bits_naive(data, bits, count):
+    """Reference per-entry Litematica bit unpacker"""
+    longs = [int.from_bytes(data[i:i + 8], 'big') for i in range(0, len(data), 8)]
+    mask = (1 << bits) - 1
+    values = []
+    for index in range(count):
+        bit_index = index * bits
+        start, offset = bit_index >> 6, bit_index & 63
+        value = longs[start] >> offset
+        if offset + bits > 64:
+            value |= longs[start + 1] << (64 - offset)
+        values.append(value & mask)
+    return values
+
+
+def encode_varints(indices):
+    """Encode palette indices the way Sponge BlockData stores them"""
+    out = bytearray()
+    for index in indices.tolist():
+        while index >= 0x80:
+            out.append((index & 0x7F) | 0x80)
+            index >>= 7
+        out.append(index)
+    return bytes(out)
+
+
+def pack_bits(indices, bits):
+    """Pack palette indices the way Litematica BlockStates stores them (big-endian longs)"""
+    longs = [0] * ((indices.size * bits + 63) // 64)
+    for index, value in enumerate(indices.tolist()):
+        bit_index = index * bits
+        start, offset = bit_index >> 6, bit_index & 63
+        longs[start] |= (value << offset) & 0xFFFFFFFFFFFFFFFF
+        if offset + bits > 64:
+            longs[start + 1] |= value >> (64 - offset)
+    return b''.join(long.to_bytes(8, 'big') for long in longs)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark NumPy block data decoding against naive Python loops'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocks', type=int, default=1_000_000, help='Number of blocks to decode')
+        parser.add_argument('--palette', type=int, default=300, help='Palette size')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per decoder (best is reported)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        count = options['blocks']
+        palette_size = options['palette']
+        rng = np.random.default_rng(options['seed'])
+        indices = rng.integers(0, palette_size, size=count, dtype=np.uint32)
+
+        varints = encode_varints(indices)
+        bits = bits_for_palette(palette_size)
+        longs = pack_bits(indices, bits)
+
+        self.stdout.write(f'{count} blocks, palette {palette_size} ({bits} bits per packed entry)')
+        self._compare(
+            'Sponge varints',
+            lambda: decode_varints_naive(varints),
+            lambda: decode_varints(varints)[0],
+            indices, options['repeat']
+        )
+        self._compare(
+            'Litematica longs',
+            lambda: unpack_bits_naive(longs, bits, count),
+            lambda: unpack_bits(longs, bits, count),
+            indices, options['repeat']
+        )
+
+    def _compare(self, label, naive, vectorized, expected, repeat):
+        naive_time, naive_result = self._time(naive, repeat)
+        fast_time, fast_result = self._time(vectorized, repeat)
+        if not np.array_equal(np.asarray(naive_result, dtype=np.uint32), expected) or \
+                not np.array_equal(fast_result, expected):
+            self.stderr.write(self.style.ERROR(f'{label}: decoded values do not match'))
+            return
+        self.stdout.write(
+            f'{label:18} naive {naive_time * 1000:9.1f} ms   numpy {fast_time * 1000:8.1f} ms   '
+            f'speedup {naive_time / fast_time:6.1f}x'
+        )
+
+    @staticmethod
+    def _time(func, repeat):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.26 on 2026-10-16 22:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schematics', '0004_add_schematic_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('block', models.CharField(db_index=True, max_length=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SchematicBlockCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField()),
+            ],
+            options={
+                'ordering': ['-count'],
+            },
+        ),
+        migrations.AddField(
+            model_name='schematicblockcount',
+            name='block_state',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schematic_counts', to='schematics.blockstate'),
+        ),
+        migrations.AddField(
+            model_name='schematicblockcount',
+            name='schematic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_counts', to='schematics.schematic'),
+        ),
+        migrations.AddIndex(
+            model_name='schematicblockcount',
+            index=models.Index(fields=['block_state', 'count'], name='schematics__block_s_828e3c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='schematicblockcount',
+            unique_together={('schematic', 'block_state')},
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.26 on 2026-10-16 22:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0001_initial'),
+        ('schematics', '0005_add_block_histogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schematic',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='schematics', to='storage.fileblob'),
+        ),
+    ]
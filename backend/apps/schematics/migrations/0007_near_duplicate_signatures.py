@@ -0,0 +1,40 @@
+# Generated by Django 4.2.26 on 2026-10-16 22:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schematics', '0006_schematic_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchematicLSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SchematicSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minhash', models.BinaryField()),
+                ('shingle_count', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='schematicsignature',
+            name='schematic',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='signature', to='schematics.schematic'),
+        ),
+        migrations.AddField(
+            model_name='schematiclshbucket',
+            name='schematic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='schematics.schematic'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.26 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schematics', '0007_near_duplicate_signatures'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='schematic',
+            name='scan_status',
+            field=models.CharField(choices=[('pending', 'Pending Scan'), ('scanning', 'Scanning'), ('clean', 'Clean'), ('infected', 'Infected'), ('error', 'Scan Error'), ('rejected', 'Rejected')], db_index=True, default='pending', max_length=20),
+        ),
+    ]
@@ -31,6 +31,7 @@ class Schematic(models.Model):
         ('clean', 'Clean'),
         ('infected', 'Infected'),
         ('error', 'Scan Error'),
+        ('rejected', 'Rejected'),
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -45,6 +46,13 @@ class Schematic(models.Model):
     )
     file_size = models.BigIntegerField()
     file_hash = models.CharField(max_length=64, db_index=True)  # SHA-256 hash
+    blob = models.ForeignKey(
+        'storage.FileBlob',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='schematics'
+    )  # Shared clean copy of the file, see apps.storage.blobs
 
     # Schematic metadata
     minecraft_version = models.CharField(max_length=20, blank=True)
@@ -102,6 +110,52 @@ class Schematic(models.Model):
         return None
 
 
+class BlockState(models.Model):
+    """Interned block state names shared by all schematic histograms"""
+    name = models.CharField(max_length=255, unique=True)  # e.g. minecraft:oak_stairs[facing=north]
+    block = models.CharField(max_length=128, db_index=True)  # e.g. minecraft:oak_stairs
+
+    def __str__(self):
+        return self.name
+
+
+class SchematicBlockCount(models.Model):
+    """One histogram entry: how many blocks of a state a schematic contains"""
+    schematic = models.ForeignKey(Schematic, on_delete=models.CASCADE, related_name='block_counts')
+    block_state = models.ForeignKey(BlockState, on_delete=models.CASCADE, related_name='schematic_counts')
+    count = models.IntegerField()
+
+    class Meta:
+        ordering = ['-count']
+        unique_together = ['schematic', 'block_state']
+        indexes = [
+            models.Index(fields=['block_state', 'count']),
+        ]
+
+    def __str__(self):
+        return f"{self.schematic.title}: {self.count} x {self.block_state.name}"
+
+
+class SchematicSignature(models.Model):
+    """MinHash signature of a schematic's block content, see apps.schematics.similarity"""
+    schematic = models.OneToOneField(Schematic, on_delete=models.CASCADE, related_name='signature')
+    minhash = models.BinaryField()  # little-endian uint64 values
+    shingle_count = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Signature of {self.schematic.title}"
+
+
+class SchematicLSHBucket(models.Model):
+    """One LSH band bucket of a signature; schematics sharing a bucket are duplicate candidates"""
+    schematic = models.ForeignKey(Schematic, on_delete=models.CASCADE, related_name='lsh_buckets')
+    bucket = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"{self.schematic.title}: {self.bucket}"
+
+
 class SchematicVersion(models.Model):
     """Version history for schematics"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
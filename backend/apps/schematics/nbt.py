@@ -0,0 +1,342 @@
+"""
+Streaming NBT reader and writer
+
+Walks the tag stream of a (optionally gzip compressed) NBT file incrementally.
+Large arrays are skipped or consumed in fixed-size chunks so the decompressed
+payload is never held in memory as a whole; the writer likewise emits array
+payloads chunk by chunk.
+
+Uploads are untrusted, so reading can be bounded by NBTLimits: the inflated
+size (absolute and relative to the compressed size), the nesting depth and
+the length of arrays and lists. Exceeding one raises NBTLimitError as soon as
+the offending bytes or header are seen.
+"""
+import gzip
+import struct
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Fixed payload sizes of the scalar tags
+_SCALAR_FORMATS = {
+    TAG_BYTE: struct.Struct('>b'),
+    TAG_SHORT: struct.Struct('>h'),
+    TAG_INT: struct.Struct('>i'),
+    TAG_LONG: struct.Struct('>q'),
+    TAG_FLOAT: struct.Struct('>f'),
+    TAG_DOUBLE: struct.Struct('>d'),
+}
+
+# Element width in bytes of the array tags
+ARRAY_ITEM_SIZES = {
+    TAG_BYTE_ARRAY: 1,
+    TAG_INT_ARRAY: 4,
+    TAG_LONG_ARRAY: 8,
+}
+
+_UNSIGNED_SHORT = struct.Struct('>H')
+_INT = struct.Struct('>i')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Inflated bytes always allowed before the expansion ratio applies, so small
+# files of very uniform builds are not rejected for compressing well
+INFLATE_ALLOWANCE = 16 * 1024 * 1024
+
+
+class NBTError(Exception):
+    """Raised when an NBT stream is malformed or truncated"""
+
+
+class NBTLimitError(NBTError):
+    """Raised when an NBT stream exceeds the configured NBTLimits"""
+
+
+@dataclass(frozen=True)
+class NBTLimits:
+    """Resource limits for reading untrusted NBT; None disables a limit"""
+    max_expansion_ratio: float = None
+    max_inflated_size: int = None
+    max_depth: int = None
+    max_array_length: int = None
+
+    def inflate_limit(self, compressed_size):
+        """Maximum number of inflated bytes for a compressed stream of the given size"""
+        limits = []
+        if self.max_expansion_ratio is not None:
+            limits.append(max(int(compressed_size * self.max_expansion_ratio), INFLATE_ALLOWANCE))
+        if self.max_inflated_size is not None:
+            limits.append(self.max_inflated_size)
+        return min(limits, default=None)
+
+
+class BoundedInflate:
+    """Gzip reader that raises NBTLimitError once more than `max_size` bytes were inflated"""
+
+    def __init__(self, fileobj, max_size):
+        self.inflater = gzip.GzipFile(fileobj=fileobj, mode='rb')
+        self.max_size = max_size
+        self.inflated = 0
+
+    def read(self, size=-1):
+        # Never inflate more than one byte past the limit, even for read()
+        allowed = self.max_size - self.inflated + 1
+        data = self.inflater.read(allowed if size is None or size < 0 else min(size, allowed))
+        self.inflated += len(data)
+        if self.inflated > self.max_size:
+            raise NBTLimitError(f'Decompressed data exceeds {self.max_size} bytes')
+        return data
+
+    def close(self):
+        self.inflater.close()
+
+
+def open_nbt(fileobj, limits=None):
+    """
+    Wrap a binary file object so that it yields decompressed NBT bytes
+
+    Gzip compressed files (the common case for schematics) are inflated
+    lazily, bounded by `limits` if given; uncompressed files are read as-is.
+    """
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic != GZIP_MAGIC:
+        return fileobj
+    max_size = None
+    if limits is not None:
+        compressed_size = fileobj.seek(0, 2)
+        fileobj.seek(0)
+        max_size = limits.inflate_limit(compressed_size)
+    if max_size is None:
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return BoundedInflate(fileobj, max_size)
+
+
+class NBTReader:
+    """
+    Incremental reader over an NBT byte stream
+
+    Compound and list payloads are not materialized; callers walk them with
+    iter_compound() / read_list_header() and decide per tag whether to read,
+    skip or descend into the payload.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, limits=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.limits = limits or NBTLimits()
+        self.depth = 0
+
+    @contextmanager
+    def nested(self):
+        """Track one level of compound or list nesting"""
+        self.depth += 1
+        try:
+            if self.limits.max_depth is not None and self.depth > self.limits.max_depth:
+                raise NBTLimitError(f'NBT nesting exceeds {self.limits.max_depth} levels')
+            yield
+        finally:
+            self.depth -= 1
+
+    def check_length(self, length, kind):
+        if self.limits.max_array_length is not None and length > self.limits.max_array_length:
+            raise NBTLimitError(f'{kind} of {length} elements exceeds {self.limits.max_array_length}')
+
+    def read_exact(self, size):
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise NBTError('Unexpected end of NBT stream')
+        return data
+
+    def read_tag_type(self):
+        return self.read_exact(1)[0]
+
+    def read_string(self):
+        length = _UNSIGNED_SHORT.unpack(self.read_exact(2))[0]
+        return self.read_exact(length).decode('utf-8', errors='replace')
+
+    def read_root(self):
+        """Read the root tag header, returning (tag_type, name)"""
+        tag_type = self.read_tag_type()
+        if tag_type != TAG_COMPOUND:
+            raise NBTError(f'Root tag must be a compound, got type {tag_type}')
+        return tag_type, self.read_string()
+
+    def iter_compound(self):
+        """
+        Yield (tag_type, name) for every entry of the current compound
+
+        The caller must consume the entry payload (read, skip or descend)
+        before advancing the iterator.
+        """
+        with self.nested():
+            while True:
+                tag_type = self.read_tag_type()
+                if tag_type == TAG_END:
+                    return
+                yield tag_type, self.read_string()
+
+    def read_list_header(self):
+        """Read a list payload header, returning (element_type, length)"""
+        element_type = self.read_tag_type()
+        length = _INT.unpack(self.read_exact(4))[0]
+        if length < 0:
+            raise NBTError('Negative list length')
+        self.check_length(length, 'List')
+        return element_type, length
+
+    def read_array_length(self):
+        length = _INT.unpack(self.read_exact(4))[0]
+        if length < 0:
+            raise NBTError('Negative array length')
+        self.check_length(length, 'Array')
+        return length
+
+    def iter_array_chunks(self, tag_type, length):
+        """Yield the raw big-endian bytes of an array payload in bounded chunks"""
+        remaining = length * ARRAY_ITEM_SIZES[tag_type]
+        # Keep chunks aligned to whole elements
+        step = max(self.chunk_size - self.chunk_size % ARRAY_ITEM_SIZES[tag_type], ARRAY_ITEM_SIZES[tag_type])
+        while remaining:
+            size = min(step, remaining)
+            yield self.read_exact(size)
+            remaining -= size
+
+    def read_payload(self, tag_type):
+        """
+        Fully read a tag payload into Python values
+
+        Only meant for small values (scalars, strings, palettes, metadata
+        compounds); use iter_array_chunks() for block arrays.
+        """
+        if tag_type in _SCALAR_FORMATS:
+            fmt = _SCALAR_FORMATS[tag_type]
+            return fmt.unpack(self.read_exact(fmt.size))[0]
+        if tag_type == TAG_STRING:
+            return self.read_string()
+        if tag_type in ARRAY_ITEM_SIZES:
+            length = self.read_array_length()
+            data = b''.join(self.iter_array_chunks(tag_type, length))
+            if tag_type == TAG_BYTE_ARRAY:
+                return data
+            code = 'i' if tag_type == TAG_INT_ARRAY else 'q'
+            return list(struct.unpack(f'>{length}{code}', data))
+        if tag_type == TAG_LIST:
+            element_type, length = self.read_list_header()
+            with self.nested():
+                return [self.read_payload(element_type) for _ in range(length)]
+        if tag_type == TAG_COMPOUND:
+            return {name: self.read_payload(child_type) for child_type, name in self.iter_compound()}
+        raise NBTError(f'Unknown tag type {tag_type}')
+
+    def skip_payload(self, tag_type):
+        """Skip over a tag payload without materializing it"""
+        if tag_type in _SCALAR_FORMATS:
+            self._skip_bytes(_SCALAR_FORMATS[tag_type].size)
+        elif tag_type == TAG_STRING:
+            self._skip_bytes(_UNSIGNED_SHORT.unpack(self.read_exact(2))[0])
+        elif tag_type in ARRAY_ITEM_SIZES:
+            self._skip_bytes(self.read_array_length() * ARRAY_ITEM_SIZES[tag_type])
+        elif tag_type == TAG_LIST:
+            element_type, length = self.read_list_header()
+            if element_type in _SCALAR_FORMATS:
+                self._skip_bytes(length * _SCALAR_FORMATS[element_type].size)
+            else:
+                with self.nested():
+                    for _ in range(length):
+                        self.skip_payload(element_type)
+        elif tag_type == TAG_COMPOUND:
+            for child_type, _ in self.iter_compound():
+                self.skip_payload(child_type)
+        elif tag_type != TAG_END:
+            raise NBTError(f'Unknown tag type {tag_type}')
+
+    def _skip_bytes(self, size):
+        while size:
+            step = min(size, self.chunk_size)
+            self.read_exact(step)
+            size -= step
+
+
+class NBTWriter:
+    """
+    Incremental writer producing an NBT byte stream
+
+    Compounds are opened and closed explicitly. Array tags can be written
+    whole or, for block data, as a header followed by write_raw() chunks.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write_string(self, value):
+        data = value.encode('utf-8')
+        self.stream.write(_UNSIGNED_SHORT.pack(len(data)))
+        self.stream.write(data)
+
+    def write_header(self, tag_type, name):
+        self.stream.write(bytes([tag_type]))
+        self.write_string(name)
+
+    def begin_compound(self, name=''):
+        self.write_header(TAG_COMPOUND, name)
+
+    def end_compound(self):
+        self.stream.write(bytes([TAG_END]))
+
+    def write_tag(self, tag_type, name, value):
+        """Write a complete scalar, string, array or compound (dict) tag"""
+        self.write_header(tag_type, name)
+        self.write_payload(tag_type, value)
+
+    def write_payload(self, tag_type, value):
+        if tag_type in _SCALAR_FORMATS:
+            self.stream.write(_SCALAR_FORMATS[tag_type].pack(value))
+        elif tag_type == TAG_STRING:
+            self.write_string(value)
+        elif tag_type in ARRAY_ITEM_SIZES:
+            code = {TAG_BYTE_ARRAY: 'b', TAG_INT_ARRAY: 'i', TAG_LONG_ARRAY: 'q'}[tag_type]
+            data = value if isinstance(value, (bytes, bytearray)) else struct.pack(f'>{len(value)}{code}', *value)
+            self.stream.write(_INT.pack(len(data) // ARRAY_ITEM_SIZES[tag_type]))
+            self.stream.write(data)
+        elif tag_type == TAG_COMPOUND:
+            # dict of name -> (tag_type, value)
+            for name, (child_type, child) in value.items():
+                self.write_tag(child_type, name, child)
+            self.end_compound()
+        else:
+            raise NBTError(f'Cannot write tag type {tag_type}')
+
+    def write_empty_list(self, name, element_type=TAG_COMPOUND):
+        self.write_header(TAG_LIST, name)
+        self.stream.write(bytes([element_type]))
+        self.stream.write(_INT.pack(0))
+
+    def begin_list(self, name, element_type, length):
+        """Start a list; the caller writes `length` payloads with write_payload()"""
+        self.write_header(TAG_LIST, name)
+        self.stream.write(bytes([element_type]))
+        self.stream.write(_INT.pack(length))
+
+    def begin_array(self, tag_type, name, length):
+        """Start an array of `length` elements; the caller streams the payload with write_raw()"""
+        self.write_header(tag_type, name)
+        self.stream.write(_INT.pack(length))
+
+    def write_raw(self, data):
+        self.stream.write(data)
@@ -0,0 +1,126 @@
+"""
+Parallel decoding of multi-region Litematica files
+
+Regions are spread over a set of worker processes, balanced by block count,
+and each worker unpacks its regions straight into one shared-memory volume.
+Per-region histograms go to a second shared array, one row per worker, so
+nothing decoded is pickled on the way back. Workers are forked, so the raw
+packed BlockStates are inherited rather than sent.
+
+Starting processes costs tens of milliseconds, so files with a single region
+or fewer than PARALLEL_MIN_BLOCKS blocks are decoded in process. Regions
+whose boxes overlap are also decoded in process, where later regions win
+deterministically.
+
+Workers are billiard processes (Celery's multiprocessing fork): the standard
+library refuses to start children from daemonic prefork workers, and
+billiard's Pool is slow to shut down.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+from billiard import Process
+
+from .formats import decode_litematic_region, litematic_bounds, merge_litematic_palettes, region_offset
+
+PARALLEL_MIN_BLOCKS = 4 * 1024 * 1024
+
+
+def _boxes_overlap(boxes):
+    """Whether any two (offset, shape) boxes intersect"""
+    for index, (offset, shape) in enumerate(boxes):
+        for other_offset, other_shape in boxes[index + 1:]:
+            if all(
+                start < other_start + other_size and other_start < start + size
+                for start, size, other_start, other_size in zip(offset, shape, other_offset, other_shape)
+            ):
+                return True
+    return False
+
+
+def _balance(sizes, workers):
+    """Assign item indices to workers, largest first onto the least loaded"""
+    groups = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for index in sorted(range(len(sizes)), key=lambda item: sizes[item], reverse=True):
+        target = loads.index(min(loads))
+        groups[target].append(index)
+        loads[target] += sizes[index]
+    return [group for group in groups if group]
+
+
+def _decode_group(blocks_name, shape, counts_name, row, palette_size, jobs):
+    """Worker: decode regions into the shared volume and add their histograms to one counts row"""
+    blocks_shm = shared_memory.SharedMemory(name=blocks_name)
+    counts_shm = shared_memory.SharedMemory(name=counts_name)
+    try:
+        blocks = np.ndarray(shape, dtype=np.uint32, buffer=blocks_shm.buf)
+        counts = np.ndarray((palette_size,), dtype=np.int64, buffer=counts_shm.buf, offset=row * palette_size * 8)
+        for region, lookup, (y, z, x) in jobs:
+            region_blocks = lookup[decode_litematic_region(region)]
+            size_y, size_z, size_x = region_blocks.shape
+            blocks[y:y + size_y, z:z + size_z, x:x + size_x] = region_blocks
+            counts += np.bincount(region_blocks.ravel(), minlength=palette_size)
+        # Release the views before closing the mappings
+        del blocks, counts
+    finally:
+        blocks_shm.close()
+        counts_shm.close()
+
+
+def decode_regions(regions, workers):
+    """
+    Assemble Litematica regions using up to `workers` processes
+
+    Returns:
+        tuple: (palette, uint32 blocks (y, z, x), per-index counts), or None
+        when the file is not worth decoding in parallel, not safe to, or a
+        worker failed; the caller then decodes in process, which also
+        surfaces the error
+    """
+    if workers < 2 or len(regions) < 2:
+        return None
+    origins, low, shape = litematic_bounds(regions)
+    total = shape[0] * shape[1] * shape[2]
+    if total < PARALLEL_MIN_BLOCKS:
+        return None
+
+    offsets = [region_offset(origin, low) for origin in origins]
+    sizes = [tuple(abs(region['size'][axis]) for axis in (1, 2, 0)) for region in regions]
+    if _boxes_overlap(list(zip(offsets, sizes))):
+        return None
+
+    palette, lookups = merge_litematic_palettes(regions)
+    groups = _balance([size[0] * size[1] * size[2] for size in sizes], workers)
+    # New shared memory is zero-filled, i.e. air outside the regions
+    blocks_shm = shared_memory.SharedMemory(create=True, size=total * 4)
+    counts_shm = shared_memory.SharedMemory(create=True, size=len(groups) * len(palette) * 8)
+    try:
+        processes = [
+            Process(
+                target=_decode_group,
+                args=(
+                    blocks_shm.name, shape, counts_shm.name, row, len(palette),
+                    [(regions[index], lookups[index], offsets[index]) for index in group],
+                )
+            )
+            for row, group in enumerate(groups)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            return None
+
+        blocks = np.ndarray(shape, dtype=np.uint32, buffer=blocks_shm.buf).copy()
+        counts = np.ndarray((len(groups), len(palette)), dtype=np.int64, buffer=counts_shm.buf).sum(axis=0)
+    finally:
+        blocks_shm.close()
+        blocks_shm.unlink()
+        counts_shm.close()
+        counts_shm.unlink()
+
+    # Index 0 is air, which also fills the space between regions
+    counts[0] = total - counts[1:].sum()
+    return palette, blocks, counts
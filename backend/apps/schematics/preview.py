@@ -0,0 +1,192 @@
+"""
+Binary 3D preview levels of detail
+
+Each clean schematic gets a few LOD grids (see SCHEMATIC_PREVIEW_LODS), each
+stored as one object in the schematic storage. A cell holds the dominant
+color group of the blocks it covers. Layout, all little-endian:
+
+    header      HEADER struct: magic, format version, level, factor,
+                height, length, width (in cells), palette size, chunk size
+    palette     palette size x RGB bytes; entry 0 is empty space
+    chunk table chunk count x (offset, byte length) uint32 pairs, offsets
+                relative to the start of the chunk data
+    chunk data  per chunk: (palette index, run length) uint16 pairs run-length
+                encoding its cells in (y, z, x) order; empty chunks have no data
+
+Chunks are chunk_size^3 cells (smaller along the far edges) in (y, z, x)
+order, so a viewer can fetch the header and table with one Range request
+and then only the chunks it needs.
+"""
+import struct
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .rendering import cell_bins, color_groups, lod_shape
+
+MAGIC = b'SCPV'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 16
+HEADER = struct.Struct('<4sBBHHHHHB')
+TABLE_ENTRY = struct.Struct('<II')
+
+
+def dominant_groups(volume, factor, cells, lookup, groups):
+    """
+    LOD grid of the most common visible color group per cell
+
+    Returns:
+        uint16 ndarray (y, z, x); 0 where a cell has no visible blocks
+    """
+    grid = np.zeros(cells, dtype=np.uint16)
+    for cell_y, z_start, z_stop, counts in cell_bins(volume.blocks, factor, cells, lookup, groups):
+        visible = counts[..., 1:]
+        dominant = visible.argmax(axis=-1) + 1
+        grid[cell_y, z_start:z_stop] = np.where(visible.any(axis=-1), dominant, 0)
+    return grid
+
+
+def encode_runs(cells):
+    """Run-length encode a chunk as (value, length) uint16 pairs"""
+    flat = cells.ravel()
+    if not flat.any():
+        return b''
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    runs = np.empty((starts.size, 2), dtype='<u2')
+    runs[:, 0] = flat[starts]
+    runs[:, 1] = np.diff(np.append(starts, flat.size))
+    return runs.tobytes()
+
+
+def encode_lod(grid, level, factor, colors):
+    """
+    Serialize one LOD grid
+
+    Returns:
+        tuple: (bytes, offset of the chunk data, number of chunks)
+    """
+    height, length, width = grid.shape
+    palette = np.asarray(colors, dtype=np.uint8).tobytes()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, level, factor, height, length, width, len(colors), CHUNK_SIZE)
+
+    table = []
+    chunks = []
+    offset = 0
+    for y in range(0, height, CHUNK_SIZE):
+        for z in range(0, length, CHUNK_SIZE):
+            for x in range(0, width, CHUNK_SIZE):
+                data = encode_runs(grid[y:y + CHUNK_SIZE, z:z + CHUNK_SIZE, x:x + CHUNK_SIZE])
+                table.append(TABLE_ENTRY.pack(offset, len(data)))
+                chunks.append(data)
+                offset += len(data)
+
+    data_offset = len(header) + len(palette) + 4 + len(table) * TABLE_ENTRY.size
+    body = b''.join([header, palette, struct.pack('<I', len(table))] + table + chunks)
+    return body, data_offset, len(table)
+
+
+def decode_lod(data):
+    """
+    Parse a serialized LOD
+
+    Returns:
+        dict with level, factor, colors (n, 3) uint8 and grid (y, z, x) uint16
+    """
+    magic, version, level, factor, height, length, width, palette_size, chunk_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a schematic preview')
+
+    position = HEADER.size
+    colors = np.frombuffer(data, dtype=np.uint8, count=palette_size * 3, offset=position).reshape(-1, 3)
+    position += palette_size * 3
+    (count,) = struct.unpack_from('<I', data, position)
+    position += 4
+    table = [TABLE_ENTRY.unpack_from(data, position + i * TABLE_ENTRY.size) for i in range(count)]
+    data_offset = position + count * TABLE_ENTRY.size
+
+    grid = np.zeros((height, length, width), dtype=np.uint16)
+    entries = iter(table)
+    for y in range(0, height, chunk_size):
+        for z in range(0, length, chunk_size):
+            for x in range(0, width, chunk_size):
+                offset, size = next(entries)
+                if not size:
+                    continue
+                runs = np.frombuffer(data, dtype='<u2', count=size // 2, offset=data_offset + offset).reshape(-1, 2)
+                view = grid[y:y + chunk_size, z:z + chunk_size, x:x + chunk_size]
+                view[...] = np.repeat(runs[:, 0], runs[:, 1]).reshape(view.shape)
+
+    return {'level': level, 'factor': factor, 'colors': colors, 'grid': grid}
+
+
+def build_previews(volume, lod_cells):
+    """
+    Encode a BlockVolume at each LOD size, coarsest first
+
+    Sizes that end up with the same scale factor as a coarser level are
+    skipped, so small builds only get the levels they need.
+
+    Returns:
+        list of (descriptor dict, bytes)
+    """
+    lookup, group_colors = color_groups(volume.palette)
+    previews = []
+    previous_factor = None
+    for max_cells in sorted(lod_cells):
+        factor, cells = lod_shape(volume.blocks.shape, max_cells)
+        if factor == previous_factor:
+            continue
+        previous_factor = factor
+
+        grid = dominant_groups(volume, factor, cells, lookup, len(group_colors))
+        level = len(previews)
+        body, data_offset, chunks = encode_lod(grid, level, factor, group_colors)
+        previews.append(({
+            'level': level,
+            'factor': factor,
+            'height': cells[0],
+            'length': cells[1],
+            'width': cells[2],
+            'chunks': chunks,
+            'data_offset': data_offset,
+            'size': len(body),
+        }, body))
+    return previews
+
+
+def preview_name(schematic, level):
+    return f'previews/{schematic.id}/lod{level}.bin'
+
+
+def save_previews(schematic, volume):
+    """
+    Store the preview LODs of a schematic and record their descriptor in preview_data
+
+    Returns:
+        the descriptor dict
+    """
+    storage = schematic.file.storage
+    previews = build_previews(volume, settings.SCHEMATIC_PREVIEW_LODS)
+
+    levels = []
+    for descriptor, body in previews:
+        name = preview_name(schematic, descriptor['level'])
+        if storage.exists(name):
+            storage.delete(name)
+        descriptor['name'] = storage.save(name, ContentFile(body))
+        levels.append(descriptor)
+
+    # Drop levels left over from an earlier, larger set
+    old_levels = (schematic.preview_data or {}).get('lods', [])
+    for old in old_levels[len(levels):]:
+        storage.delete(old['name'])
+
+    schematic.preview_data = {
+        'version': FORMAT_VERSION,
+        'encoding': 'rle-chunked',
+        'chunk_size': CHUNK_SIZE,
+        'lods': levels,
+    }
+    schematic.save(update_fields=['preview_data'])
+    return schematic.preview_data
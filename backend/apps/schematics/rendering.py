@@ -0,0 +1,262 @@
+"""
+Isometric thumbnail rendering
+
+The decoded block volume is first reduced to a level-of-detail grid of at
+most `max_cells` voxels per axis (averaging block colors per cell, one
+y-slab at a time), then drawn face by face with Pillow. Render time and
+memory therefore depend on the LOD size, not on the size of the build.
+"""
+import hashlib
+import io
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .formats import AIR_BLOCKS, block_name
+
+# Blocks that never show up in a preview
+INVISIBLE_BLOCKS = AIR_BLOCKS | {'minecraft:structure_void', 'minecraft:barrier', 'minecraft:light'}
+
+BLOCK_COLORS = {
+    'stone': (125, 125, 125), 'cobblestone': (122, 122, 122), 'granite': (149, 103, 85),
+    'diorite': (188, 188, 188), 'andesite': (136, 136, 136), 'deepslate': (80, 80, 82),
+    'grass_block': (95, 159, 53), 'grass': (95, 159, 53), 'dirt': (134, 96, 67),
+    'coarse_dirt': (119, 85, 59), 'podzol': (91, 63, 24), 'mycelium': (111, 99, 105),
+    'sand': (219, 207, 163), 'red_sand': (190, 102, 33), 'gravel': (131, 127, 126),
+    'clay': (160, 166, 179), 'snow': (249, 254, 254), 'snow_block': (249, 254, 254),
+    'ice': (145, 183, 253), 'packed_ice': (141, 180, 250), 'blue_ice': (116, 167, 253),
+    'water': (63, 118, 228), 'lava': (207, 92, 20), 'obsidian': (15, 10, 24),
+    'bedrock': (85, 85, 85), 'netherrack': (97, 38, 38), 'soul_sand': (81, 62, 50),
+    'glowstone': (171, 131, 84), 'end_stone': (219, 222, 158), 'purpur_block': (169, 125, 169),
+    'quartz_block': (235, 229, 222), 'smooth_quartz': (235, 229, 222),
+    'sandstone': (216, 203, 155), 'red_sandstone': (186, 99, 29),
+    'bricks': (150, 97, 83), 'brick_block': (150, 97, 83), 'stone_bricks': (122, 121, 122),
+    'stonebrick': (122, 121, 122), 'mossy_cobblestone': (110, 118, 94),
+    'prismarine': (99, 156, 151), 'dark_prismarine': (51, 91, 75), 'sea_lantern': (172, 199, 190),
+    'iron_block': (220, 220, 220), 'gold_block': (246, 208, 61), 'diamond_block': (98, 237, 228),
+    'emerald_block': (42, 203, 87), 'lapis_block': (30, 67, 140), 'redstone_block': (175, 24, 5),
+    'coal_block': (16, 15, 15), 'netherite_block': (66, 61, 63), 'copper_block': (192, 107, 79),
+    'hay_block': (166, 136, 38), 'bookshelf': (117, 94, 59), 'tnt': (219, 68, 26),
+    'pumpkin': (198, 118, 24), 'melon': (111, 145, 30), 'cactus': (85, 127, 43),
+    'slime_block': (111, 192, 91), 'honey_block': (251, 185, 52), 'terracotta': (152, 94, 67),
+    'hardened_clay': (152, 94, 67), 'magma_block': (142, 63, 31), 'bone_block': (229, 225, 207),
+    'redstone_lamp': (95, 54, 30), 'torch': (255, 214, 90), 'lantern': (255, 200, 100),
+}
+
+# Colors used for all dyed variants (wool, concrete, terracotta, glass, ...)
+DYE_COLORS = {
+    'white': (234, 236, 236), 'orange': (241, 118, 20), 'magenta': (189, 68, 179),
+    'light_blue': (58, 175, 217), 'yellow': (248, 198, 40), 'lime': (112, 185, 26),
+    'pink': (237, 141, 172), 'gray': (63, 68, 72), 'light_gray': (142, 142, 135),
+    'silver': (142, 142, 135), 'cyan': (21, 137, 145), 'purple': (121, 42, 172),
+    'blue': (53, 57, 157), 'brown': (114, 72, 41), 'green': (85, 110, 28),
+    'red': (161, 39, 35), 'black': (21, 21, 26),
+}
+
+WOOD_COLORS = {
+    'dark_oak': (67, 43, 20), 'oak': (162, 131, 79), 'spruce': (115, 85, 49),
+    'birch': (192, 175, 121), 'jungle': (160, 115, 81), 'acacia': (168, 90, 50),
+    'mangrove': (117, 54, 48), 'cherry': (226, 178, 172), 'bamboo': (194, 173, 80),
+    'crimson': (101, 48, 70), 'warped': (43, 104, 99),
+}
+
+# Substring fallbacks, checked in order
+KEYWORD_COLORS = [
+    ('leaves', (60, 120, 40)), ('glass', (200, 220, 230)), ('deepslate', (80, 80, 82)),
+    ('blackstone', (42, 36, 41)), ('nether_brick', (44, 21, 26)), ('quartz', (235, 229, 222)),
+    ('sandstone', (216, 203, 155)), ('prismarine', (99, 156, 151)), ('copper', (192, 107, 79)),
+    ('brick', (150, 97, 83)), ('stone', (125, 125, 125)), ('ore', (130, 130, 130)),
+    ('wool', (234, 236, 236)), ('concrete', (207, 213, 214)), ('terracotta', (152, 94, 67)),
+    ('rail', (125, 110, 90)), ('redstone', (175, 24, 5)), ('iron', (200, 200, 200)),
+]
+
+FACE_SHADES = {'top': 1.0, 'left': 0.8, 'right': 0.62}
+
+# Upper bound on the cell x color group counters binned at once
+MAX_BINS = 1 << 22
+
+
+def block_color(state):
+    """Approximate RGB color of a block state for previews"""
+    name = block_name(state).split(':', 1)[-1]
+    if name in BLOCK_COLORS:
+        return BLOCK_COLORS[name]
+    for prefix in sorted(DYE_COLORS, key=len, reverse=True):
+        if name.startswith(prefix + '_'):
+            return DYE_COLORS[prefix]
+    for wood in sorted(WOOD_COLORS, key=len, reverse=True):
+        if name.startswith(wood + '_') or name.startswith('stripped_' + wood + '_'):
+            return WOOD_COLORS[wood]
+    for keyword, color in KEYWORD_COLORS:
+        if keyword in name:
+            return color
+    # Stable, muted color for anything unknown
+    digest = hashlib.md5(name.encode('utf-8')).digest()
+    return tuple(80 + byte % 120 for byte in digest[:3])
+
+
+def color_groups(palette):
+    """
+    Map palette indices onto distinct preview colors
+
+    Large palettes mostly differ in block properties that do not change the
+    color, so this keeps the per-cell bins small.
+
+    Returns:
+        tuple: (lookup ndarray palette index -> group, group colors ndarray (n, 3));
+        group 0 holds invisible blocks
+    """
+    lookup = np.zeros(max(len(palette), 1), dtype=np.intp)
+    group_of = {}
+    colors = [(0, 0, 0)]
+    for index, state in enumerate(palette):
+        if block_name(state) in INVISIBLE_BLOCKS:
+            continue
+        color = block_color(state)
+        if color not in group_of:
+            group_of[color] = len(colors)
+            colors.append(color)
+        lookup[index] = group_of[color]
+    return lookup, np.array(colors, dtype=np.float64)
+
+
+def lod_shape(shape, max_cells):
+    """
+    Scale factor and cell counts of an LOD grid
+
+    The factor is the smallest integer that brings every axis of the
+    (height, length, width) shape down to at most max_cells.
+    """
+    factor = max(1, math.ceil(max(shape) / max_cells))
+    return factor, [math.ceil(size / factor) for size in shape]
+
+
+def cell_bins(blocks, factor, cells, lookup, groups):
+    """
+    Count the blocks of each color group per LOD cell
+
+    Works through one slab of `factor` layers at a time, split into bands
+    along z so at most MAX_BINS counters are live.
+
+    Yields:
+        tuple: (cell y, first z cell, end z cell, counts ndarray (z cells, x cells, groups))
+    """
+    height, length, width = blocks.shape
+    band = max(1, MAX_BINS // (cells[2] * groups))
+    z_cells = np.arange(length) // factor
+    x_cells = np.arange(width) // factor
+
+    for cell_y, y in enumerate(range(0, height, factor)):
+        slab = blocks[y:y + factor]
+        for z_start in range(0, cells[1], band):
+            z_stop = min(cells[1], z_start + band)
+            rows = slice(z_start * factor, z_stop * factor)
+            keys = ((z_cells[rows, None] - z_start) * cells[2] + x_cells) * groups + lookup[slab[:, rows]]
+            bins = z_stop - z_start, cells[2], groups
+            counts = np.bincount(keys.ravel(), minlength=math.prod(bins)).reshape(bins)
+            yield cell_y, z_start, z_stop, counts
+
+
+def downsample(volume, max_cells):
+    """
+    Reduce a BlockVolume to a level-of-detail grid
+
+    A cell is filled if any of its blocks is visible and takes their mean
+    color.
+
+    Returns:
+        tuple: (filled bool ndarray (y, z, x), colors uint8 ndarray (y, z, x, 3), factor)
+    """
+    factor, cells = lod_shape(volume.blocks.shape, max_cells)
+    lookup, group_colors = color_groups(volume.palette)
+
+    filled = np.zeros(cells, dtype=bool)
+    mean_colors = np.zeros(cells + [3], dtype=np.uint8)
+
+    for cell_y, z_start, z_stop, counts in cell_bins(volume.blocks, factor, cells, lookup, len(group_colors)):
+        visible = counts[..., 1:]
+        totals = visible.sum(axis=-1)
+        filled[cell_y, z_start:z_stop] = totals > 0
+        mean_colors[cell_y, z_start:z_stop] = (visible @ group_colors[1:]) / np.maximum(totals, 1)[..., None]
+
+    return filled, mean_colors, factor
+
+
+def _exposed_faces(filled):
+    """Faces visible from the (+x, +y, +z) corner: top (+y), left (+z) and right (+x)"""
+    def open_towards(axis):
+        shifted = np.ones_like(filled)
+        index = [slice(None)] * 3
+        index[axis] = slice(0, -1)
+        source = [slice(None)] * 3
+        source[axis] = slice(1, None)
+        shifted[tuple(index)] = ~filled[tuple(source)]
+        return filled & shifted
+
+    return {'top': open_towards(0), 'left': open_towards(1), 'right': open_towards(2)}
+
+
+def render_isometric(filled, colors, size=512, background=(0, 0, 0, 0)):
+    """
+    Draw an isometric view of an LOD grid
+
+    Voxels are painted back to front (ascending x + y + z) and only their
+    exposed faces are drawn.
+
+    Returns:
+        PIL.Image in RGBA mode, fitted into a size x size square
+    """
+    height, length, width = filled.shape
+    if not filled.any():
+        return Image.new('RGBA', (size, size), background)
+
+    # Tile: half width `tile`, half height `tile / 2`, cube side height `tile`
+    span = width + length
+    tile = max(2, size // max(span, 1))
+    half = tile / 2
+    canvas_w = int(span * tile) + 2
+    canvas_h = int(span * half + (height + 1) * tile) + 2
+    image = Image.new('RGBA', (canvas_w, canvas_h), background)
+    draw = ImageDraw.Draw(image)
+
+    faces = _exposed_faces(filled)
+    any_face = faces['top'] | faces['left'] | faces['right']
+    ys, zs, xs = np.nonzero(any_face)
+    order = np.argsort(xs + ys + zs, kind='stable')
+
+    origin_x = length * tile
+    origin_y = height * tile
+
+    for index in order:
+        y, z, x = int(ys[index]), int(zs[index]), int(xs[index])
+        # Screen position of the voxel's top-front corner
+        sx = origin_x + (x - z) * tile
+        sy = origin_y + (x + z) * half - y * tile
+        base = colors[y, z, x].astype(np.float32)
+
+        top = [(sx, sy), (sx + tile, sy + half), (sx, sy + tile), (sx - tile, sy + half)]
+        left = [(sx - tile, sy + half), (sx, sy + tile), (sx, sy + 2 * tile), (sx - tile, sy + tile + half)]
+        right = [(sx, sy + tile), (sx + tile, sy + half), (sx + tile, sy + tile + half), (sx, sy + 2 * tile)]
+
+        for face, polygon in (('top', top), ('left', left), ('right', right)):
+            if faces[face][y, z, x]:
+                shade = tuple(int(channel) for channel in base * FACE_SHADES[face]) + (255,)
+                draw.polygon(polygon, fill=shade)
+
+    bbox = image.getbbox()
+    if bbox:
+        image = image.crop(bbox)
+    image.thumbnail((size, size), Image.LANCZOS)
+    framed = Image.new('RGBA', (size, size), background)
+    framed.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+    return framed
+
+
+def render_thumbnail(volume, size=512, max_cells=64):
+    """Render a BlockVolume to PNG bytes"""
+    filled, colors, _ = downsample(volume, max_cells)
+    image = render_isometric(filled, colors, size=size)
+    output = io.BytesIO()
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
@@ -2,10 +2,14 @@
 Schematic serializers
 """
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 from PIL import Image
 import io
-from .models import Schematic, Tag, SchematicComment, SchematicLike, SchematicImage
+from .models import Schematic, Tag, SchematicComment, SchematicLike, SchematicImage, SchematicBlockCount
+from .similarity import possible_duplicates
+from apps.storage.models import UploadSession
 
 User = get_user_model()
 
@@ -69,6 +73,32 @@ class SchematicImageSerializer(serializers.ModelSerializer):
         return value
 
 
+class SchematicBlockCountSerializer(serializers.ModelSerializer):
+    """Serializer for block histogram entries"""
+    block_state = serializers.CharField(source='block_state.name', read_only=True)
+    block = serializers.CharField(source='block_state.block', read_only=True)
+
+    class Meta:
+        model = SchematicBlockCount
+        fields = ['block_state', 'block', 'count']
+
+
+def duplicate_warning(schematic, request):
+    """Possible duplicates for the owner only, limited to clean schematics they can see anyway"""
+    if not request or request.user != schematic.owner:
+        return None
+    visible = Schematic.objects.filter(Q(is_public=True) | Q(owner=request.user), scan_status='clean')
+    return [
+        {
+            'id': str(other.id),
+            'title': other.title,
+            'owner': other.owner.username,
+            'similarity': round(similarity, 2),
+        }
+        for other, similarity in possible_duplicates(schematic, visible)
+    ]
+
+
 class SchematicListSerializer(serializers.ModelSerializer):
     """Serializer for listing schematics"""
     owner = SchematicOwnerSerializer(read_only=True)
@@ -114,6 +144,8 @@ class SchematicDetailSerializer(serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
     comments_count = serializers.IntegerField(source='comments.count', read_only=True)
     images = SchematicImageSerializer(many=True, read_only=True)
+    preview_data = serializers.SerializerMethodField()
+    possible_duplicates = serializers.SerializerMethodField()
 
     class Meta:
         model = Schematic
@@ -123,7 +155,7 @@ class SchematicDetailSerializer(serializers.ModelSerializer):
             'tags', 'tag_names', 'category', 'is_public', 'scan_status',
             'scan_result', 'scanned_at', 'download_count', 'view_count',
             'thumbnail_url', 'preview_data', 'likes_count', 'is_liked',
-            'comments_count', 'images', 'created_at', 'updated_at'
+            'comments_count', 'images', 'possible_duplicates', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'owner', 'file_size', 'file_hash', 'scan_status',
@@ -137,6 +169,23 @@ class SchematicDetailSerializer(serializers.ModelSerializer):
             return SchematicLike.objects.filter(user=request.user, schematic=obj).exists()
         return False
 
+    def get_preview_data(self, obj):
+        # Only the LOD descriptor; the binary levels are served by the preview endpoint
+        if not obj.preview_data or 'lods' not in obj.preview_data:
+            return None
+        request = self.context.get('request')
+        lods = []
+        for lod in obj.preview_data['lods']:
+            entry = {key: value for key, value in lod.items() if key != 'name'}
+            entry['url'] = reverse(
+                'schematic-preview', kwargs={'pk': obj.pk, 'level': lod['level']}, request=request
+            )
+            lods.append(entry)
+        return {**obj.preview_data, 'lods': lods}
+
+    def get_possible_duplicates(self, obj):
+        return duplicate_warning(obj, self.context.get('request'))
+
     def create(self, validated_data):
         tag_names = validated_data.pop('tag_names', [])
         schematic = Schematic.objects.create(**validated_data)
@@ -178,10 +227,19 @@ class SchematicUploadSerializer(serializers.ModelSerializer):
         required=False,
         allow_empty=True
     )
+    # Exact copies are known at upload; near-duplicates follow on the detail once processed
+    possible_duplicates = serializers.SerializerMethodField()
 
     class Meta:
         model = Schematic
-        fields = ['title', 'description', 'file', 'tag_names', 'category', 'is_public', 'minecraft_version']
+        fields = [
+            'id', 'title', 'description', 'file', 'tag_names', 'category', 'is_public', 'minecraft_version',
+            'possible_duplicates'
+        ]
+        read_only_fields = ['id']
+
+    def get_possible_duplicates(self, obj):
+        return duplicate_warning(obj, self.context.get('request'))
 
     def validate_file(self, value):
         # File size validation
@@ -218,3 +276,68 @@ class CommentSerializer(serializers.ModelSerializer):
         if obj.replies.exists():
             return CommentSerializer(obj.replies.all(), many=True).data
         return []
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable upload sessions"""
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'file_name', 'file_size', 'offset', 'expires_at']
+        read_only_fields = ['id', 'offset', 'expires_at']
+
+    def validate_file_size(self, value):
+        from django.conf import settings
+        if value < 1:
+            raise serializers.ValidationError("The file is empty")
+        if value > settings.MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f"File size must not exceed "
+                f"{settings.MAX_UPLOAD_SIZE / (1024 * 1024)}MB"
+            )
+        return value
+
+    def validate_file_name(self, value):
+        import os
+        from django.conf import settings
+        ext = os.path.splitext(value)[1].lower()
+        if ext not in settings.ALLOWED_SCHEMATIC_EXTENSIONS:
+            raise serializers.ValidationError(
+                f"File type not allowed. Allowed types: "
+                f"{', '.join(settings.ALLOWED_SCHEMATIC_EXTENSIONS)}"
+            )
+        return value
+
+
+class DirectUploadSessionSerializer(UploadSessionSerializer):
+    """Serializer for starting a direct-to-S3 upload session"""
+    part_checksums = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        write_only=True,
+        help_text='Base64 SHA-256 of each UPLOAD_DIRECT_PART_SIZE part, in order'
+    )
+
+    class Meta(UploadSessionSerializer.Meta):
+        fields = UploadSessionSerializer.Meta.fields + ['part_checksums']
+
+
+class UploadFinalizeSerializer(SchematicUploadSerializer):
+    """Schematic details sent when finalizing an upload session"""
+
+    class Meta(SchematicUploadSerializer.Meta):
+        fields = ['title', 'description', 'tag_names', 'category', 'is_public', 'minecraft_version']
+
+
+class BulkUploadSerializer(serializers.Serializer):
+    """A zip archive of schematics with its metadata manifest"""
+    archive = serializers.FileField()
+    manifest = serializers.JSONField(required=False, default=dict)
+
+    def validate_manifest(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("The manifest must be a JSON object")
+        for key in ('defaults', 'files'):
+            if not isinstance(value.get(key, {}), dict):
+                raise serializers.ValidationError(f"Manifest '{key}' must be a JSON object")
+        return value
@@ -0,0 +1,194 @@
+"""
+Near-duplicate detection
+
+Each clean schematic gets a MinHash signature of its decoded block content,
+so re-saved or lightly edited copies match even though their bytes (and
+file_hash) differ. A shingle is the 2x2x2 window of blocks starting at a
+non-air block plus the coarse region of the build it sits in (the bounding
+box split REGION_SPLITS times per axis). Blocks are keyed by state
+name, so palette order does not matter, and local windows alone would be
+too few distinct features for builds made of a handful of materials.
+
+The signature uses one-permutation hashing: shingle hashes are split into
+SIGNATURE_SIZE bins by their top bits and each bin keeps its minimum, which
+takes a single pass over the volume. For lookup the signature is cut into
+LSH_BANDS bands of rows; each band hashes to a bucket stored in an indexed
+column, so candidates come from an index lookup and only those are compared
+in full.
+"""
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .formats import AIR_BLOCKS, block_name
+from .models import Schematic, SchematicLSHBucket, SchematicSignature
+
+SIGNATURE_SIZE = 128
+LSH_BANDS = 16
+ROWS_PER_BAND = SIGNATURE_SIZE // LSH_BANDS
+BIN_SHIFT = np.uint64(64 - (SIGNATURE_SIZE.bit_length() - 1))
+EMPTY = np.uint64(np.iinfo(np.uint64).max)
+REGION_SPLITS = 4
+
+# Odd multipliers folding in the window's lower and upper layer
+WINDOW_KEYS = [np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F)]
+
+
+def _mix(values):
+    """splitmix64 finalizer, spreads combined hashes over all 64 bits"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def state_hashes(palette):
+    """Stable 64-bit hash per palette entry; air hashes to 0"""
+    hashes = np.zeros(max(len(palette), 1), dtype=np.uint64)
+    for index, state in enumerate(palette):
+        if block_name(state) not in AIR_BLOCKS:
+            digest = hashlib.blake2b(state.encode('utf-8'), digest_size=8).digest()
+            hashes[index] = int.from_bytes(digest, 'little') | 1
+    return hashes
+
+
+def _densify(signature):
+    """Fill empty bins from the next non-empty one so sparse builds still compare"""
+    filled = np.flatnonzero(signature != EMPTY)
+    if filled.size in (0, signature.size):
+        return signature
+    empty = np.flatnonzero(signature == EMPTY)
+    donors = filled[np.searchsorted(filled, empty) % filled.size]
+    offsets = ((donors - empty) % signature.size).astype(np.uint64)
+    signature[empty] = _mix(signature[donors] + offsets)
+    return signature
+
+
+def minhash_signature(volume):
+    """
+    MinHash signature of a BlockVolume
+
+    Returns:
+        tuple: (uint64 ndarray of SIGNATURE_SIZE values, number of shingles)
+    """
+    hashes = state_hashes(volume.palette)
+    height, length, width = volume.blocks.shape
+    signature = np.full(SIGNATURE_SIZE, EMPTY, dtype=np.uint64)
+    shingles = 0
+
+    region_z = (np.arange(length) * REGION_SPLITS // max(length, 1))[:, None]
+    region_x = np.arange(width) * REGION_SPLITS // max(width, 1)
+    columns = (region_z * REGION_SPLITS + region_x).astype(np.uint64)
+
+    with np.errstate(over='ignore'):
+        upper = hashes[volume.blocks[0]] if height else None
+        for y in range(height):
+            layer = upper
+            upper = hashes[volume.blocks[y + 1]] if y + 1 < height else np.zeros_like(layer)
+            solid = layer != 0
+            if not solid.any():
+                continue
+
+            # Hash the 2x2x2 window starting at each solid block
+            combined = (columns + np.uint64(y * REGION_SPLITS // height * REGION_SPLITS ** 2 + 1))[solid]
+            for key, plane in zip(WINDOW_KEYS, (layer, upper)):
+                for dz, dx in ((0, 0), (0, 1), (1, 0), (1, 1)):
+                    shifted = np.zeros_like(plane)
+                    shifted[:length - dz, :width - dx] = plane[dz:, dx:]
+                    combined = combined * key + shifted[solid]
+            mixed = _mix(combined)
+            np.minimum.at(signature, (mixed >> BIN_SHIFT).astype(np.intp), mixed)
+            shingles += mixed.size
+
+    return _densify(signature), shingles
+
+
+def lsh_buckets(signature):
+    """One signed 64-bit bucket per band, with the band number folded in"""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(rows.tobytes(), digest_size=8, salt=band.to_bytes(2, 'little')).digest()
+        buckets.append(int.from_bytes(digest, 'little', signed=True))
+    return buckets
+
+
+def estimate_similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(first == second))
+
+
+def signature_array(data):
+    return np.frombuffer(bytes(data), dtype='<u8')
+
+
+@transaction.atomic
+def save_signature(schematic, signature, shingles):
+    """Store the signature of a schematic and replace its LSH buckets"""
+    SchematicSignature.objects.update_or_create(
+        schematic=schematic,
+        defaults={'minhash': signature.astype('<u8').tobytes(), 'shingle_count': shingles}
+    )
+    SchematicLSHBucket.objects.filter(schematic=schematic).delete()
+    SchematicLSHBucket.objects.bulk_create([
+        SchematicLSHBucket(schematic=schematic, bucket=bucket) for bucket in lsh_buckets(signature)
+    ])
+
+
+def find_near_duplicates(schematic, candidates=None, threshold=None, limit=10):
+    """
+    Schematics whose block content is likely a near-copy of this one
+
+    Args:
+        schematic: Schematic with a stored signature
+        candidates: optional Schematic queryset restricting the results,
+            e.g. to what a user is allowed to see
+        threshold: minimum estimated similarity, default
+            NEAR_DUPLICATE_THRESHOLD
+
+    Returns:
+        list of (Schematic, similarity), most similar first
+    """
+    try:
+        signature = signature_array(schematic.signature.minhash)
+    except SchematicSignature.DoesNotExist:
+        return []
+    if threshold is None:
+        threshold = settings.NEAR_DUPLICATE_THRESHOLD
+
+    matches = SchematicLSHBucket.objects.filter(
+        bucket__in=lsh_buckets(signature)
+    ).exclude(schematic=schematic).values('schematic')
+    queryset = Schematic.objects.filter(id__in=matches).exclude(scan_status='infected')
+    if candidates is not None:
+        queryset = queryset.filter(id__in=candidates.values('id'))
+
+    results = []
+    for other in queryset.select_related('signature', 'owner'):
+        similarity = estimate_similarity(signature, signature_array(other.signature.minhash))
+        if similarity >= threshold:
+            results.append((other, similarity))
+    results.sort(key=lambda match: match[1], reverse=True)
+    return results[:limit]
+
+
+def possible_duplicates(schematic, candidates, limit=10):
+    """
+    Exact copies of a schematic's file followed by near-duplicates
+
+    Exact copies share the file_hash, so they are known from the upload on;
+    near-duplicates need the signature computed once the file is processed.
+
+    Returns:
+        list of (Schematic, similarity), exact copies with similarity 1.0 first
+    """
+    exact = candidates.filter(file_hash=schematic.file_hash).exclude(id=schematic.id)
+    matches = [(other, 1.0) for other in exact.select_related('owner')[:limit]]
+    seen = {other.id for other, _ in matches}
+    for other, similarity in find_near_duplicates(schematic, candidates=candidates, limit=limit):
+        if other.id not in seen:
+            matches.append((other, similarity))
+    return matches[:limit]
@@ -0,0 +1,174 @@
+"""
+Celery tasks for schematic processing
+"""
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def reject_schematic(schematic, error):
+    """Mark a schematic whose content exceeds the ingestion limits as rejected"""
+    schematic.scan_status = 'rejected'
+    schematic.scan_result = {'status': 'rejected', 'error': str(error)}
+    schematic.save(update_fields=['scan_status', 'scan_result'])
+    logger.warning(f"Rejected schematic {schematic.id}: {error}")
+
+
+def save_thumbnail(schematic, volume):
+    """Render the isometric PNG thumbnail of a decoded volume, store it and link it"""
+    from .rendering import render_thumbnail
+
+    png = render_thumbnail(
+        volume,
+        size=settings.SCHEMATIC_THUMBNAIL_SIZE,
+        max_cells=settings.SCHEMATIC_THUMBNAIL_MAX_CELLS
+    )
+
+    storage = schematic.file.storage
+    name = f'thumbnails/{schematic.id}.png'
+    if storage.exists(name):
+        storage.delete(name)
+    name = storage.save(name, ContentFile(png))
+
+    schematic.thumbnail_url = storage.url(name)
+    schematic.save(update_fields=['thumbnail_url'])
+    logger.info(f"Rendered thumbnail for schematic {schematic.id} ({len(png)} bytes)")
+    return schematic.thumbnail_url
+
+
+@shared_task
+def process_schematic_task(schematic_id):
+    """
+    Extract metadata, block histogram, preview LODs, thumbnail and the
+    near-duplicate signature from a clean schematic
+    The blocks are decoded once and every derived output is built from
+    that volume. Queued by scan_file_task once the file has passed the virus scan;
+    files exceeding the NBT ingestion limits are marked rejected
+    """
+    from .formats import read_blocks, read_metadata
+    from .histogram import block_histogram, save_block_histogram
+    from .nbt import NBTError, NBTLimitError
+    from .preview import save_previews
+    from .similarity import minhash_signature, save_signature
+
+    Schematic = apps.get_model('schematics', 'Schematic')
+
+    try:
+        schematic = Schematic.objects.get(id=schematic_id)
+    except Schematic.DoesNotExist:
+        logger.error(f"Schematic {schematic_id} not found")
+        return None
+
+    if schematic.scan_status != 'clean':
+        logger.warning(f"Skipping processing of {schematic_id} with scan status {schematic.scan_status}")
+        return None
+
+    # Metadata first: a streaming pass with bounded memory that fills the columns quickly
+    try:
+        with schematic.file.open('rb') as file_obj:
+            metadata = read_metadata(file_obj)
+    except NBTLimitError as e:
+        reject_schematic(schematic, e)
+        return None
+    except (OSError, ValueError, NBTError) as e:
+        logger.error(f"Error reading schematic {schematic_id}: {e.__class__.__name__}: {e}")
+        return None
+
+    schematic.width = metadata['width']
+    schematic.height = metadata['height']
+    schematic.length = metadata['length']
+    schematic.block_count = metadata['block_count']
+    update_fields = ['width', 'height', 'length', 'block_count']
+
+    # Keep a version the uploader entered by hand
+    if not schematic.minecraft_version and metadata['minecraft_version']:
+        schematic.minecraft_version = metadata['minecraft_version']
+        update_fields.append('minecraft_version')
+
+    schematic.save(update_fields=update_fields)
+    logger.info(
+        f"Processed schematic {schematic_id}: {metadata['format']} "
+        f"{schematic.width}x{schematic.height}x{schematic.length}, {schematic.block_count} blocks"
+    )
+
+    # Then decode the full block content for analysis
+    try:
+        with schematic.file.open('rb') as file_obj:
+            volume = read_blocks(file_obj, workers=settings.SCHEMATIC_DECODE_WORKERS)
+    except NBTLimitError as e:
+        reject_schematic(schematic, e)
+        return None
+    except (OSError, ValueError, NBTError) as e:
+        logger.error(f"Error decoding blocks of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+        return metadata
+
+    histogram = block_histogram(volume)
+    if schematic.block_count is None:
+        schematic.block_count = sum(histogram.values())
+        schematic.save(update_fields=['block_count'])
+        metadata['block_count'] = schematic.block_count
+
+    # Each derived output is saved on its own, so one failing does not block the others
+    try:
+        save_block_histogram(schematic, histogram)
+    except Exception as e:
+        logger.error(f"Error saving block histogram of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+
+    try:
+        save_previews(schematic, volume)
+    except Exception as e:
+        logger.error(f"Error saving previews of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+
+    try:
+        signature, shingles = minhash_signature(volume)
+        if shingles:
+            save_signature(schematic, signature, shingles)
+    except Exception as e:
+        logger.error(f"Error saving similarity signature of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+
+    # From the volume already in memory rather than decoding the file again
+    try:
+        save_thumbnail(schematic, volume)
+    except Exception as e:
+        logger.error(f"Error rendering thumbnail of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+
+    return metadata
+
+
+@shared_task
+def render_thumbnail_task(schematic_id):
+    """
+    Render an isometric PNG thumbnail of a clean schematic
+    Stored next to the schematic files and linked from thumbnail_url.
+    process_schematic_task renders it on upload; this re-renders one alone.
+    """
+    from .formats import read_blocks
+    from .nbt import NBTError, NBTLimitError
+
+    Schematic = apps.get_model('schematics', 'Schematic')
+
+    try:
+        schematic = Schematic.objects.get(id=schematic_id)
+    except Schematic.DoesNotExist:
+        logger.error(f"Schematic {schematic_id} not found")
+        return None
+
+    if schematic.scan_status != 'clean':
+        logger.warning(f"Skipping thumbnail of {schematic_id} with scan status {schematic.scan_status}")
+        return None
+
+    try:
+        with schematic.file.open('rb') as file_obj:
+            volume = read_blocks(file_obj, workers=settings.SCHEMATIC_DECODE_WORKERS)
+    except NBTLimitError as e:
+        reject_schematic(schematic, e)
+        return None
+    except (OSError, ValueError, NBTError) as e:
+        logger.error(f"Error decoding blocks of schematic {schematic_id}: {e.__class__.__name__}: {e}")
+        return None
+
+    return save_thumbnail(schematic, volume)
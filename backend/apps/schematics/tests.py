@@ -835,3 +835,1985 @@ class TestSchematicImages:
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert 'Invalid image' in str(response.data) or 'image' in str(response.data).lower()
+
+
+def _nbt_string(value):
+    import struct
+    data = value.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+
+def _nbt_tag(tag_type, name, payload):
+    return bytes([tag_type]) + _nbt_string(name) + payload
+
+
+def _nbt_compound(*tags):
+    return b''.join(tags) + b'\x00'
+
+
+def _gzip_nbt(root_name, *tags):
+    import gzip
+    return gzip.compress(_nbt_tag(10, root_name, _nbt_compound(*tags)))
+
+
+def build_sponge_schematic(width, height, length, palette, indices, data_version=3465):
+    """Build a gzip compressed Sponge v2 schematic"""
+    import struct
+    block_data = bytearray()
+    for index in indices:
+        while index >= 0x80:
+            block_data.append((index & 0x7F) | 0x80)
+            index >>= 7
+        block_data.append(index)
+    return _gzip_nbt(
+        'Schematic',
+        _nbt_tag(3, 'Version', struct.pack('>i', 2)),
+        _nbt_tag(3, 'DataVersion', struct.pack('>i', data_version)),
+        _nbt_tag(2, 'Width', struct.pack('>h', width)),
+        _nbt_tag(2, 'Height', struct.pack('>h', height)),
+        _nbt_tag(2, 'Length', struct.pack('>h', length)),
+        _nbt_tag(7, 'BlockData', struct.pack('>i', len(block_data)) + bytes(block_data)),
+        _nbt_tag(10, 'Palette', _nbt_compound(*[
+            _nbt_tag(3, state, struct.pack('>i', index)) for state, index in palette.items()
+        ])),
+    )
+
+
+class TestSchematicFormats:
+    """Test streaming metadata extraction"""
+
+    def test_read_sponge_metadata(self):
+        """Test reading dimensions and block count from a Sponge schematic"""
+        import io
+        from apps.schematics.formats import read_metadata
+
+        palette = {'minecraft:air': 0, 'minecraft:stone': 1, 'minecraft:redstone_block': 200}
+        indices = [0, 1, 1, 200, 0, 200, 1, 0]
+        data = build_sponge_schematic(2, 2, 2, palette, indices)
+
+        metadata = read_metadata(io.BytesIO(data))
+
+        assert metadata['format'] == 'sponge'
+        assert (metadata['width'], metadata['height'], metadata['length']) == (2, 2, 2)
+        assert metadata['block_count'] == 5
+        assert metadata['minecraft_version'] == '1.20.1'
+
+    def test_read_mcedit_metadata(self):
+        """Test reading a legacy MCEdit schematic"""
+        import io
+        import struct
+        from apps.schematics.formats import read_metadata
+
+        blocks = bytes([0, 1, 0, 35, 4, 0])
+        data = _gzip_nbt(
+            'Schematic',
+            _nbt_tag(2, 'Width', struct.pack('>h', 3)),
+            _nbt_tag(2, 'Height', struct.pack('>h', 1)),
+            _nbt_tag(2, 'Length', struct.pack('>h', 2)),
+            _nbt_tag(8, 'Materials', _nbt_string('Alpha')),
+            _nbt_tag(7, 'Blocks', struct.pack('>i', len(blocks)) + blocks),
+            _nbt_tag(7, 'Data', struct.pack('>i', len(blocks)) + bytes(len(blocks))),
+        )
+
+        metadata = read_metadata(io.BytesIO(data))
+
+        assert metadata['format'] == 'mcedit'
+        assert (metadata['width'], metadata['height'], metadata['length']) == (3, 1, 2)
+        assert metadata['block_count'] == 3
+        assert metadata['minecraft_version'] == ''
+
+    def test_read_litematic_metadata(self):
+        """Test reading the enclosing size of a Litematica file without decoding regions"""
+        import io
+        import struct
+        from apps.schematics.formats import read_metadata
+
+        states = struct.pack('>i', 4) + bytes(32)
+        data = _gzip_nbt(
+            '',
+            _nbt_tag(3, 'MinecraftDataVersion', struct.pack('>i', 3953)),
+            _nbt_tag(10, 'Metadata', _nbt_compound(
+                _nbt_tag(10, 'EnclosingSize', _nbt_compound(
+                    _nbt_tag(3, 'x', struct.pack('>i', 16)),
+                    _nbt_tag(3, 'y', struct.pack('>i', 8)),
+                    _nbt_tag(3, 'z', struct.pack('>i', 4)),
+                )),
+                _nbt_tag(3, 'TotalBlocks', struct.pack('>i', 77)),
+            )),
+            _nbt_tag(10, 'Regions', _nbt_compound(
+                _nbt_tag(10, 'main', _nbt_compound(_nbt_tag(12, 'BlockStates', states))),
+            )),
+        )
+
+        metadata = read_metadata(io.BytesIO(data))
+
+        assert metadata['format'] == 'litematic'
+        assert (metadata['width'], metadata['height'], metadata['length']) == (16, 8, 4)
+        assert metadata['block_count'] == 77
+        assert metadata['minecraft_version'] == '1.21'
+
+    def test_read_structure_metadata(self):
+        """Test reading a vanilla structure file"""
+        import io
+        import struct
+        from apps.schematics.formats import read_metadata
+
+        def block(state, x):
+            return _nbt_compound(
+                _nbt_tag(9, 'pos', bytes([3]) + struct.pack('>iiii', 3, x, 0, 0)),
+                _nbt_tag(3, 'state', struct.pack('>i', state)),
+            )
+
+        palette = [
+            _nbt_compound(_nbt_tag(8, 'Name', _nbt_string('minecraft:air'))),
+            _nbt_compound(
+                _nbt_tag(8, 'Name', _nbt_string('minecraft:oak_stairs')),
+                _nbt_tag(10, 'Properties', _nbt_compound(_nbt_tag(8, 'facing', _nbt_string('north')))),
+            ),
+        ]
+        data = _gzip_nbt(
+            '',
+            _nbt_tag(3, 'DataVersion', struct.pack('>i', 2586)),
+            _nbt_tag(9, 'size', bytes([3]) + struct.pack('>iiii', 3, 3, 1, 1)),
+            _nbt_tag(9, 'blocks', bytes([10]) + struct.pack('>i', 3) + block(1, 0) + block(0, 1) + block(1, 2)),
+            _nbt_tag(9, 'palette', bytes([10]) + struct.pack('>i', 2) + b''.join(palette)),
+        )
+
+        metadata = read_metadata(io.BytesIO(data))
+
+        assert metadata['format'] == 'structure'
+        assert (metadata['width'], metadata['height'], metadata['length']) == (3, 1, 1)
+        assert metadata['block_count'] == 2
+        assert metadata['minecraft_version'] == '1.16.5'
+
+    def test_read_invalid_file(self):
+        """Test that non-NBT content is rejected"""
+        import io
+        from apps.schematics.formats import read_metadata
+        from apps.schematics.nbt import NBTError
+
+        with pytest.raises(NBTError):
+            read_metadata(io.BytesIO(b'test content'))
+
+
+class TestIngestionLimits:
+    """Test bounded reading of untrusted NBT"""
+
+    def test_inflate_limit(self):
+        """Test that the expansion ratio applies beyond a fixed allowance and is capped by the maximum size"""
+        from apps.schematics.nbt import INFLATE_ALLOWANCE, NBTLimits
+
+        limits = NBTLimits(max_expansion_ratio=100, max_inflated_size=500 * 1024 * 1024)
+
+        assert limits.inflate_limit(1024 * 1024) == 100 * 1024 * 1024
+        assert limits.inflate_limit(1024) == INFLATE_ALLOWANCE
+        assert limits.inflate_limit(100 * 1024 * 1024) == 500 * 1024 * 1024
+        assert NBTLimits().inflate_limit(1024) is None
+
+    def test_decompression_bomb(self):
+        """Test that inflating stops at the limit instead of decompressing everything"""
+        import io
+        import struct
+        from apps.schematics.formats import read_metadata
+        from apps.schematics.nbt import NBTLimitError, NBTLimits
+
+        data = _gzip_nbt(
+            'Schematic',
+            _nbt_tag(7, 'Padding', struct.pack('>i', 8 * 1024 * 1024) + bytes(8 * 1024 * 1024)),
+        )
+        assert len(data) < 16 * 1024
+
+        with pytest.raises(NBTLimitError, match='Decompressed data'):
+            read_metadata(io.BytesIO(data), limits=NBTLimits(max_inflated_size=1024 * 1024))
+
+    def test_nesting_depth(self):
+        """Test that deeply nested compounds are refused"""
+        import io
+        from apps.schematics.formats import read_metadata
+        from apps.schematics.nbt import NBTLimitError, NBTLimits
+
+        nested = b''
+        for _ in range(100):
+            nested = _nbt_tag(10, 'n', _nbt_compound(nested) if nested else b'\x00')
+        data = _gzip_nbt('Schematic', nested)
+
+        with pytest.raises(NBTLimitError, match='nesting'):
+            read_metadata(io.BytesIO(data), limits=NBTLimits(max_depth=32))
+
+    def test_array_length(self):
+        """Test that an oversized array header is refused before its payload is read"""
+        import io
+        import struct
+        from apps.schematics.formats import read_metadata
+        from apps.schematics.nbt import NBTLimitError, NBTLimits
+
+        data = _gzip_nbt('Schematic', _nbt_tag(7, 'BlockData', struct.pack('>i', 2 ** 31 - 1)))
+
+        with pytest.raises(NBTLimitError, match='Array'):
+            read_metadata(io.BytesIO(data), limits=NBTLimits(max_array_length=1024))
+
+    def test_declared_volume(self):
+        """Test that a structure declaring a huge size is refused instead of allocated"""
+        import io
+        import struct
+        from apps.schematics.formats import read_blocks
+        from apps.schematics.nbt import NBTLimitError
+
+        size = struct.pack('>bi', 3, 3) + struct.pack('>3i', 100000, 100000, 100000)
+        data = _gzip_nbt('', _nbt_tag(9, 'size', size), _nbt_tag(9, 'blocks', struct.pack('>bi', 10, 0)))
+
+        with pytest.raises(NBTLimitError, match='Block volume'):
+            read_blocks(io.BytesIO(data))
+
+    def test_out_of_range_palette_index(self):
+        """Test that a huge varint palette index does not size the histogram"""
+        import io
+        from apps.schematics.formats import read_metadata
+        from apps.schematics.nbt import NBTLimitError
+
+        data = build_sponge_schematic(1, 1, 1, {'minecraft:stone': 0}, [2 ** 31])
+
+        with pytest.raises(NBTLimitError, match='Palette size'):
+            read_metadata(io.BytesIO(data))
+
+
+@pytest.mark.django_db
+class TestProcessSchematicTask:
+    """Test process_schematic_task Celery task"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def test_process_populates_metadata(self):
+        """Test that a clean schematic gets its dimensions filled in"""
+        from django.core.files.base import ContentFile
+        from apps.schematics.tasks import process_schematic_task
+
+        data = build_sponge_schematic(
+            2, 1, 2, {'minecraft:air': 0, 'minecraft:stone': 1}, [1, 0, 1, 1]
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Parsed Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            scan_status='clean'
+        )
+        schematic.file.save('parsed.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        result = process_schematic_task(str(schematic.id))
+
+        assert result['format'] == 'sponge'
+        schematic.refresh_from_db()
+        assert (schematic.width, schematic.height, schematic.length) == (2, 1, 2)
+        assert schematic.block_count == 3
+        assert schematic.minecraft_version == '1.20.1'
+        schematic.file.delete(save=False)
+
+    def test_process_skips_unscanned(self):
+        """Test that files which have not passed the scan are not parsed"""
+        from apps.schematics.tasks import process_schematic_task
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Pending Schematic',
+            file='test.schematic',
+            file_size=1024,
+            file_hash='abc123',
+            scan_status='pending'
+        )
+
+        assert process_schematic_task(str(schematic.id)) is None
+
+    def test_process_missing_file(self):
+        """Test that a missing file is logged rather than raised"""
+        from apps.schematics.tasks import process_schematic_task
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Missing Schematic',
+            file='missing.schematic',
+            file_size=1024,
+            file_hash='abc123',
+            scan_status='clean'
+        )
+
+        assert process_schematic_task(str(schematic.id)) is None
+        schematic.refresh_from_db()
+        assert schematic.width is None
+
+    def test_process_rejects_oversized(self, settings):
+        """Test that a file exceeding the ingestion limits is marked rejected and not downloadable"""
+        from django.core.files.base import ContentFile
+        from apps.schematics.tasks import process_schematic_task
+
+        settings.SCHEMATIC_MAX_ARRAY_LENGTH = 4
+        data = build_sponge_schematic(
+            2, 2, 2, {'minecraft:air': 0, 'minecraft:stone': 1}, [1] * 8
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Oversized Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            is_public=True,
+            scan_status='clean'
+        )
+        schematic.file.save('oversized.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        assert process_schematic_task(str(schematic.id)) is None
+
+        schematic.refresh_from_db()
+        assert schematic.scan_status == 'rejected'
+        assert 'exceeds 4' in schematic.scan_result['error']
+        assert schematic.width is None
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(reverse('schematic-download', kwargs={'pk': schematic.id}))
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        schematic.file.delete(save=False)
+
+
+def build_litematic(regions, data_version=3953):
+    """
+    Build a gzip compressed Litematica file
+
+    regions: list of (name, position, size, palette, indices) with position
+    and size as (x, y, z) tuples
+    """
+    import struct
+    import numpy as np
+    from apps.schematics.blockdata import bits_for_palette
+    from apps.schematics.management.commands.benchmark_blockdata import pack_bits
+
+    def vec(name, values):
+        return _nbt_tag(10, name, _nbt_compound(*[
+            _nbt_tag(3, axis, struct.pack('>i', value)) for axis, value in zip('xyz', values)
+        ]))
+
+    region_tags = []
+    for name, position, size, palette, indices in regions:
+        packed = pack_bits(np.array(indices, dtype=np.uint32), bits_for_palette(len(palette)))
+        entries = b''.join(_nbt_compound(_nbt_tag(8, 'Name', _nbt_string(state))) for state in palette)
+        region_tags.append(_nbt_tag(10, name, _nbt_compound(
+            vec('Position', position),
+            vec('Size', size),
+            _nbt_tag(9, 'BlockStatePalette', bytes([10]) + struct.pack('>i', len(palette)) + entries),
+            _nbt_tag(12, 'BlockStates', struct.pack('>i', len(packed) // 8) + packed),
+        )))
+    return _gzip_nbt(
+        '',
+        _nbt_tag(3, 'MinecraftDataVersion', struct.pack('>i', data_version)),
+        _nbt_tag(10, 'Regions', _nbt_compound(*region_tags)),
+    )
+
+
+class TestBlockData:
+    """Test vectorized block data decoding"""
+
+    def test_decode_varints_matches_naive(self):
+        """Test that vectorized varint decoding matches the reference loop"""
+        import numpy as np
+        from apps.schematics.blockdata import decode_varints
+        from apps.schematics.management.commands.benchmark_blockdata import (
+            decode_varints_naive, encode_varints
+        )
+
+        indices = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 21, 2 ** 32 - 1], dtype=np.uint32)
+        data = encode_varints(indices)
+
+        values, consumed = decode_varints(data)
+
+        assert consumed == len(data)
+        assert values.tolist() == decode_varints_naive(data) == indices.tolist()
+
+    def test_varint_decoder_across_chunks(self):
+        """Test that varints split across chunk boundaries decode correctly"""
+        import numpy as np
+        from apps.schematics.blockdata import VarintDecoder
+        from apps.schematics.management.commands.benchmark_blockdata import encode_varints
+
+        indices = np.arange(0, 5000, 7, dtype=np.uint32)
+        data = encode_varints(indices)
+        decoder = VarintDecoder()
+
+        decoded = [decoder.feed(data[i:i + 3]) for i in range(0, len(data), 3)]
+        decoder.close()
+
+        assert np.concatenate(decoded).tolist() == indices.tolist()
+
+    def test_truncated_varint(self):
+        """Test that a dangling continuation byte is rejected"""
+        from apps.schematics.blockdata import decode_varints
+        from apps.schematics.nbt import NBTError
+
+        with pytest.raises(NBTError):
+            decode_varints(b'\x01\x81')
+
+    def test_unpack_bits_matches_naive(self):
+        """Test Litematica bit unpacking including entries straddling two longs"""
+        import numpy as np
+        from apps.schematics.blockdata import unpack_bits
+        from apps.schematics.management.commands.benchmark_blockdata import pack_bits, unpack_bits_naive
+
+        rng = np.random.default_rng(1)
+        for bits in (2, 5, 9, 13):
+            indices = rng.integers(0, 2 ** bits, size=1000, dtype=np.uint32)
+            data = pack_bits(indices, bits)
+
+            values = unpack_bits(data, bits, indices.size)
+
+            assert values.dtype == np.uint32
+            assert values.tolist() == indices.tolist() == unpack_bits_naive(data, bits, indices.size)
+
+    def test_encoders_round_trip(self):
+        """Test that varint encoding and bit packing match the reference encoders and decode back"""
+        import numpy as np
+        from apps.schematics import blockdata
+        from apps.schematics.management.commands.benchmark_blockdata import encode_varints, pack_bits
+
+        rng = np.random.default_rng(0)
+        indices = rng.integers(0, 300, size=1000).astype(np.uint32)
+
+        assert blockdata.encode_varints(indices) == encode_varints(indices)
+        assert int(blockdata.varint_lengths(indices).sum()) == len(encode_varints(indices))
+        assert blockdata.pack_bits(indices, 9) == pack_bits(indices, 9)
+        # Packing in pieces of 64 entries matches a single pass
+        pieces = b''.join(blockdata.pack_bits(indices[i:i + 128], 9) for i in range(0, 1000, 128))
+        assert pieces == blockdata.pack_bits(indices, 9)
+        assert blockdata.unpack_bits(pieces, 9, 1000).tolist() == indices.tolist()
+
+    def test_read_blocks_sponge(self):
+        """Test decoding a Sponge schematic into a (y, z, x) volume"""
+        import io
+        from apps.schematics.formats import read_blocks
+
+        palette = {'minecraft:air': 0, 'minecraft:stone': 1, 'minecraft:glass': 130}
+        indices = [1, 0, 130, 1, 0, 0, 1, 130, 1, 1, 0, 0]
+        volume = read_blocks(io.BytesIO(build_sponge_schematic(3, 2, 2, palette, indices)))
+
+        assert volume.blocks.shape == (2, 2, 3)
+        assert volume.palette[volume.blocks[0, 0, 2]] == 'minecraft:glass'
+        assert volume.palette[volume.blocks[1, 0, 0]] == 'minecraft:stone'
+        assert volume.block_count == 7
+
+    def test_read_blocks_litematic_regions(self):
+        """Test merging Litematica regions, including negative sizes, into one volume"""
+        import io
+        from apps.schematics.formats import read_blocks
+
+        data = build_litematic([
+            ('a', (0, 0, 0), (2, 1, 1), ['minecraft:air', 'minecraft:stone'], [1, 1]),
+            ('b', (3, 0, 0), (-1, 1, -2), ['minecraft:air', 'minecraft:gold_block'], [1, 0]),
+        ])
+
+        volume = read_blocks(io.BytesIO(data))
+
+        assert (volume.width, volume.height, volume.length) == (4, 1, 2)
+        # Region b spans z -1..0, which shifts region a to z index 1
+        assert volume.palette[volume.blocks[0, 1, 0]] == 'minecraft:stone'
+        assert volume.palette[volume.blocks[0, 1, 1]] == 'minecraft:stone'
+        assert volume.palette[volume.blocks[0, 0, 3]] == 'minecraft:gold_block'
+        assert volume.palette[volume.blocks[0, 1, 3]] == 'minecraft:air'
+        assert volume.block_count == 3
+
+
+class TestParallelDecode:
+    """Test process-pool decoding of multi-region Litematica files"""
+
+    def _regions(self):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        regions = []
+        for index, (position, size) in enumerate([
+            ((0, 0, 0), (4, 3, 5)), ((5, 0, 0), (-2, 2, 3)), ((0, 3, 2), (6, 1, -3)),
+        ]):
+            palette = ['minecraft:air', 'minecraft:stone', f'minecraft:block_{index}']
+            volume = abs(size[0] * size[1] * size[2])
+            regions.append((f'r{index}', position, size, palette, rng.integers(0, 3, volume).tolist()))
+        return regions
+
+    def test_read_blocks_parallel_matches_sequential(self, monkeypatch):
+        """Test that decoding regions in worker processes gives the same volume and histogram"""
+        import io
+        import numpy as np
+        from apps.schematics import parallel
+        from apps.schematics.formats import read_blocks
+
+        monkeypatch.setattr(parallel, 'PARALLEL_MIN_BLOCKS', 0)
+        data = build_litematic(self._regions())
+
+        sequential = read_blocks(io.BytesIO(data))
+        volume = read_blocks(io.BytesIO(data), workers=2)
+
+        assert volume.counts is not None
+        assert volume.palette == sequential.palette
+        assert np.array_equal(volume.blocks, sequential.blocks)
+        assert volume.histogram().tolist() == np.bincount(
+            sequential.blocks.ravel(), minlength=len(sequential.palette)
+        ).tolist()
+
+    def test_overlapping_regions_decode_in_process(self, monkeypatch):
+        """Test that overlapping or small region sets are left to the sequential decoder"""
+        from apps.schematics import parallel
+        from apps.schematics.blockdata import pack_bits
+
+        def region(position):
+            return {'position': position, 'size': (2, 2, 2), 'palette': ['minecraft:air', 'minecraft:stone'],
+                    'states': pack_bits([1] * 8, 2)}
+
+        assert parallel.decode_regions([region((0, 0, 0)), region((4, 0, 0))], 2) is None
+        monkeypatch.setattr(parallel, 'PARALLEL_MIN_BLOCKS', 0)
+        assert parallel.decode_regions([region((0, 0, 0)), region((1, 1, 1))], 2) is None
+        assert parallel.decode_regions([region((0, 0, 0)), region((2, 0, 0))], 1) is None
+        assert parallel.decode_regions([region((0, 0, 0)), region((2, 0, 0))], 2) is not None
+
+
+@pytest.mark.django_db
+class TestBlockHistogram:
+    """Test block material histograms and the contains filter"""
+
+    def setup_method(self):
+        """Set up test client and user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.list_url = reverse('schematic-list')
+
+    def _create(self, title, histogram):
+        from apps.schematics.histogram import save_block_histogram
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title=title,
+            file='test.schematic',
+            file_size=1024,
+            file_hash='abc123',
+            is_public=True,
+            scan_status='clean'
+        )
+        save_block_histogram(schematic, histogram)
+        return schematic
+
+    def test_block_histogram_skips_air(self):
+        """Test that histograms are keyed by block state and leave out air"""
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+        from apps.schematics.histogram import block_histogram
+
+        volume = BlockVolume(
+            'sponge',
+            ['minecraft:air', 'minecraft:stone', 'minecraft:cave_air', 'minecraft:stone'],
+            np.array([0, 1, 1, 2, 3, 0], dtype=np.uint32).reshape(1, 2, 3)
+        )
+
+        assert block_histogram(volume) == {'minecraft:stone': 3}
+
+    def test_block_states_are_interned(self):
+        """Test that block states are shared between schematics"""
+        from apps.schematics.models import BlockState
+
+        self._create('First', {'minecraft:stone': 10, 'minecraft:oak_stairs[facing=north]': 2})
+        self._create('Second', {'minecraft:stone': 5})
+
+        assert BlockState.objects.count() == 2
+        assert BlockState.objects.get(name='minecraft:oak_stairs[facing=north]').block == 'minecraft:oak_stairs'
+
+    def test_filter_contains_min_count(self):
+        """Test filtering schematics by block material and minimum count"""
+        self._create('Redstone Heavy', {'minecraft:redstone_block': 150, 'minecraft:stone': 10})
+        self._create('Redstone Light', {'minecraft:redstone_block': 20})
+        self._create('No Redstone', {'minecraft:stone': 500})
+
+        response = self.client.get(self.list_url, {'contains': 'minecraft:redstone_block', 'min_count': 100})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [result['title'] for result in response.data['results']] == ['Redstone Heavy']
+
+        response = self.client.get(self.list_url, {'contains': 'redstone_block'})
+        assert len(response.data['results']) == 2
+
+    def test_filter_contains_sums_block_states(self):
+        """Test that a bare block id matches every state of the block"""
+        self._create('Stairs', {
+            'minecraft:oak_stairs[facing=north]': 60,
+            'minecraft:oak_stairs[facing=south]': 60,
+        })
+
+        response = self.client.get(self.list_url, {'contains': 'minecraft:oak_stairs', 'min_count': 100})
+        assert len(response.data['results']) == 1
+
+        response = self.client.get(
+            self.list_url, {'contains': 'minecraft:oak_stairs[facing=north]', 'min_count': 100}
+        )
+        assert len(response.data['results']) == 0
+
+    def test_materials_endpoint(self):
+        """Test listing the material histogram of a schematic"""
+        schematic = self._create('Materials', {'minecraft:stone': 10, 'minecraft:glass': 30})
+
+        url = reverse('schematic-materials', kwargs={'pk': schematic.id})
+        response = self.client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0] == {'block_state': 'minecraft:glass', 'block': 'minecraft:glass', 'count': 30}
+        assert len(response.data) == 2
+
+    def test_process_stores_histogram(self):
+        """Test that processing a clean schematic stores its histogram"""
+        from django.core.files.base import ContentFile
+        from apps.schematics.tasks import process_schematic_task
+
+        data = build_sponge_schematic(
+            2, 1, 2, {'minecraft:air': 0, 'minecraft:stone': 1, 'minecraft:redstone_block': 2}, [1, 2, 2, 0]
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Histogram Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            scan_status='clean'
+        )
+        schematic.file.save('histogram.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        process_schematic_task(str(schematic.id))
+
+        counts = {entry.block_state.name: entry.count for entry in schematic.block_counts.all()}
+        assert counts == {'minecraft:stone': 1, 'minecraft:redstone_block': 2}
+        schematic.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestThumbnailRendering:
+    """Test isometric thumbnail rendering"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def test_block_colors(self):
+        """Test that dyed and wooden variants share their base color"""
+        from apps.schematics.rendering import DYE_COLORS, WOOD_COLORS, block_color
+
+        assert block_color('minecraft:light_blue_wool') == DYE_COLORS['light_blue']
+        assert block_color('minecraft:blue_concrete') == DYE_COLORS['blue']
+        assert block_color('minecraft:dark_oak_planks') == WOOD_COLORS['dark_oak']
+        assert block_color('minecraft:oak_stairs[facing=north]') == WOOD_COLORS['oak']
+        assert block_color('mymod:strange_block') == block_color('mymod:strange_block')
+
+    def test_downsample_bounds_grid(self):
+        """Test that the LOD grid never exceeds max_cells per axis"""
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+        from apps.schematics.rendering import downsample
+
+        blocks = np.zeros((30, 130, 200), dtype=np.uint32)
+        blocks[:, :, :100] = 1
+        volume = BlockVolume('sponge', ['minecraft:air', 'minecraft:stone'], blocks)
+
+        filled, colors, factor = downsample(volume, 64)
+
+        assert factor == 4
+        assert filled.shape == (8, 33, 50)
+        assert filled[:, :, :25].all()
+        assert not filled[:, :, 25:].any()
+        assert tuple(colors[0, 0, 0]) == (125, 125, 125)
+
+    def test_downsample_averages_colors(self):
+        """Test that a cell takes the mean color of its visible blocks"""
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+        from apps.schematics.rendering import downsample
+
+        palette = ['minecraft:air', 'minecraft:white_wool', 'minecraft:black_wool']
+        blocks = np.array([1, 2, 0, 0], dtype=np.uint32).reshape(1, 2, 2)
+        volume = BlockVolume('sponge', palette, blocks)
+
+        filled, colors, factor = downsample(volume, 1)
+
+        assert factor == 2
+        assert filled.tolist() == [[[True]]]
+        assert tuple(colors[0, 0, 0]) == (127, 128, 131)
+
+    def test_render_thumbnail_png(self):
+        """Test rendering a volume to a square PNG"""
+        import io
+        import numpy as np
+        from PIL import Image
+        from apps.schematics.formats import BlockVolume
+        from apps.schematics.rendering import render_thumbnail
+
+        blocks = np.ones((4, 4, 4), dtype=np.uint32)
+        volume = BlockVolume('sponge', ['minecraft:air', 'minecraft:stone'], blocks)
+
+        image = Image.open(io.BytesIO(render_thumbnail(volume, size=128)))
+
+        assert image.format == 'PNG'
+        assert image.size == (128, 128)
+        assert image.getbbox() is not None
+
+    def test_render_task_sets_thumbnail_url(self):
+        """Test that the render task stores the PNG and links it"""
+        from django.core.files.base import ContentFile
+        from apps.schematics.tasks import render_thumbnail_task
+
+        data = build_sponge_schematic(
+            2, 2, 2, {'minecraft:air': 0, 'minecraft:stone': 1}, [1, 1, 1, 1, 1, 0, 0, 0]
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Rendered Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            scan_status='clean'
+        )
+        schematic.file.save('rendered.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        url = render_thumbnail_task(str(schematic.id))
+
+        schematic.refresh_from_db()
+        assert schematic.thumbnail_url == url
+        assert url.endswith(f'thumbnails/{schematic.id}.png')
+        assert schematic.file.storage.exists(f'thumbnails/{schematic.id}.png')
+        schematic.file.storage.delete(f'thumbnails/{schematic.id}.png')
+        schematic.file.delete(save=False)
+
+    def test_processing_renders_thumbnail_from_its_volume(self):
+        """Test that processing links a thumbnail without decoding the blocks a second time"""
+        from unittest.mock import patch
+        from django.core.files.base import ContentFile
+        from apps.schematics import formats
+        from apps.schematics.tasks import process_schematic_task
+
+        data = build_sponge_schematic(
+            2, 2, 2, {'minecraft:air': 0, 'minecraft:stone': 1}, [1, 1, 1, 1, 1, 0, 0, 0]
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Processed Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            scan_status='clean'
+        )
+        schematic.file.save('processed.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        with patch.object(formats, 'read_blocks', wraps=formats.read_blocks) as read_blocks:
+            process_schematic_task(str(schematic.id))
+
+        assert read_blocks.call_count == 1
+        schematic.refresh_from_db()
+        assert schematic.thumbnail_url.endswith(f'thumbnails/{schematic.id}.png')
+        schematic.file.storage.delete(f'thumbnails/{schematic.id}.png')
+        schematic.file.delete(save=False)
+
+    def test_processing_continues_past_failed_outputs(self):
+        """Test that a failed histogram or preview save does not skip the signature and thumbnail"""
+        from unittest.mock import patch
+        from django.core.files.base import ContentFile
+        from django.db import DatabaseError
+        from apps.schematics.models import SchematicSignature
+        from apps.schematics.tasks import process_schematic_task
+
+        data = build_sponge_schematic(
+            2, 2, 2, {'minecraft:air': 0, 'minecraft:stone': 1}, [1, 1, 1, 1, 1, 0, 0, 0]
+        )
+        schematic = Schematic(
+            owner=self.user,
+            title='Processed Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            scan_status='clean'
+        )
+        schematic.file.save('processed.schem', ContentFile(data), save=False)
+        schematic.save()
+
+        with patch('apps.schematics.histogram.save_block_histogram', side_effect=DatabaseError('locked')), \
+                patch('apps.schematics.preview.save_previews', side_effect=OSError('storage down')):
+            metadata = process_schematic_task(str(schematic.id))
+
+        assert metadata['block_count'] == 5
+        assert SchematicSignature.objects.filter(schematic=schematic).exists()
+        schematic.refresh_from_db()
+        assert schematic.thumbnail_url.endswith(f'thumbnails/{schematic.id}.png')
+        schematic.file.storage.delete(f'thumbnails/{schematic.id}.png')
+        schematic.file.delete(save=False)
+
+    def test_render_task_skips_unscanned(self):
+        """Test that files which have not passed the scan are not rendered"""
+        from apps.schematics.tasks import render_thumbnail_task
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Pending Schematic',
+            file='test.schematic',
+            file_size=1024,
+            file_hash='abc123',
+            scan_status='pending'
+        )
+
+        assert render_thumbnail_task(str(schematic.id)) is None
+
+
+@pytest.mark.django_db
+class TestSchematicPreview:
+    """Test binary preview LODs and the preview endpoint"""
+
+    def setup_method(self):
+        """Set up test client and user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _volume(self):
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+
+        blocks = np.zeros((20, 40, 40), dtype=np.uint32)
+        blocks[:10] = 1
+        blocks[:10, :, :8] = 2
+        return BlockVolume('sponge', ['minecraft:air', 'minecraft:stone', 'minecraft:red_wool'], blocks)
+
+    def _processed(self):
+        from django.core.files.base import ContentFile
+        from apps.schematics.tasks import process_schematic_task
+
+        indices = [1] * 8 + [0] * 8
+        data = build_sponge_schematic(4, 1, 4, {'minecraft:air': 0, 'minecraft:stone': 1}, indices)
+        schematic = Schematic(
+            owner=self.user,
+            title='Preview Schematic',
+            file_size=len(data),
+            file_hash='abc123',
+            is_public=True,
+            scan_status='clean'
+        )
+        schematic.file.save('preview.schem', ContentFile(data), save=False)
+        schematic.save()
+        process_schematic_task(str(schematic.id))
+        schematic.refresh_from_db()
+        return schematic
+
+    def _cleanup(self, schematic):
+        storage = schematic.file.storage
+        for lod in schematic.preview_data['lods']:
+            storage.delete(lod['name'])
+        storage.delete(f'thumbnails/{schematic.id}.png')
+        schematic.file.delete(save=False)
+
+    def test_lod_round_trip(self):
+        """Test that an encoded LOD decodes back to the same grid"""
+        import numpy as np
+        from apps.schematics.preview import decode_lod, encode_lod
+        from apps.schematics.rendering import DYE_COLORS
+
+        grid = np.zeros((3, 20, 17), dtype=np.uint16)
+        grid[0] = 1
+        grid[1, 5:18, 3:9] = 2
+        colors = [(0, 0, 0), (125, 125, 125), DYE_COLORS['red']]
+
+        body, data_offset, chunks = encode_lod(grid, 1, 4, colors)
+        decoded = decode_lod(body)
+
+        assert chunks == 4
+        assert decoded['level'] == 1
+        assert decoded['factor'] == 4
+        assert decoded['colors'].tolist() == [list(color) for color in colors]
+        assert np.array_equal(decoded['grid'], grid)
+
+    def test_build_previews_levels(self):
+        """Test that each LOD stays within its size and duplicate factors are skipped"""
+        from apps.schematics.preview import build_previews, decode_lod
+
+        previews = build_previews(self._volume(), [8, 9, 16, 64])
+
+        assert [descriptor['factor'] for descriptor, _ in previews] == [5, 3, 1]
+        coarse = decode_lod(previews[0][1])
+        assert coarse['grid'].shape == (4, 8, 8)
+        # The dominant block wins each cell
+        assert coarse['grid'][0, 0, 0] == 2
+        assert coarse['grid'][0, 0, 4] == 1
+        assert not coarse['grid'][2:].any()
+
+    def test_process_stores_previews(self):
+        """Test that processing stores LODs and a small descriptor"""
+        schematic = self._processed()
+
+        descriptor = schematic.preview_data
+        assert descriptor['encoding'] == 'rle-chunked'
+        assert len(descriptor['lods']) == 1
+        assert schematic.file.storage.exists(descriptor['lods'][0]['name'])
+
+        url = reverse('schematic-detail', kwargs={'pk': schematic.id})
+        response = self.client.get(url)
+        lod = response.data['preview_data']['lods'][0]
+        assert lod['url'].endswith(f'/api/schematics/{schematic.id}/preview/0/')
+        assert 'name' not in lod
+        self._cleanup(schematic)
+
+    def test_preview_endpoint_ranges(self):
+        """Test full, partial and unsatisfiable preview requests"""
+        from apps.schematics.preview import decode_lod
+
+        schematic = self._processed()
+        url = reverse('schematic-preview', kwargs={'pk': schematic.id, 'level': 0})
+        size = schematic.preview_data['lods'][0]['size']
+
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Accept-Ranges'] == 'bytes'
+        body = b''.join(response.streaming_content)
+        assert decode_lod(body)['grid'].shape == (1, 4, 4)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3')
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == b'SCPV'
+        assert response['Content-Range'] == f'bytes 0-3/{size}'
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        assert response.content == body[-4:]
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={size}-')
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+        response = self.client.get(reverse('schematic-preview', kwargs={'pk': schematic.id, 'level': 5}))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        self._cleanup(schematic)
+
+
+@pytest.mark.django_db
+class TestUploadDeduplication:
+    """Test that identical uploads share a clean blob"""
+
+    def setup_method(self):
+        """Set up test client and users"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='testpass123'
+        )
+        self.list_url = reverse('schematic-list')
+
+    def _upload(self, data, name='castle.schem'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        self.client.force_authenticate(user=self.other_user)
+        return self.client.post(self.list_url, {
+            'title': 'Uploaded Castle',
+            'file': SimpleUploadedFile(name, data, content_type='application/octet-stream'),
+        }, format='multipart')
+
+    def test_identical_upload_reuses_clean_blob(self):
+        """Test that a known clean file skips the scan and inherits the verdict"""
+        import hashlib
+        from unittest.mock import patch
+        from django.core.files.base import ContentFile
+        from apps.storage.blobs import register_blob
+
+        data = b'identical schematic bytes'
+        original = Schematic(
+            owner=self.user,
+            title='Original',
+            file_size=len(data),
+            file_hash=hashlib.sha256(data).hexdigest(),
+            scan_status='clean',
+            scan_result={'is_infected': False, 'virus_name': None, 'status': 'clean'}
+        )
+        original.file.save('original.schem', ContentFile(data), save=False)
+        original.save()
+        blob = register_blob(original)
+
+        with patch('apps.schematics.views.queue_scan') as mock_scan, \
+                patch('apps.schematics.views.process_schematic_task') as mock_process:
+            response = self._upload(data)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_not_called()
+        mock_process.delay.assert_called_once()
+
+        upload = Schematic.objects.get(title='Uploaded Castle')
+        assert upload.scan_status == 'clean'
+        assert upload.scan_result == original.scan_result
+        assert upload.blob == blob
+        assert upload.file.name == original.file.name
+        blob.refresh_from_db()
+        assert blob.ref_count == 2
+        # The copy is reported with the upload, before any processing
+        assert response.data['id'] == str(upload.id)
+        assert response.data['possible_duplicates'] == [
+            {'id': str(original.id), 'title': 'Original', 'owner': 'testuser', 'similarity': 1.0}
+        ]
+        original.file.delete(save=False)
+
+    def test_new_content_is_scanned(self):
+        """Test that unknown content is stored and queued for scanning"""
+        from unittest.mock import patch
+
+        with patch('apps.schematics.views.queue_scan') as mock_scan:
+            response = self._upload(b'brand new bytes')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_called_once()
+        assert response.data['possible_duplicates'] == []
+        upload = Schematic.objects.get(title='Uploaded Castle')
+        assert upload.scan_status == 'pending'
+        assert upload.blob is None
+        assert upload.file.name.startswith('quarantine/')
+        upload.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestNearDuplicates:
+    """Test MinHash near-duplicate detection"""
+
+    def setup_method(self):
+        """Set up test client and users"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='testpass123'
+        )
+
+    def _build(self, seed):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        blocks = np.zeros((12, 24, 24), dtype=np.uint32)
+        blocks[:8, 2:22, 2:22] = rng.integers(1, 4, size=(8, 20, 20))
+        return blocks
+
+    def _volume(self, blocks, palette=None):
+        from apps.schematics.formats import BlockVolume
+
+        palette = palette or ['minecraft:air', 'minecraft:stone', 'minecraft:oak_planks', 'minecraft:glass']
+        return BlockVolume('sponge', palette, blocks)
+
+    def _indexed(self, owner, title, volume, is_public=True):
+        from apps.schematics.similarity import minhash_signature, save_signature
+
+        schematic = Schematic.objects.create(
+            owner=owner,
+            title=title,
+            file='test.schematic',
+            file_size=1024,
+            file_hash=title,
+            is_public=is_public,
+            scan_status='clean'
+        )
+        save_signature(schematic, *minhash_signature(volume))
+        return schematic
+
+    def test_signature_ignores_palette_order(self):
+        """Test that re-serializing with another palette order gives the same signature"""
+        import numpy as np
+        from apps.schematics.similarity import minhash_signature
+
+        blocks = self._build(1)
+        reordered = np.array([0, 3, 1, 2], dtype=np.uint32)[blocks]
+        palette = ['minecraft:air', 'minecraft:oak_planks', 'minecraft:glass', 'minecraft:stone']
+
+        first, shingles = minhash_signature(self._volume(blocks))
+        second, _ = minhash_signature(self._volume(reordered, palette))
+
+        assert shingles == int((blocks != 0).sum())
+        assert np.array_equal(first, second)
+
+    def test_similarity_of_edits(self):
+        """Test that light edits stay similar and unrelated builds do not"""
+        import numpy as np
+        from apps.schematics.similarity import estimate_similarity, minhash_signature
+
+        blocks = self._build(1)
+        edited = blocks.copy()
+        edited[0, 2:22, 2:4] = 1
+
+        original, _ = minhash_signature(self._volume(blocks))
+        assert estimate_similarity(original, minhash_signature(self._volume(edited))[0]) >= 0.8
+        assert estimate_similarity(original, minhash_signature(self._volume(self._build(2)))[0]) < 0.3
+        assert not np.array_equal(original, minhash_signature(self._volume(edited))[0])
+
+    def test_find_near_duplicates(self):
+        """Test that LSH lookup returns near copies and skips unrelated builds"""
+        from apps.schematics.similarity import find_near_duplicates
+
+        blocks = self._build(1)
+        original = self._indexed(self.user, 'Original', self._volume(blocks))
+        edited = blocks.copy()
+        edited[0, 2:22, 2:4] = 1
+        copy = self._indexed(self.other_user, 'Copy', self._volume(edited))
+        self._indexed(self.other_user, 'Unrelated', self._volume(self._build(2)))
+
+        matches = find_near_duplicates(copy)
+
+        assert [match.title for match, _ in matches] == ['Original']
+        assert matches[0][1] >= 0.8
+        assert find_near_duplicates(original)[0][0] == copy
+
+    def test_owner_sees_possible_duplicates(self):
+        """Test that only the owner gets the warning and never sees others' private schematics"""
+        blocks = self._build(1)
+        self._indexed(self.other_user, 'Public Original', self._volume(blocks))
+        self._indexed(self.other_user, 'Private Original', self._volume(blocks), is_public=False)
+        rejected = self._indexed(self.other_user, 'Rejected Original', self._volume(blocks))
+        Schematic.objects.filter(id=rejected.id).update(scan_status='rejected')
+        upload = self._indexed(self.user, 'Upload', self._volume(blocks))
+        url = reverse('schematic-detail', kwargs={'pk': upload.id})
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(url)
+        duplicates = response.data['possible_duplicates']
+        assert [duplicate['title'] for duplicate in duplicates] == ['Public Original']
+        assert duplicates[0]['similarity'] == 1.0
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(url)
+        assert response.data['possible_duplicates'] is None
+
+    def test_admin_lists_possible_duplicates(self):
+        """Test the possible duplicates field of SchematicAdmin"""
+        from django.contrib.admin.sites import site
+
+        blocks = self._build(1)
+        self._indexed(self.other_user, 'Original', self._volume(blocks))
+        upload = self._indexed(self.user, 'Upload', self._volume(blocks))
+
+        html = site._registry[Schematic].possible_duplicates(upload)
+
+        assert 'Original' in html
+        assert '100%' in html
+
+
+@pytest.mark.django_db
+class TestSchematicConversion:
+    """Test format conversion and converted downloads"""
+
+    def setup_method(self):
+        """Set up test client and user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _volume(self, palette=None):
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+
+        palette = palette or [
+            'minecraft:stone', 'minecraft:air', 'minecraft:oak_stairs[facing=north,half=top]', 'minecraft:glass'
+        ]
+        blocks = np.random.default_rng(0).integers(0, len(palette), size=(5, 6, 7)).astype(np.uint32)
+        return BlockVolume('sponge', palette, blocks, 3465)
+
+    def _round_trip(self, volume, target):
+        import io
+        from apps.schematics.conversion import convert
+        from apps.schematics.formats import read_blocks
+
+        stream = io.BytesIO()
+        convert(volume, target, stream, name='Test')
+        stream.seek(0)
+        return read_blocks(stream)
+
+    def _states(self, volume):
+        return [volume.palette[index] for index in volume.blocks.ravel()]
+
+    def test_convert_to_sponge(self):
+        """Test that a Sponge conversion decodes to the same blocks"""
+        volume = self._volume()
+        converted = self._round_trip(volume, 'schem')
+
+        assert converted.format == 'sponge'
+        assert converted.data_version == 3465
+        assert self._states(converted) == self._states(volume)
+
+    def test_convert_to_litematic(self):
+        """Test that a Litematica conversion puts air first and decodes to the same blocks"""
+        volume = self._volume()
+        converted = self._round_trip(volume, 'litematic')
+
+        assert converted.format == 'litematic'
+        assert converted.palette[0] == 'minecraft:air'
+        assert self._states(converted) == self._states(volume)
+
+    def test_convert_to_mcedit(self):
+        """Test MCEdit conversion of blocks that have a legacy id"""
+        volume = self._volume(['minecraft:air', 'minecraft:stone', 'minecraft:cave_air', 'minecraft:glass'])
+        converted = self._round_trip(volume, 'schematic')
+
+        expected = ['minecraft:air' if state == 'minecraft:cave_air' else state for state in self._states(volume)]
+        assert converted.format == 'mcedit'
+        assert self._states(converted) == expected
+
+    def test_convert_to_mcedit_rejects_modern_blocks(self):
+        """Test that blocks without a legacy id cannot be written as MCEdit"""
+        import io
+        from apps.schematics.conversion import ConversionError, convert
+
+        volume = self._volume(['minecraft:air', 'minecraft:deepslate'])
+
+        with pytest.raises(ConversionError, match='minecraft:deepslate'):
+            convert(volume, 'schematic', io.BytesIO())
+
+    def test_convert_legacy_to_sponge_is_refused(self):
+        """Test that pre-1.13 blocks are not written under flattened Sponge palettes"""
+        import io
+        import numpy as np
+        from apps.schematics.conversion import ConversionError, convert
+        from apps.schematics.formats import BlockVolume
+
+        volume = BlockVolume('mcedit', ['minecraft:air', 'minecraft:wool'], np.ones((2, 2, 2), dtype=np.uint32))
+
+        with pytest.raises(ConversionError, match='Pre-1.13'):
+            convert(volume, 'schem', io.BytesIO())
+        converted = self._round_trip(volume, 'litematic')
+        assert converted.data_version == 1343
+
+    def test_convert_without_data_version(self):
+        """Test that both writers fall back to 1.13 for modern blocks without a DataVersion"""
+        import numpy as np
+        from apps.schematics.formats import BlockVolume
+
+        volume = BlockVolume('sponge', ['minecraft:air', 'minecraft:stone'], np.ones((2, 2, 2), dtype=np.uint32))
+
+        assert self._round_trip(volume, 'schem').data_version == 1519
+        assert self._round_trip(volume, 'litematic').data_version == 1519
+
+    def _clean_schematic(self, scan_status='clean'):
+        from django.core.files.base import ContentFile
+
+        indices = [1, 2, 0, 1] * 4
+        palette = {'minecraft:air': 0, 'minecraft:stone': 1, 'minecraft:glass': 2}
+        data = build_sponge_schematic(4, 1, 4, palette, indices)
+        schematic = Schematic(
+            owner=self.user,
+            title='Convertible',
+            file_size=len(data),
+            file_hash='convert123',
+            is_public=True,
+            scan_status=scan_status
+        )
+        schematic.file.save('convertible.schem', ContentFile(data), save=False)
+        schematic.save()
+        return schematic
+
+    def test_download_converted(self):
+        """Test downloading as another format converts once and reuses the cached file"""
+        from unittest.mock import patch
+        from apps.schematics import conversion
+        from apps.schematics.formats import read_blocks
+
+        self.client.force_authenticate(user=self.user)
+        schematic = self._clean_schematic()
+        storage = schematic.file.storage
+        url = reverse('schematic-download', kwargs={'pk': schematic.id})
+        name = conversion.converted_name('convert123', 'litematic', 'Convertible')
+        try:
+            response = self.client.post(f'{url}?format=litematic')
+
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['file_name'].endswith('.litematic')
+            assert storage.exists(name)
+            assert response.data['file_size'] == storage.size(name)
+            with storage.open(name) as converted:
+                assert read_blocks(converted).format == 'litematic'
+
+            with patch.object(conversion, 'convert') as convert:
+                response = self.client.post(f'{url}?format=litematic')
+            assert response.status_code == status.HTTP_200_OK
+            convert.assert_not_called()
+
+            schematic.refresh_from_db()
+            assert schematic.download_count == 2
+        finally:
+            conversion.delete_converted(storage, 'convert123')
+            schematic.file.delete(save=False)
+
+    def test_converted_cache_is_keyed_by_title(self):
+        """Test that formats embedding the title are converted again for another title"""
+        import gzip
+        from apps.schematics.conversion import converted_file, converted_name, delete_converted
+
+        schematic = self._clean_schematic()
+        storage = schematic.file.storage
+        try:
+            first = converted_file(schematic, 'litematic')
+            schematic.title = 'Renamed'
+            second = converted_file(schematic, 'litematic')
+
+            assert first != second
+            assert second == converted_name('convert123', 'litematic', 'Renamed')
+            with storage.open(second) as converted:
+                assert b'Renamed' in gzip.GzipFile(fileobj=converted).read()
+            assert converted_file(schematic, 'schematic') == converted_name('convert123', 'schematic')
+        finally:
+            delete_converted(storage, 'convert123')
+            schematic.file.delete(save=False)
+        assert not storage.exists(first)
+        assert not storage.exists(second)
+
+    def test_download_same_format(self):
+        """Test that asking for the source format serves the original file without decoding it"""
+        from unittest.mock import patch
+        from apps.schematics.conversion import converted_name
+
+        self.client.force_authenticate(user=self.user)
+        schematic = self._clean_schematic()
+        url = reverse('schematic-download', kwargs={'pk': schematic.id})
+        try:
+            with patch('apps.schematics.conversion.read_blocks') as read_blocks:
+                response = self.client.post(f'{url}?format=schem')
+            read_blocks.assert_not_called()
+
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['download_url'] == schematic.file.url
+            assert not schematic.file.storage.exists(converted_name('convert123', 'schem'))
+        finally:
+            schematic.file.delete(save=False)
+
+    def test_download_conversion_errors(self):
+        """Test unknown formats, pending scans and unconvertible content"""
+        from unittest.mock import patch
+        from apps.schematics.conversion import ConversionError
+
+        self.client.force_authenticate(user=self.user)
+        schematic = self._clean_schematic(scan_status='pending')
+        url = reverse('schematic-download', kwargs={'pk': schematic.id})
+        try:
+            response = self.client.post(f'{url}?format=dwg')
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+            response = self.client.post(f'{url}?format=litematic')
+            assert response.status_code == status.HTTP_409_CONFLICT
+
+            Schematic.objects.filter(id=schematic.id).update(scan_status='clean')
+            with patch('apps.schematics.views.converted_file', side_effect=ConversionError('too new')):
+                response = self.client.post(f'{url}?format=schematic')
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+            assert 'too new' in response.data['error']
+
+            schematic.refresh_from_db()
+            assert schematic.download_count == 0
+        finally:
+            schematic.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestInlineUploadScan:
+    """Test scanning small uploads in the request that hashes them"""
+
+    def setup_method(self):
+        """Set up test client, user and a fake clamd"""
+        from apps.scanning.fakeclamd import FakeClamd
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.list_url = reverse('schematic-list')
+        self.clamd = FakeClamd()
+
+    def teardown_method(self):
+        """Stop the fake clamd"""
+        from apps.scanning.sessions import get_session_pool
+
+        get_session_pool('127.0.0.1', self.clamd.port).close()
+        self.clamd.stop()
+
+    def _upload(self, settings, data, max_size=1024 * 1024):
+        from unittest.mock import patch
+
+        settings.CLAMAV_HOST = '127.0.0.1'
+        settings.CLAMAV_PORT = self.clamd.port
+        settings.INLINE_SCAN_MAX_SIZE = max_size
+        self.client.force_authenticate(user=self.user)
+        with patch('apps.schematics.views.queue_scan') as mock_scan, \
+                patch('apps.schematics.tasks.process_schematic_task') as mock_process:
+            response = self.client.post(self.list_url, {
+                'title': 'Inline Castle',
+                'file': SimpleUploadedFile('castle.schem', data, content_type='application/octet-stream'),
+            }, format='multipart')
+        return response, mock_scan, mock_process
+
+    def test_clean_upload_leaves_request_scanned(self, settings):
+        """Test that a small clean upload is marked clean without a scan task"""
+        response, mock_scan, mock_process = self._upload(settings, b'clean schematic bytes' * 1000)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_not_called()
+        mock_process.delay.assert_called_once()
+        assert 'zINSTREAM' in self.clamd.commands
+
+        upload = Schematic.objects.get(title='Inline Castle')
+        assert upload.scan_status == 'clean'
+        assert upload.scan_result['status'] == 'clean'
+        assert upload.scanned_at is not None
+        assert upload.blob is not None
+        upload.file.delete(save=False)
+
+    def test_infected_upload_is_refused(self, settings):
+        """Test that an infected upload is never stored and flags the uploader"""
+        response, mock_scan, mock_process = self._upload(settings, b'xx EICAR xx')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'file' in response.data
+        mock_scan.assert_not_called()
+        assert not Schematic.objects.filter(title='Inline Castle').exists()
+        self.user.refresh_from_db()
+        assert self.user.infected_upload_count == 1
+        assert self.user.storage_used == 0
+
+    def test_large_upload_falls_back_to_task(self, settings):
+        """Test that uploads above INLINE_SCAN_MAX_SIZE are left to scan_file_task"""
+        response, mock_scan, mock_process = self._upload(settings, b'x' * 4096, max_size=1024)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_called_once()
+        assert 'zINSTREAM' not in self.clamd.commands
+        upload = Schematic.objects.get(title='Inline Castle')
+        assert upload.scan_status == 'pending'
+        upload.file.delete(save=False)
+
+    def test_known_clean_content_is_not_rescanned(self, settings):
+        """Test that content matching a clean blob shares it without reaching clamd"""
+        from apps.storage.blobs import register_blob
+
+        data = b'clean schematic bytes' * 1000
+        self._upload(settings, data)
+        original = Schematic.objects.get(title='Inline Castle')
+        register_blob(original)
+        self.clamd.commands.clear()
+
+        response, mock_scan, mock_process = self._upload(settings, data)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_not_called()
+        assert 'zINSTREAM' not in self.clamd.commands
+        upload = Schematic.objects.exclude(id=original.id).get(title='Inline Castle')
+        assert upload.blob == original.blob
+        original.file.delete(save=False)
+
+    def test_inline_results_feed_verdicts_and_breaker(self, settings):
+        """Test that inline verdicts are cached and inline clamd failures trip the breaker"""
+        from django.core.cache import cache
+        from apps.scanning import breaker
+        from apps.scanning.models import ScanVerdict
+        from apps.scanning.sessions import get_session_pool
+
+        settings.CACHES = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'inline-scan-tests'}
+        }
+        cache.clear()
+        self._upload(settings, b'clean schematic bytes' * 1000)
+        upload = Schematic.objects.get(title='Inline Castle')
+        assert ScanVerdict.objects.get(file_hash=upload.file_hash).scan_result['status'] == 'clean'
+        upload.file.delete(save=False)
+        upload.delete()
+
+        settings.CLAMD_BREAKER_THRESHOLD = 1
+        get_session_pool('127.0.0.1', self.clamd.port).close()
+        self.clamd.stop()
+        response, mock_scan, _ = self._upload(settings, b'other schematic bytes')
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_called_once()
+        assert breaker.is_open()
+        Schematic.objects.get(title='Inline Castle').file.delete(save=False)
+        cache.clear()
+
+    def test_open_breaker_skips_inline_scan(self, settings):
+        """Test that uploads go straight to the scan queue while clamd is known to be down"""
+        from unittest.mock import patch
+
+        with patch('apps.scanning.breaker.is_open', return_value=True):
+            response, mock_scan, mock_process = self._upload(settings, b'clean schematic bytes')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_called_once()
+        assert not self.clamd.commands
+        upload = Schematic.objects.get(title='Inline Castle')
+        assert upload.scan_status == 'pending'
+        upload.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestResumableUpload:
+    """Test uploading a schematic in byte ranges through an upload session"""
+
+    def setup_method(self):
+        """Set up test client and user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.data = bytes(range(256)) * 40
+
+    def _start(self, name='castle.schem', size=None):
+        return self.client.post(reverse('upload-session-list'), {
+            'file_name': name,
+            'file_size': len(self.data) if size is None else size,
+        }, format='json')
+
+    def _put(self, session_id, start, end, data=None, **headers):
+        return self.client.generic(
+            'PUT', reverse('upload-session-detail', args=[session_id]),
+            self.data[start:end + 1] if data is None else data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}',
+            **headers
+        )
+
+    def test_chunked_upload_and_finalize(self):
+        """Test that chunks are appended in place and finalize hashes the stored file"""
+        import base64
+        import hashlib
+        from unittest.mock import patch
+        from apps.storage.models import UploadSession
+
+        response = self._start()
+        assert response.status_code == status.HTTP_201_CREATED
+        session_id = response.data['id']
+        assert response.data['offset'] == 0
+
+        chunk = hashlib.sha256(self.data[:4000]).digest()
+        response = self._put(
+            session_id, 0, 3999, HTTP_CONTENT_DIGEST=f'sha-256=:{base64.b64encode(chunk).decode()}:'
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['offset'] == 4000
+
+        # Resuming from GET after a dropped connection
+        assert self.client.get(reverse('upload-session-detail', args=[session_id])).data['offset'] == 4000
+        assert self._put(session_id, 4000, len(self.data) - 1).data['offset'] == len(self.data)
+
+        session = UploadSession.objects.get(id=session_id)
+        assert session.file.name.startswith('quarantine/')
+        with session.file.open('rb') as stored:
+            assert stored.read() == self.data
+
+        with patch('apps.schematics.views.queue_scan') as mock_scan:
+            response = self.client.post(
+                reverse('upload-session-finalize', args=[session_id]),
+                {'title': 'Chunked Castle'}, format='json'
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_called_once()
+
+        schematic = Schematic.objects.get(title='Chunked Castle')
+        assert schematic.file_hash == hashlib.sha256(self.data).hexdigest()
+        assert schematic.file_size == len(self.data)
+        assert schematic.file.name == session.file.name
+        assert schematic.scan_status == 'pending'
+        assert not UploadSession.objects.exists()
+        self.user.refresh_from_db()
+        assert self.user.storage_used == len(self.data)
+        schematic.file.delete(save=False)
+
+    def test_bad_chunks_are_refused(self):
+        """Test that chunks at the wrong offset, of the wrong length or digest are not appended"""
+        import base64
+        from apps.storage.models import UploadSession
+
+        session_id = self._start().data['id']
+        assert self._put(session_id, 0, 999).status_code == status.HTTP_200_OK
+
+        # Replayed or skipped ranges report where to resume
+        response = self._put(session_id, 0, 999)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['offset'] == 1000
+        assert self._put(session_id, 2000, 2999).status_code == status.HTTP_409_CONFLICT
+
+        # Body shorter than the announced range
+        assert self._put(session_id, 1000, 1999, data=b'x' * 10).status_code == status.HTTP_400_BAD_REQUEST
+        wrong_digest = base64.b64encode(b'0' * 32).decode()
+        response = self._put(session_id, 1000, 1999, HTTP_CONTENT_DIGEST=f'sha-256=:{wrong_digest}:')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = self.client.generic(
+            'PUT', reverse('upload-session-detail', args=[session_id]), b'abc',
+            content_type='application/octet-stream'
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        # Finalizing early is refused
+        response = self.client.post(
+            reverse('upload-session-finalize', args=[session_id]), {'title': 'Early'}, format='json'
+        )
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+        session = UploadSession.objects.get(id=session_id)
+        assert session.offset == 1000
+        assert session.file.size == 1000
+
+        # Aborting deletes the partial file
+        name = session.file.name
+        assert self.client.delete(reverse('upload-session-detail', args=[session_id])).status_code == 204
+        assert not session.file.storage.exists(name)
+
+    def test_sessions_are_private_and_validated(self):
+        """Test that sessions check the file up front and are only visible to their owner"""
+        from apps.storage.uploads import abort_upload
+        from apps.storage.models import UploadSession
+
+        assert self._start(name='castle.exe').status_code == status.HTTP_400_BAD_REQUEST
+        assert self._start(size=0).status_code == status.HTTP_400_BAD_REQUEST
+
+        session_id = self._start().data['id']
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        assert self._put(session_id, 0, 999).status_code == status.HTTP_404_NOT_FOUND
+        abort_upload(UploadSession.objects.get(id=session_id))
+
+    def test_finalize_reuses_clean_blob(self, django_capture_on_commit_callbacks):
+        """Test that finalized content already known clean shares the blob and drops the copy"""
+        import hashlib
+        from unittest.mock import patch
+        from django.core.files.base import ContentFile
+        from apps.storage.blobs import register_blob
+        from apps.storage.models import UploadSession
+
+        original = Schematic(
+            owner=self.user,
+            title='Original',
+            file_size=len(self.data),
+            file_hash=hashlib.sha256(self.data).hexdigest(),
+            scan_status='clean',
+            scan_result={'is_infected': False, 'virus_name': None, 'status': 'clean'}
+        )
+        original.file.save('original.schem', ContentFile(self.data), save=False)
+        original.save()
+        blob = register_blob(original)
+
+        session_id = self._start().data['id']
+        self._put(session_id, 0, len(self.data) - 1)
+        partial = UploadSession.objects.get(id=session_id).file
+
+        with django_capture_on_commit_callbacks(execute=True), \
+                patch('apps.schematics.views.queue_scan') as mock_scan, \
+                patch('apps.schematics.views.process_schematic_task') as mock_process:
+            response = self.client.post(
+                reverse('upload-session-finalize', args=[session_id]), {'title': 'Copy'}, format='json'
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+        mock_scan.assert_not_called()
+        mock_process.delay.assert_called_once()
+        copy = Schematic.objects.get(title='Copy')
+        assert copy.blob == blob
+        assert copy.scan_status == 'clean'
+        assert not partial.storage.exists(partial.name)
+        original.file.delete(save=False)
+
+
+@pytest.mark.django_db
+class TestDirectUpload:
+    """Test uploads whose parts go straight to S3 through presigned URLs"""
+
+    def setup_method(self):
+        """Set up test client, user and parts"""
+        import base64
+        import hashlib
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.data = bytes(range(256)) * 40
+        self.checksums = [
+            base64.b64encode(hashlib.sha256(self.data[start:start + 4096]).digest()).decode()
+            for start in range(0, len(self.data), 4096)
+        ]
+
+    def _s3(self, settings):
+        """Point direct uploads at a mocked S3 client"""
+        from contextlib import ExitStack
+        from unittest.mock import MagicMock, PropertyMock, patch
+        from storages.backends.s3boto3 import S3Boto3Storage
+        from apps.storage.backends import QuarantineStorage
+
+        settings.USE_S3 = True
+        settings.UPLOAD_DIRECT_PART_SIZE = 4096
+        client = MagicMock()
+        client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        client.generate_presigned_url.side_effect = lambda operation, Params, ExpiresIn: (
+            f'https://s3.example.com/part-{Params["PartNumber"]}'
+        )
+        stack = ExitStack()
+        connection = stack.enter_context(
+            patch.object(S3Boto3Storage, 'connection', new_callable=PropertyMock)
+        )
+        connection.return_value.meta.client = client
+        stack.enter_context(patch.object(QuarantineStorage, 'exists', return_value=False))
+        return stack, client
+
+    def _start(self):
+        return self.client.post(reverse('upload-session-direct'), {
+            'file_name': 'castle.schem',
+            'file_size': len(self.data),
+            'part_checksums': self.checksums,
+        }, format='json')
+
+    def test_direct_upload_and_finalize(self, settings):
+        """Test that part URLs are signed with their checksums and finalize verifies what S3 holds"""
+        from unittest.mock import patch
+
+        stack, client = self._s3(settings)
+        with stack:
+            response = self._start()
+            assert response.status_code == status.HTTP_201_CREATED
+            session_id = response.data['id']
+            assert [part['size'] for part in response.data['parts']] == [4096, 4096, 2048]
+            assert response.data['parts'][2]['url'] == 'https://s3.example.com/part-3'
+            assert client.create_multipart_upload.call_args.kwargs['ChecksumAlgorithm'] == 'SHA256'
+            signed = client.generate_presigned_url.call_args_list[0].kwargs['Params']
+            assert signed['ChecksumSHA256'] == self.checksums[0]
+
+            # Resuming hands out fresh URLs
+            response = self.client.get(reverse('upload-session-detail', args=[session_id]))
+            assert len(response.data['parts']) == 3
+
+            client.list_parts.return_value = {
+                'Parts': [
+                    {'PartNumber': number, 'ETag': f'"etag-{number}"', 'ChecksumSHA256': checksum,
+                     'Size': min(4096, len(self.data) - (number - 1) * 4096)}
+                    for number, checksum in enumerate(self.checksums, start=1)
+                ],
+                'IsTruncated': False,
+            }
+            client.head_object.return_value = {'ContentLength': len(self.data)}
+            with patch('apps.schematics.views.queue_scan') as mock_scan:
+                response = self.client.post(
+                    reverse('upload-session-finalize', args=[session_id]),
+                    {'title': 'Castle'}, format='json'
+                )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        parts = client.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+        assert [part['ETag'] for part in parts] == ['"etag-1"', '"etag-2"', '"etag-3"']
+        schematic = Schematic.objects.get(id=response.data['id'])
+        # Hashed by the scan, not taken from the client
+        assert schematic.file_hash == ''
+        assert schematic.file.name.startswith('quarantine/')
+        mock_scan.assert_called_once_with(schematic)
+
+    def test_finalize_rejects_mismatched_part(self, settings):
+        """Test that a part S3 holds with another checksum keeps the session open"""
+        from apps.storage.models import UploadSession
+
+        stack, client = self._s3(settings)
+        with stack:
+            session_id = self._start().data['id']
+            client.list_parts.return_value = {
+                'Parts': [
+                    {'PartNumber': number, 'ETag': f'"etag-{number}"', 'ChecksumSHA256': self.checksums[0],
+                     'Size': min(4096, len(self.data) - (number - 1) * 4096)}
+                    for number in range(1, 4)
+                ],
+                'IsTruncated': False,
+            }
+            response = self.client.post(
+                reverse('upload-session-finalize', args=[session_id]),
+                {'title': 'Castle'}, format='json'
+            )
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        client.complete_multipart_upload.assert_not_called()
+        assert UploadSession.objects.filter(id=session_id).exists()
+        assert not Schematic.objects.exists()
+
+    def test_direct_upload_needs_s3_and_all_checksums(self, settings):
+        """Test that direct sessions are refused without S3 or with a wrong number of checksums"""
+        settings.USE_S3 = False
+        assert self._start().status_code == status.HTTP_400_BAD_REQUEST
+
+        stack, client = self._s3(settings)
+        with stack:
+            self.checksums = self.checksums[:2]
+            assert self._start().status_code == status.HTTP_400_BAD_REQUEST
+        client.create_multipart_upload.assert_not_called()
+
+
+@pytest.mark.django_db
+class TestBulkUpload:
+    """Test uploading a zip archive of schematics"""
+
+    def setup_method(self):
+        """Set up test client and user"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _archive(self, members, stored=False):
+        import io
+        import zipfile
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED) as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    def _post(self, data, manifest=None):
+        import json
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        payload = {'archive': SimpleUploadedFile('builds.zip', data, content_type='application/zip')}
+        if manifest is not None:
+            payload['manifest'] = json.dumps(manifest)
+        return self.client.post(reverse('schematic-bulk'), payload, format='multipart')
+
+    def _clean_up(self):
+        from django.core.files.storage import default_storage
+        for schematic in Schematic.objects.all():
+            default_storage.delete(schematic.file.name)
+
+    def test_archive_is_created_in_one_insert_and_one_scan(self):
+        """Test that all members become schematics with one bulk_create and a single batched scan"""
+        from unittest.mock import patch
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        data = self._archive({
+            'builds/keep.schem': b'keep bytes',
+            'builds/tower.litematic': b'tower bytes',
+            'wall.nbt': b'wall bytes',
+            'README.txt': b'not a schematic',
+            '__MACOSX/builds/._keep.schem': b'resource fork',
+        })
+        manifest = {
+            'defaults': {'is_public': False, 'tag_names': ['Castle']},
+            'files': {'builds/keep.schem': {'title': 'The Keep', 'tag_names': ['castle', 'medieval']}},
+        }
+
+        with patch('apps.schematics.views.scan_batch_task') as mock_batch, \
+                CaptureQueriesContext(connection) as queries:
+            response = self._post(data, manifest)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['created'] == 3
+        assert [(member['name'], member['status']) for member in response.data['members']] == [
+            ('builds/keep.schem', 'created'),
+            ('builds/tower.litematic', 'created'),
+            ('wall.nbt', 'created'),
+            ('README.txt', 'skipped'),
+        ]
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "schematics_schematic"')]
+        assert len(inserts) == 1
+        mock_batch.delay.assert_called_once_with()
+
+        keep = Schematic.objects.get(id=response.data['members'][0]['id'])
+        assert keep.title == 'The Keep'
+        assert keep.is_public is False
+        assert keep.scan_status == 'pending'
+        assert keep.file.name.startswith('quarantine/')
+        assert sorted(keep.tags.values_list('name', flat=True)) == ['castle', 'medieval']
+        with keep.file.open('rb') as stored:
+            assert stored.read() == b'keep bytes'
+        tower = Schematic.objects.get(title='tower')
+        assert list(tower.tags.values_list('name', flat=True)) == ['castle']
+        self.user.refresh_from_db()
+        assert self.user.storage_used == len(b'keep bytes') + len(b'tower bytes') + len(b'wall bytes')
+        self._clean_up()
+
+    def test_bad_members_are_reported_and_others_imported(self, settings):
+        """Test that corrupt, oversized and badly described members fail on their own"""
+        from unittest.mock import patch
+
+        settings.MAX_UPLOAD_SIZE = 100
+        data = self._archive({
+            'good.schem': b'good bytes',
+            'corrupt.schem': b'corrupt bytes',
+            'huge.schem': b'x' * 101,
+            'untitled.schem': b'untitled bytes',
+        }, stored=True)
+        # Stored uncompressed, so this only breaks the member's CRC
+        data = data.replace(b'corrupt bytes', b'CORRUPT BYTES')
+
+        with patch('apps.schematics.views.scan_batch_task'):
+            response = self._post(data, {'files': {'untitled.schem': {'title': ''}}})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        statuses = {member['name']: member['status'] for member in response.data['members']}
+        assert statuses == {
+            'good.schem': 'created', 'corrupt.schem': 'failed', 'huge.schem': 'failed', 'untitled.schem': 'failed',
+        }
+        assert 'title' in response.data['members'][3]['error']
+        assert list(Schematic.objects.values_list('title', flat=True)) == ['good']
+        self._clean_up()
+
+    def test_archive_limits(self, settings):
+        """Test that archives that are not zips or hold too many files are refused whole"""
+        settings.BULK_UPLOAD_MAX_FILES = 1
+
+        assert self._post(b'not a zip').status_code == status.HTTP_400_BAD_REQUEST
+        response = self._post(self._archive({'a.schem': b'a', 'b.schem': b'b'}))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'at most 1 files' in response.data['error']
+        assert not Schematic.objects.exists()
+
+
+@pytest.mark.django_db
+class TestUploadSessionExpiry:
+    """Test dropping abandoned upload sessions"""
+
+    def test_expired_sessions_are_aborted(self):
+        """Test that only sessions past expires_at are deleted, with their partial files"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from apps.storage.models import UploadSession
+        from apps.storage.tasks import expire_upload_sessions_task
+        from apps.storage.uploads import abort_upload, start_upload
+
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        stale = start_upload(user, 'stale.schem', 100)
+        fresh = start_upload(user, 'fresh.schem', 100)
+        UploadSession.objects.filter(id=stale.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        assert expire_upload_sessions_task() == 1
+        assert list(UploadSession.objects.all()) == [fresh]
+        assert not stale.file.storage.exists(stale.file.name)
+        abort_upload(fresh)
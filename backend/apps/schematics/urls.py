@@ -6,6 +6,7 @@ from rest_framework.routers import DefaultRouter
 from . import views
 
 router = DefaultRouter()
+router.register(r'uploads', views.UploadSessionViewSet, basename='upload-session')
 router.register(r'', views.SchematicViewSet, basename='schematic')
 router.register(r'tags', views.TagViewSet, basename='tag')
 
@@ -1,21 +1,96 @@
 """
 Schematic views
 """
-from rest_framework import viewsets, status, filters, permissions
+from rest_framework import viewsets, mixins, status, filters, permissions, renderers
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.db.models import Q, Count
+from django.http import FileResponse, HttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-import hashlib
+import io
+import logging
+import re
 
 from .models import Schematic, Tag, SchematicLike, SchematicImage
 from .serializers import (
     SchematicListSerializer, SchematicDetailSerializer,
     SchematicUploadSerializer, TagSerializer, CommentSerializer,
-    SchematicImageSerializer
+    SchematicImageSerializer, SchematicBlockCountSerializer,
+    UploadSessionSerializer, DirectUploadSessionSerializer, UploadFinalizeSerializer,
+    BulkUploadSerializer
 )
-from apps.scanning.tasks import scan_file_task
+from .bulk import ArchiveError, import_archive
+from .filters import SchematicFilter
+from .conversion import CONVERSION_FORMATS, ConversionError, converted_file
+from .nbt import NBTError
+from .tasks import process_schematic_task
+from apps.scanning import breaker as clamd_breaker
+from apps.scanning.scanner import ConcurrentStreamScan, VirusScanner
+from apps.scanning.routing import queue_scan
+from apps.scanning.tasks import after_clean_scan, flag_infected_upload, record_scan_result, scan_batch_task
+from apps.scanning.verdicts import cached_verdict
+from apps.storage.blobs import acquire_blob
+from apps.storage.models import FileBlob, UploadSession
+from apps.storage.promotion import save_to_quarantine
+from apps.storage.uploadhandlers import uploaded_file_hash
+from apps.storage.uploads import (
+    UploadError, UploadOffsetMismatch, abort_upload, append_chunk, complete_upload,
+    presigned_part_urls, start_direct_upload, start_upload
+)
+
+logger = logging.getLogger(__name__)
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single-range Range header against a resource of `size` bytes
+
+    Returns:
+        (start, end) inclusive, None to serve the whole resource, or
+        False if the range cannot be satisfied
+    """
+    match = BYTE_RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        # Missing, malformed or multi-range headers get the full body
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class PreviewRenderer(renderers.BaseRenderer):
+    """Accepts requests for application/octet-stream preview data"""
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return renderers.JSONRenderer().render(data)
+
+
+class IgnoreFormatNegotiation(DefaultContentNegotiation):
+    """Leaves ?format= to the view instead of treating it as a renderer override"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -33,7 +108,7 @@ class SchematicViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description', 'tags__name', 'category']
     ordering_fields = ['created_at', 'download_count', 'view_count']
-    filterset_fields = ['category', 'scan_status', 'is_public', 'owner']
+    filterset_class = SchematicFilter
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -59,26 +134,103 @@ class SchematicViewSet(viewsets.ModelViewSet):
         return queryset
 
     def perform_create(self, serializer):
-        # Calculate file hash
         file_obj = self.request.FILES['file']
-        file_hash = hashlib.sha256()
-        for chunk in file_obj.chunks():
-            file_hash.update(chunk)
-
-        # Save schematic
-        schematic = serializer.save(
-            owner=self.request.user,
-            file_size=file_obj.size,
-            file_hash=file_hash.hexdigest()
-        )
+
+        # Hashed by the upload handler while the request was received
+        file_hash = uploaded_file_hash(file_obj)
+
+        # Small uploads are scanned before they are stored, unless the content
+        # is already a clean blob or clamd is known to be down
+        scan_result = None
+        if (0 < file_obj.size <= settings.INLINE_SCAN_MAX_SIZE and not clamd_breaker.is_open()
+                and not FileBlob.objects.filter(file_hash=file_hash).exists()):
+            scanner = VirusScanner()
+            engine_version = scanner.engine_version()
+            scan_result = cached_verdict(file_hash, engine_version)
+            if scan_result is None:
+                inline_scan = ConcurrentStreamScan(scanner, timeout=settings.INLINE_SCAN_TIMEOUT)
+                for chunk in file_obj.chunks():
+                    inline_scan.feed(chunk)
+                scan_result = inline_scan.finish()
+                record_scan_result(file_hash, engine_version, scan_result)
+
+        if scan_result and scan_result['is_infected']:
+            # Never stored, so there is nothing to delete
+            logger.warning(f"Rejected infected upload from {self.request.user.username}: {scan_result['virus_name']}")
+            flag_infected_upload(self.request.user)
+            raise ValidationError({'file': 'The uploaded file was flagged as infected.'})
+        scanned_clean = bool(scan_result) and scan_result['status'] == 'clean'
+
+        with transaction.atomic():
+            # Identical content that already scanned clean is shared instead of stored again
+            blob = acquire_blob(file_hash)
+            if blob:
+                schematic = serializer.save(
+                    owner=self.request.user,
+                    file=blob.file.name,
+                    file_size=file_obj.size,
+                    file_hash=file_hash,
+                    blob=blob,
+                    scan_status='clean',
+                    scan_result=blob.scan_result,
+                    scanned_at=blob.scanned_at
+                )
+            elif scanned_clean:
+                schematic = serializer.save(
+                    owner=self.request.user,
+                    file_size=file_obj.size,
+                    file_hash=file_hash,
+                    scan_status='clean',
+                    scan_result=scan_result,
+                    scanned_at=timezone.now()
+                )
+            else:
+                # Kept in quarantine until scan_file_task promotes it
+                schematic = serializer.save(
+                    owner=self.request.user,
+                    file=save_to_quarantine(file_obj),
+                    file_size=file_obj.size,
+                    file_hash=file_hash
+                )
 
         # Update user storage
         user = self.request.user
         user.storage_used += file_obj.size
         user.save()
 
-        # Trigger virus scan
-        scan_file_task.delay(str(schematic.id))
+        if blob:
+            # Inherits the verdict, so go straight to processing
+            process_schematic_task.delay(str(schematic.id))
+        elif scanned_clean:
+            after_clean_scan(schematic)
+        else:
+            # Too large for an inline scan, or clamd did not answer in time
+            queue_scan(schematic)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def bulk(self, request):
+        """Upload a zip archive of schematics with a metadata manifest"""
+        serializer = BulkUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            schematics, members = import_archive(
+                request.user, serializer.validated_data['archive'], serializer.validated_data['manifest']
+            )
+        except ArchiveError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One batched scan for the whole archive instead of a task per file
+        if any(not schematic.blob_id for schematic in schematics):
+            scan_batch_task.delay()
+        for schematic in schematics:
+            if schematic.blob_id:
+                process_schematic_task.delay(str(schematic.id))
+
+        logger.info(f"Bulk upload by {request.user.username}: {len(schematics)} of {len(members)} files created")
+        return Response(
+            {'created': len(schematics), 'members': members},
+            status=status.HTTP_201_CREATED if schematics else status.HTTP_400_BAD_REQUEST
+        )
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -88,9 +240,9 @@ class SchematicViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], content_negotiation_class=IgnoreFormatNegotiation)
     def download(self, request, pk=None):
-        """Track downloads and return file URL"""
+        """Track downloads and return file URL, converted if ?format= is given"""
         schematic = self.get_object()
 
         # Check scan status
@@ -99,17 +251,96 @@ class SchematicViewSet(viewsets.ModelViewSet):
                 {'error': 'File flagged as infected'},
                 status=status.HTTP_403_FORBIDDEN
             )
+        if schematic.scan_status == 'rejected':
+            return Response(
+                {'error': 'File rejected as malformed or oversized'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        target = request.query_params.get('format')
+        file_name = schematic.file.name.split('/')[-1]
+        download_url = schematic.file.url
+        file_size = schematic.file_size
+
+        if target:
+            if target not in CONVERSION_FORMATS:
+                return Response(
+                    {'error': f"Unknown format. Available formats: {', '.join(CONVERSION_FORMATS)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if schematic.scan_status != 'clean':
+                return Response(
+                    {'error': 'File can be converted once its scan is complete'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            try:
+                name = converted_file(schematic, target)
+            except (ConversionError, NBTError) as e:
+                return Response(
+                    {'error': f'Cannot convert to {target}: {e}'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if name != schematic.file.name:
+                storage = schematic.file.storage
+                file_name = file_name.rsplit('.', 1)[0] + CONVERSION_FORMATS[target]
+                download_url = storage.url(name)
+                file_size = storage.size(name)
 
         # Increment download count
         schematic.download_count += 1
         schematic.save(update_fields=['download_count'])
 
         return Response({
-            'download_url': schematic.file.url,
-            'file_name': schematic.file.name.split('/')[-1],
-            'file_size': schematic.file_size
+            'download_url': download_url,
+            'file_name': file_name,
+            'file_size': file_size
         })
 
+    @action(detail=True, methods=['get'])
+    def materials(self, request, pk=None):
+        """Get the block material histogram of a schematic"""
+        schematic = self.get_object()
+        counts = schematic.block_counts.select_related('block_state')
+        serializer = SchematicBlockCountSerializer(counts, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=True, methods=['get'], url_path='preview/(?P<level>[0-9]+)',
+        renderer_classes=[renderers.JSONRenderer, PreviewRenderer]
+    )
+    def preview(self, request, pk=None, level=None):
+        """Serve one binary preview LOD, with support for Range requests"""
+        schematic = self.get_object()
+        lods = (schematic.preview_data or {}).get('lods', [])
+        lod = next((lod for lod in lods if lod['level'] == int(level)), None)
+        if lod is None:
+            return Response({'error': 'Preview not available'}, status=status.HTTP_404_NOT_FOUND)
+
+        storage = schematic.file.storage
+        size = lod['size']
+        byte_range = parse_byte_range(request.headers.get('Range'), size)
+
+        if byte_range is False:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range is None:
+            response = FileResponse(storage.open(lod['name'], 'rb'), content_type='application/octet-stream')
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            with storage.open(lod['name'], 'rb') as preview_file:
+                preview_file.seek(start)
+                body = preview_file.read(end - start + 1)
+            response = HttpResponse(
+                body, status=status.HTTP_206_PARTIAL_CONTENT, content_type='application/octet-stream'
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = f'"{schematic.file_hash}-{lod["level"]}-{size}"'
+        response['Cache-Control'] = 'public, max-age=86400' if schematic.is_public else 'private, max-age=86400'
+        return response
+
     @action(detail=True, methods=['post', 'delete'])
     def like(self, request, pk=None):
         """Like or unlike a schematic"""
@@ -243,3 +474,150 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
         ).order_by('-schematic_count')[:20]
         serializer = self.get_serializer(tags, many=True)
         return Response(serializer.data)
+
+
+def save_stored_upload(serializer, user, name, file_size, file_hash):
+    """
+    Save the schematic for an upload already stored in quarantine
+
+    Content that already scanned clean is shared through its blob and the
+    stored copy is deleted. An empty file_hash (direct uploads) is filled in
+    by the scan. Call queue_stored_upload() once committed.
+    """
+    with transaction.atomic():
+        blob = acquire_blob(file_hash) if file_hash else None
+        if blob:
+            schematic = serializer.save(
+                owner=user,
+                file=blob.file.name,
+                file_size=file_size,
+                file_hash=file_hash,
+                blob=blob,
+                scan_status='clean',
+                scan_result=blob.scan_result,
+                scanned_at=blob.scanned_at
+            )
+            transaction.on_commit(lambda: default_storage.delete(name))
+        else:
+            schematic = serializer.save(
+                owner=user,
+                file=name,
+                file_size=file_size,
+                file_hash=file_hash
+            )
+
+        user.storage_used += file_size
+        user.save()
+    return schematic
+
+
+def queue_stored_upload(schematic):
+    """Scan a schematic saved by save_stored_upload(), or process it if it shares a blob"""
+    if schematic.blob_id:
+        process_schematic_task.delay(str(schematic.id))
+    else:
+        queue_scan(schematic)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads
+
+    POST creates a session for a file of known size, PUT appends the next
+    byte range (raw body with Content-Range, optionally Content-Digest), GET
+    tells where to resume and POST finalize/ creates the schematic.
+
+    With S3 storage, POST direct/ instead hands out presigned part URLs so
+    the client uploads to the bucket without the bytes passing through here.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.instance = start_upload(
+            self.request.user,
+            serializer.validated_data['file_name'],
+            serializer.validated_data['file_size']
+        )
+
+    def perform_destroy(self, instance):
+        abort_upload(instance)
+
+    def _direct_session_data(self, session):
+        data = self.get_serializer(session).data
+        data['part_size'] = settings.UPLOAD_DIRECT_PART_SIZE
+        data['parts'] = presigned_part_urls(session)
+        return data
+
+    def retrieve(self, request, pk=None):
+        session = self.get_object()
+        if session.direct:
+            # Fresh part URLs, for resuming after the first ones expired
+            return Response(self._direct_session_data(session))
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=False, methods=['post'])
+    def direct(self, request):
+        """Start an upload whose parts go straight to S3"""
+        if not settings.USE_S3:
+            return Response(
+                {'error': 'Direct uploads need S3 storage'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = DirectUploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            session = start_direct_upload(
+                request.user,
+                serializer.validated_data['file_name'],
+                serializer.validated_data['file_size'],
+                serializer.validated_data['part_checksums']
+            )
+        except UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._direct_session_data(session), status=status.HTTP_201_CREATED)
+
+    def update(self, request, pk=None):
+        """Append one chunk"""
+        session = self.get_object()
+        try:
+            session = append_chunk(
+                session.id, request.user,
+                request.headers.get('Content-Range'),
+                request.stream or io.BytesIO(),
+                request.headers.get('Content-Digest')
+            )
+        except UploadOffsetMismatch as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Create the schematic once every byte has arrived"""
+        serializer = UploadFinalizeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(), id=self.get_object().id
+            )
+            try:
+                file_hash = complete_upload(session)
+            except UploadError as e:
+                return Response({'error': str(e), 'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+            schematic = save_stored_upload(
+                serializer, request.user, session.file.name, session.file_size, file_hash
+            )
+            session.delete()
+
+        queue_stored_upload(schematic)
+        return Response(
+            SchematicDetailSerializer(schematic, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED
+        )
@@ -0,0 +1,21 @@
+"""
+Storage admin
+"""
+from django.contrib import admin
+from .models import FileBlob, UploadSession
+
+
+@admin.register(FileBlob)
+class FileBlobAdmin(admin.ModelAdmin):
+    list_display = ['file_hash', 'file_size', 'ref_count', 'scanned_at', 'created_at']
+    search_fields = ['file_hash']
+    readonly_fields = ['file_hash', 'file', 'file_size', 'ref_count', 'scan_result', 'scanned_at', 'created_at']
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['file_name', 'owner', 'offset', 'file_size', 'created_at', 'expires_at']
+    search_fields = ['file_name', 'owner__username']
+    readonly_fields = [
+        'file_name', 'file', 'file_size', 'offset', 'chunk_digests', 's3_upload_id', 's3_parts', 'created_at'
+    ]
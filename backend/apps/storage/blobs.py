@@ -0,0 +1,125 @@
+"""
+Content-addressed file blobs
+
+Uploads are keyed by SHA-256. The first clean copy of some content is
+registered as a FileBlob; identical uploads afterwards point at that blob
+instead of storing and scanning the bytes again.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F
+
+from apps.schematics.conversion import delete_converted
+from .models import FileBlob
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_blob(file_hash):
+    """
+    Take a reference on the clean blob with this hash
+
+    Must run in the transaction that creates the referencing schematic, so
+    the reference is dropped again if that fails.
+
+    Returns:
+        FileBlob or None if no clean copy exists
+    """
+    blob = FileBlob.objects.select_for_update().filter(file_hash=file_hash).first()
+    if blob is None:
+        return None
+    FileBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+    blob.ref_count += 1
+    return blob
+
+
+@transaction.atomic
+def register_blob(schematic):
+    """
+    Turn the file of a schematic that just scanned clean into a blob
+
+    If another upload of the same content was registered in the meantime,
+    the schematic switches to that blob and its own copy is deleted.
+
+    Returns:
+        FileBlob
+    """
+    if schematic.blob_id:
+        return schematic.blob
+
+    blob, created = FileBlob.objects.select_for_update().get_or_create(
+        file_hash=schematic.file_hash,
+        defaults={
+            'file': schematic.file.name,
+            'file_size': schematic.file_size,
+            'ref_count': 1,
+            'scan_result': schematic.scan_result,
+            'scanned_at': schematic.scanned_at,
+        }
+    )
+
+    update_fields = ['blob']
+    if not created:
+        FileBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+        if blob.file.name != schematic.file.name:
+            storage, duplicate = schematic.file.storage, schematic.file.name
+            transaction.on_commit(lambda: storage.delete(duplicate))
+            schematic.file.name = blob.file.name
+            update_fields.append('file')
+            logger.info(f"Schematic {schematic.id} deduplicated onto blob {blob.file_hash}")
+
+    schematic.blob = blob
+    schematic.save(update_fields=update_fields)
+    return blob
+
+
+@transaction.atomic
+def release_blob(blob_id):
+    """
+    Drop one reference; the last one deletes the blob, its file and its conversions
+
+    Returns:
+        True if the file was deleted
+    """
+    blob = FileBlob.objects.select_for_update().filter(id=blob_id).first()
+    if blob is None:
+        return False
+
+    blob.ref_count = max(blob.ref_count - 1, 0)
+    # A drifted counter must never orphan a file that is still referenced
+    if blob.ref_count or blob.schematics.exists():
+        blob.save(update_fields=['ref_count'])
+        return False
+
+    storage, name, file_hash = blob.file.storage, blob.file.name, blob.file_hash
+    blob.delete()
+    # Only touch storage once the rows are gone for good
+    transaction.on_commit(lambda: storage.delete(name))
+    transaction.on_commit(lambda: delete_converted(storage, file_hash))
+    logger.info(f"Released last reference to blob {blob.file_hash}, deleting {name}")
+    return True
+
+
+@transaction.atomic
+def discard_blob(file_hash):
+    """
+    Drop the blob of content that turned out to be infected
+
+    Every schematic sharing it is detached and the file deleted, so the
+    content can neither be downloaded nor reused by later uploads.
+
+    Returns:
+        Number of schematics that referenced the blob
+    """
+    blob = FileBlob.objects.select_for_update().filter(file_hash=file_hash).first()
+    if blob is None:
+        return 0
+
+    detached = blob.schematics.update(blob=None)
+    storage, name = blob.file.storage, blob.file.name
+    blob.delete()
+    transaction.on_commit(lambda: storage.delete(name))
+    transaction.on_commit(lambda: delete_converted(storage, file_hash))
+    logger.warning(f"Discarded infected blob {file_hash} shared by {detached} schematics")
+    return detached
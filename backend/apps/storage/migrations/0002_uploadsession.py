@@ -0,0 +1,33 @@
+# Generated by Django 4.2.26 on 2026-10-16 23:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('storage', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('file_size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('chunk_digests', models.JSONField(blank=True, default=list)),
+                ('s3_upload_id', models.CharField(blank=True, max_length=255)),
+                ('s3_parts', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+"""
+Storage models
+"""
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class FileBlob(models.Model):
+    """
+    A stored file shared by every schematic with the same content
+
+    Only files that passed the virus scan become blobs. Schematics uploaded
+    later with the same SHA-256 reuse the stored file and its verdict; the
+    file is deleted when the last referencing schematic goes away.
+    """
+    file_hash = models.CharField(max_length=64, unique=True)  # SHA-256 hash
+    file = models.FileField(max_length=255)
+    file_size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # Verdict inherited by deduplicated uploads
+    scan_result = models.JSONField(null=True, blank=True)
+    scanned_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.file_hash[:12]} ({self.ref_count} refs)"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress, see apps.storage.uploads
+
+    The file is appended to in quarantine one byte range at a time; each
+    chunk's SHA-256 is kept in chunk_digests so finalizing can check the
+    stored file against what was received.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)  # Name given by the client
+    file = models.FileField(max_length=255)  # Partial file in quarantine
+    file_size = models.BigIntegerField()  # Declared total size
+    offset = models.BigIntegerField(default=0)  # Bytes received so far
+    chunk_digests = models.JSONField(default=list, blank=True)  # [{offset, size, sha256}] per chunk
+
+    # Parts go straight to S3 through presigned URLs instead of through the API
+    direct = models.BooleanField(default=False)
+
+    # S3 multipart upload the chunks are parts of (declared checksums for direct uploads)
+    s3_upload_id = models.CharField(max_length=255, blank=True)
+    s3_parts = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.file_size})"
+
+    @property
+    def is_complete(self):
+        return self.offset == self.file_size
@@ -0,0 +1,90 @@
+"""
+Quarantine and promotion of uploaded files
+
+Uploads that still need a virus scan are written through QuarantineStorage
+(private objects under quarantine/) instead of the public schematic
+storage. Once clean they are promoted to schematics/ with a server-side S3
+copy (CopyObject, or UploadPartCopy above S3_MULTIPART_COPY_THRESHOLD), so
+the bytes never pass through the worker, and the quarantine copy is deleted.
+
+File names stay relative to the default storage, so "quarantine/..." and
+"schematics/..." address the same objects QuarantineStorage and
+SchematicStorage use.
+"""
+import logging
+import os
+
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from .backends import QuarantineStorage, SchematicStorage
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_PREFIX = f'{QuarantineStorage.location}/'
+PRODUCTION_PREFIX = f'{SchematicStorage.location}/'
+
+
+def save_to_quarantine(upload):
+    """
+    Store an upload that still needs scanning
+
+    Returns:
+        The file name relative to the default storage
+    """
+    path = f'{timezone.now():%Y/%m/%d}/{os.path.basename(upload.name)}'
+    if settings.USE_S3:
+        return QUARANTINE_PREFIX + QuarantineStorage().save(path, upload)
+    return default_storage.save(QUARANTINE_PREFIX + path, upload)
+
+
+def _s3_copy(storage, source, target):
+    """Server-side copy within the storage's bucket"""
+    client = storage.connection.meta.client
+    extra_args = {'ACL': storage.default_acl} if storage.default_acl else {}
+    client.copy(
+        {'Bucket': storage.bucket_name, 'Key': storage._normalize_name(clean_name(source))},
+        storage.bucket_name,
+        storage._normalize_name(clean_name(target)),
+        ExtraArgs=extra_args,
+        Config=TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_COPY_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_COPY_CHUNK_SIZE,
+        ),
+    )
+
+
+def promote_file(schematic):
+    """
+    Move a clean schematic's file out of quarantine
+
+    Returns:
+        True if the file was moved; False if it was not quarantined
+    """
+    name = schematic.file.name
+    if not name or not name.startswith(QUARANTINE_PREFIX):
+        return False
+
+    storage = schematic.file.storage
+    target = storage.get_available_name(PRODUCTION_PREFIX + name[len(QUARANTINE_PREFIX):])
+    if isinstance(storage, S3Boto3Storage):
+        _s3_copy(storage, name, target)
+        storage.delete(name)
+    elif isinstance(storage, FileSystemStorage):
+        os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+        file_move_safe(storage.path(name), storage.path(target))
+    else:
+        # No server-side copy available, so the bytes pass through here
+        with storage.open(name, 'rb') as source:
+            target = storage.save(target, source)
+        storage.delete(name)
+
+    schematic.file.name = target
+    schematic.save(update_fields=['file'])
+    logger.info(f"Promoted {name} to {target}")
+    return True
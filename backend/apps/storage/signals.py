@@ -0,0 +1,15 @@
+"""
+Storage signal handlers
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from apps.schematics.models import Schematic
+from .blobs import release_blob
+
+
+@receiver(post_delete, sender=Schematic)
+def release_schematic_blob(sender, instance, **kwargs):
+    """Free the shared file once no schematic references it"""
+    if instance.blob_id:
+        release_blob(instance.blob_id)
@@ -0,0 +1,64 @@
+"""
+Celery tasks for storage
+"""
+from celery import shared_task
+from django.apps import apps
+from django.utils import timezone
+import logging
+
+from .blobs import register_blob
+from .models import UploadSession
+from .promotion import promote_file
+from .uploads import abort_upload
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def expire_upload_sessions_task():
+    """
+    Drop resumable uploads that received no chunk for UPLOAD_SESSION_TTL
+
+    Run periodically (CELERY_BEAT_SCHEDULE); partial files and S3 multipart
+    uploads are deleted with their sessions.
+    """
+    expired = list(UploadSession.objects.filter(expires_at__lt=timezone.now()))
+    for session in expired:
+        abort_upload(session)
+    if expired:
+        logger.info(f"Expired {len(expired)} upload sessions")
+    return len(expired)
+
+
+@shared_task(bind=True, max_retries=5)
+def promote_file_task(self, schematic_id):
+    """
+    Retry moving a clean schematic's file out of quarantine
+
+    Queued by after_clean_scan when the first move failed. The blob is only
+    registered once the file is in production storage, so later uploads of
+    the same content never point at a quarantine object. Once the retries
+    are spent the schematic stays clean in quarantine, without a blob.
+    """
+    Schematic = apps.get_model('schematics', 'Schematic')
+
+    try:
+        schematic = Schematic.objects.get(id=schematic_id)
+    except Schematic.DoesNotExist:
+        logger.error(f"Schematic {schematic_id} not found")
+        return None
+    if schematic.scan_status != 'clean':
+        return None
+
+    try:
+        promote_file(schematic)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Giving up promoting file of {schematic_id}, left in quarantine: {str(e)}")
+            return None
+        countdown = min(2 ** self.request.retries * 60, 900)
+        logger.warning(f"Error promoting file of {schematic_id}, retrying in {countdown}s: {str(e)}")
+        raise self.retry(exc=e, countdown=countdown)
+
+    register_blob(schematic)
+    return schematic.file.name
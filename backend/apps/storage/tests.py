@@ -1,9 +1,14 @@
 """
 Unit tests for storage app
 """
+import pytest
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from apps.schematics.models import Schematic
 from apps.storage.backends import SchematicStorage
 
+User = get_user_model()
+
 
 class TestSchematicStorage:
     """Test SchematicStorage backend"""
@@ -30,3 +35,334 @@ class TestSchematicStorage:
         # Verify it's a subclass
         from storages.backends.s3boto3 import S3Boto3Storage
         assert isinstance(storage, S3Boto3Storage)
+
+
+@pytest.mark.django_db
+class TestFileBlobs:
+    """Test content-addressed file blobs"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _clean_schematic(self, data=b'schematic bytes'):
+        import hashlib
+        from django.core.files.base import ContentFile
+        from django.utils import timezone
+
+        schematic = Schematic(
+            owner=self.user,
+            title='Clean Schematic',
+            file_size=len(data),
+            file_hash=hashlib.sha256(data).hexdigest(),
+            scan_status='clean',
+            scan_result={'is_infected': False, 'virus_name': None, 'status': 'clean'},
+            scanned_at=timezone.now()
+        )
+        schematic.file.save('blob.schem', ContentFile(data), save=False)
+        schematic.save()
+        return schematic
+
+    def test_register_blob(self):
+        """Test that a clean file becomes a blob with one reference"""
+        from apps.storage.blobs import register_blob
+
+        schematic = self._clean_schematic()
+        blob = register_blob(schematic)
+
+        assert blob.ref_count == 1
+        assert blob.file.name == schematic.file.name
+        assert blob.scan_result['status'] == 'clean'
+        schematic.refresh_from_db()
+        assert schematic.blob == blob
+        blob.file.delete(save=False)
+
+    def test_register_duplicate_switches_to_blob(self, django_capture_on_commit_callbacks):
+        """Test that a second clean copy of the same content is dropped in favour of the blob"""
+        from apps.storage.blobs import register_blob
+
+        first = self._clean_schematic()
+        blob = register_blob(first)
+        second = self._clean_schematic()
+        duplicate = second.file.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert register_blob(second) == blob
+
+        blob.refresh_from_db()
+        second.refresh_from_db()
+        assert blob.ref_count == 2
+        assert second.file.name == blob.file.name
+        assert not second.file.storage.exists(duplicate)
+        blob.file.delete(save=False)
+
+    def test_release_deletes_with_last_reference(self, django_capture_on_commit_callbacks):
+        """Test that the file is only deleted once no schematic references it"""
+        from apps.storage.blobs import register_blob
+        from apps.storage.models import FileBlob
+
+        first = self._clean_schematic()
+        blob = register_blob(first)
+        second = self._clean_schematic()
+        register_blob(second)
+        name = blob.file.name
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first.delete()
+        blob.refresh_from_db()
+        assert blob.ref_count == 1
+        assert blob.file.storage.exists(name)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        assert not FileBlob.objects.filter(id=blob.id).exists()
+        assert not blob.file.storage.exists(name)
+
+    def test_release_deletes_conversions(self, django_capture_on_commit_callbacks):
+        """Test that cached conversions of the content go with its last reference"""
+        from django.core.files.base import ContentFile
+        from apps.schematics.conversion import converted_name
+        from apps.storage.blobs import register_blob
+
+        schematic = self._clean_schematic()
+        blob = register_blob(schematic)
+        storage = blob.file.storage
+        converted = [
+            storage.save(converted_name(blob.file_hash, 'litematic', 'Clean Schematic'), ContentFile(b'x')),
+            storage.save(converted_name(blob.file_hash, 'schematic'), ContentFile(b'x')),
+        ]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            schematic.delete()
+        assert not any(storage.exists(name) for name in converted)
+
+
+@pytest.mark.django_db
+class TestQuarantinePromotion:
+    """Test keeping unscanned uploads in quarantine and promoting clean ones"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _quarantined(self, data=b'quarantined bytes'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from apps.storage.promotion import save_to_quarantine
+
+        name = save_to_quarantine(SimpleUploadedFile('castle.schem', data))
+        return Schematic.objects.create(
+            owner=self.user,
+            title='Castle',
+            file=name,
+            file_size=len(data),
+            file_hash='q' * 64,
+            scan_status='pending'
+        )
+
+    def test_clean_scan_promotes_file(self):
+        """Test that a clean verdict moves the upload from quarantine/ to schematics/"""
+        import io
+        from django.core.files.storage import default_storage
+        from apps.scanning.tasks import scan_file_task
+
+        schematic = self._quarantined()
+        quarantined = schematic.file.name
+        assert quarantined.startswith('quarantine/')
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', return_value=io.BytesIO(b'quarantined bytes')), \
+                patch('apps.schematics.tasks.process_schematic_task'):
+            mock_scanner_class.return_value.engine_version.return_value = None
+            mock_scanner_class.return_value.scan_stream.return_value = {
+                'is_infected': False, 'virus_name': None, 'status': 'clean'
+            }
+            scan_file_task(str(schematic.id))
+
+        schematic.refresh_from_db()
+        assert schematic.file.name.startswith('schematics/')
+        assert schematic.blob.file.name == schematic.file.name
+        assert not default_storage.exists(quarantined)
+        with schematic.file.open('rb') as promoted:
+            assert promoted.read() == b'quarantined bytes'
+        schematic.file.delete(save=False)
+
+    def test_failed_promotion_defers_blob(self):
+        """Test that a file stuck in quarantine is not registered as a blob until promoted"""
+        import io
+        from apps.scanning.tasks import scan_file_task
+        from apps.storage.models import FileBlob
+        from apps.storage.tasks import promote_file_task
+
+        schematic = self._quarantined()
+
+        with patch('apps.scanning.scanner.VirusScanner') as mock_scanner_class, \
+                patch('apps.scanning.streams.open_scan_stream', return_value=io.BytesIO(b'quarantined bytes')), \
+                patch('apps.storage.promotion.promote_file', side_effect=OSError('copy failed')), \
+                patch('apps.storage.tasks.promote_file_task') as mock_promote, \
+                patch('apps.schematics.tasks.process_schematic_task'):
+            mock_scanner_class.return_value.engine_version.return_value = None
+            mock_scanner_class.return_value.scan_stream.return_value = {
+                'is_infected': False, 'virus_name': None, 'status': 'clean'
+            }
+            scan_file_task(str(schematic.id))
+
+        schematic.refresh_from_db()
+        assert schematic.scan_status == 'clean'
+        assert schematic.file.name.startswith('quarantine/')
+        assert not FileBlob.objects.exists()
+        mock_promote.apply_async.assert_called_once_with(args=[str(schematic.id)], countdown=60)
+
+        assert promote_file_task(str(schematic.id)).startswith('schematics/')
+        schematic.refresh_from_db()
+        assert schematic.blob.file.name == schematic.file.name
+        assert schematic.file.name.startswith('schematics/')
+        schematic.file.delete(save=False)
+
+    def test_s3_promotion_copies_server_side(self):
+        """Test that S3 promotion is a managed CopyObject within the bucket, never a download"""
+        from unittest.mock import MagicMock, PropertyMock
+        from storages.backends.s3boto3 import S3Boto3Storage
+        from apps.storage.promotion import promote_file
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Castle',
+            file='quarantine/2026/10/16/castle.schem',
+            file_size=1024,
+            file_hash='s' * 64,
+            scan_status='clean'
+        )
+        storage = S3Boto3Storage(bucket_name='schematics', default_acl='public-read')
+        schematic.file.storage = storage
+        client = MagicMock()
+
+        with patch.object(S3Boto3Storage, 'connection', new_callable=PropertyMock) as connection, \
+                patch.object(storage, 'exists', return_value=False), \
+                patch.object(storage, 'delete') as delete, \
+                patch.object(storage, 'open') as open_file:
+            connection.return_value.meta.client = client
+            assert promote_file(schematic) is True
+
+        source, bucket, key = client.copy.call_args.args
+        assert source == {'Bucket': 'schematics', 'Key': 'quarantine/2026/10/16/castle.schem'}
+        assert (bucket, key) == ('schematics', 'schematics/2026/10/16/castle.schem')
+        assert client.copy.call_args.kwargs['ExtraArgs'] == {'ACL': 'public-read'}
+        assert client.copy.call_args.kwargs['Config'].multipart_threshold == 64 * 1024 * 1024
+        delete.assert_called_once_with('quarantine/2026/10/16/castle.schem')
+        open_file.assert_not_called()
+        schematic.refresh_from_db()
+        assert schematic.file.name == 'schematics/2026/10/16/castle.schem'
+
+    def test_files_outside_quarantine_stay(self):
+        """Test that inline-scanned and deduplicated files are not moved"""
+        from apps.storage.promotion import promote_file
+
+        schematic = Schematic.objects.create(
+            owner=self.user,
+            title='Castle',
+            file='schematics/2026/10/16/castle.schem',
+            file_size=1024,
+            file_hash='p' * 64,
+            scan_status='clean'
+        )
+        assert promote_file(schematic) is False
+        assert schematic.file.name == 'schematics/2026/10/16/castle.schem'
+
+
+@pytest.mark.django_db
+class TestChunkDigests:
+    """Test hashing chunked uploads from their recorded chunk digests"""
+
+    def setup_method(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def _received(self, data, chunk_size):
+        import io
+        from apps.storage.uploads import append_chunk, start_upload
+
+        session = start_upload(self.user, 'castle.schem', len(data))
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            session = append_chunk(
+                session.id, self.user, f'bytes {start}-{start + len(chunk) - 1}/{len(data)}', io.BytesIO(chunk)
+            )
+        return session
+
+    def test_finalize_digest_matches_hashlib(self):
+        """Test that the finalize digest is hashlib's SHA-256 of the whole file"""
+        import hashlib
+        import os
+        from apps.storage.uploads import abort_upload, complete_upload
+
+        data = os.urandom(5000)
+        session = self._received(data, 1100)
+
+        assert [chunk['size'] for chunk in session.chunk_digests] == [1100, 1100, 1100, 1100, 600]
+        assert session.chunk_digests[1]['sha256'] == hashlib.sha256(data[1100:2200]).hexdigest()
+        assert complete_upload(session) == hashlib.sha256(data).hexdigest()
+        abort_upload(session)
+
+    def test_finalize_detects_changed_file(self):
+        """Test that a stored file differing from the received chunks is refused"""
+        import os
+        from apps.storage.uploads import UploadError, abort_upload, complete_upload
+
+        session = self._received(os.urandom(3000), 1000)
+        with open(session.file.storage.path(session.file.name), 'r+b') as stored:
+            stored.seek(1500)
+            stored.write(b'tampered')
+
+        with pytest.raises(UploadError, match='at 1000'):
+            complete_upload(session)
+        abort_upload(session)
+
+
+class TestHashingUploadHandlers:
+    """Test hashing uploaded files while the request body is parsed"""
+
+    def _upload(self, data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+
+        request = RequestFactory().post('/upload/', {'file': SimpleUploadedFile('castle.schem', data)})
+        return request.FILES['file']
+
+    def test_files_are_hashed_on_arrival(self, settings):
+        """Test that in-memory and spooled uploads both carry the SHA-256 of their bytes"""
+        import hashlib
+        import os
+        from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = 64 * 1024
+        small, large = os.urandom(1000), os.urandom(300 * 1024)
+
+        file_obj = self._upload(small)
+        assert isinstance(file_obj, InMemoryUploadedFile)
+        assert file_obj.sha256 == hashlib.sha256(small).hexdigest()
+
+        file_obj = self._upload(large)
+        assert isinstance(file_obj, TemporaryUploadedFile)
+        assert file_obj.sha256 == hashlib.sha256(large).hexdigest()
+        file_obj.close()
+
+    def test_hash_falls_back_to_reading_the_file(self):
+        """Test that files from other handlers are hashed by reading them"""
+        import hashlib
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from apps.storage.uploadhandlers import uploaded_file_hash
+
+        file_obj = SimpleUploadedFile('castle.schem', b'schematic bytes')
+        assert uploaded_file_hash(file_obj) == hashlib.sha256(b'schematic bytes').hexdigest()
@@ -0,0 +1,60 @@
+"""
+Upload handlers that hash files while Django receives them
+
+The SHA-256 and byte count are updated chunk by chunk as the request body
+is parsed, so views get the content hash without another pass over the
+spooled file. The finished UploadedFile carries it as `sha256`.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin:
+    """Hash the chunks of each file this handler stores"""
+
+    def new_file(self, *args, **kwargs):
+        # Before super(), which raises StopFutureHandlers once a handler takes the file
+        self.sha256 = hashlib.sha256()
+        self.hashed_size = 0
+        super().new_file(*args, **kwargs)
+
+    def _hash_chunk(self, raw_data):
+        self.sha256.update(raw_data)
+        self.hashed_size += len(raw_data)
+
+    def file_complete(self, file_size):
+        file_obj = super().file_complete(file_size)
+        if file_obj is not None and self.hashed_size == file_size:
+            file_obj.sha256 = self.sha256.hexdigest()
+        return file_obj
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    """Keeps small files in memory, hashed"""
+
+    def receive_data_chunk(self, raw_data, start):
+        # Larger files are passed on to the next handler, which hashes them
+        if self.activated:
+            self._hash_chunk(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    """Spools files to a temporary file, hashed"""
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash_chunk(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def uploaded_file_hash(file_obj):
+    """SHA-256 hex digest of an uploaded file, hashed on arrival when possible"""
+    file_hash = getattr(file_obj, 'sha256', None)
+    if file_hash is None:
+        # Received through other upload handlers
+        sha256 = hashlib.sha256()
+        for chunk in file_obj.chunks():
+            sha256.update(chunk)
+        file_hash = sha256.hexdigest()
+    return file_hash
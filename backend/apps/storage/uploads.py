@@ -0,0 +1,371 @@
+"""
+Resumable chunked uploads
+
+A client creates an UploadSession for a file of known size, sends the file
+as consecutive byte ranges (each its own request, so a dropped connection
+only loses the current chunk) and finalizes the session once every byte
+has arrived. Chunks are appended to the file in quarantine as they come:
+in place on the filesystem, or as the parts of an S3 multipart upload.
+
+Each chunk's SHA-256 is recorded as it is received. Finalizing a
+filesystem session rehashes the file with hashlib in one local pass and
+checks every chunk against its recorded digest. S3 sessions are not read
+back: like direct sessions below, their hash is computed by the scan.
+
+With S3 storage, direct sessions skip the API for the bytes altogether: the
+client gets presigned UploadPart URLs for a multipart upload into
+quarantine/, each signed with the SHA-256 the client declared for that
+part, so S3 itself rejects corrupted parts. Finalizing checks the parts S3
+holds against the declared checksums and sizes. S3 keeps no SHA-256 of a
+whole multipart object, so the content hash is left empty and computed by
+the scan while the object streams to clamd.
+"""
+import base64
+import hashlib
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from storages.utils import clean_name
+
+from .backends import QuarantineStorage
+from .models import UploadSession
+from .promotion import QUARANTINE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+CONTENT_DIGEST = re.compile(r'(?:^|,)\s*sha-256=:([A-Za-z0-9+/=]+):')
+
+# S3 rejects multipart parts below 5 MiB, except the last one
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A chunk or finalize request that cannot be accepted"""
+
+
+class UploadOffsetMismatch(UploadError):
+    """A chunk that does not start where the received bytes end"""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected a chunk starting at byte {offset}')
+        self.offset = offset
+
+
+def parse_content_range(header):
+    """
+    Parse a chunk's "Content-Range: bytes <first>-<last>/<total>" header
+
+    Returns:
+        (start, length, total)
+    """
+    match = CONTENT_RANGE.match(header.strip()) if header else None
+    if not match:
+        raise UploadError('Chunks need a "Content-Range: bytes <first>-<last>/<total>" header')
+    first, last, total = (int(value) for value in match.groups())
+    if last < first:
+        raise UploadError('Invalid Content-Range')
+    return first, last - first + 1, total
+
+
+def parse_content_digest(header):
+    """SHA-256 digest from a "Content-Digest: sha-256=:<base64>:" header, or None"""
+    match = CONTENT_DIGEST.search(header) if header else None
+    if not match:
+        return None
+    try:
+        return base64.b64decode(match.group(1), validate=True)
+    except ValueError:
+        raise UploadError('Invalid Content-Digest')
+
+
+def _s3_target(storage, name):
+    return storage.connection.meta.client, storage.bucket_name, storage._normalize_name(clean_name(name))
+
+
+def start_upload(owner, file_name, file_size):
+    """
+    Open a session for a file of `file_size` bytes
+
+    The quarantine name is reserved right away: an empty file on the
+    filesystem, or a multipart upload on S3.
+    """
+    path = f'{timezone.now():%Y/%m/%d}/{os.path.basename(file_name)}'
+    upload_id = ''
+    if settings.USE_S3:
+        storage = QuarantineStorage()
+        name = storage.get_available_name(path)
+        client, bucket, key = _s3_target(storage, name)
+        upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType='application/octet-stream'
+        )['UploadId']
+        name = QUARANTINE_PREFIX + name
+    else:
+        name = default_storage.save(QUARANTINE_PREFIX + path, ContentFile(b''))
+
+    return UploadSession.objects.create(
+        owner=owner,
+        file_name=file_name,
+        file=name,
+        file_size=file_size,
+        s3_upload_id=upload_id,
+        expires_at=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    )
+
+
+def _part_count(file_size):
+    return math.ceil(file_size / settings.UPLOAD_DIRECT_PART_SIZE)
+
+
+def start_direct_upload(owner, file_name, file_size, part_checksums):
+    """
+    Open a session whose parts the client uploads straight to S3
+
+    `part_checksums` are the base64 SHA-256 digests of the file's parts of
+    UPLOAD_DIRECT_PART_SIZE bytes, in order.
+    """
+    if len(part_checksums) != _part_count(file_size):
+        raise UploadError(
+            f'Expected {_part_count(file_size)} part checksums '
+            f'for parts of {settings.UPLOAD_DIRECT_PART_SIZE} bytes'
+        )
+    for checksum in part_checksums:
+        try:
+            valid = len(base64.b64decode(checksum, validate=True)) == 32
+        except ValueError:
+            valid = False
+        if not valid:
+            raise UploadError('Part checksums must be base64 SHA-256 digests')
+
+    storage = QuarantineStorage()
+    name = storage.get_available_name(f'{timezone.now():%Y/%m/%d}/{os.path.basename(file_name)}')
+    client, bucket, key = _s3_target(storage, name)
+    upload_id = client.create_multipart_upload(
+        Bucket=bucket, Key=key, ContentType='application/octet-stream', ChecksumAlgorithm='SHA256'
+    )['UploadId']
+
+    return UploadSession.objects.create(
+        owner=owner,
+        file_name=file_name,
+        file=QUARANTINE_PREFIX + name,
+        file_size=file_size,
+        direct=True,
+        s3_upload_id=upload_id,
+        s3_parts=[
+            {'PartNumber': number, 'ChecksumSHA256': checksum}
+            for number, checksum in enumerate(part_checksums, start=1)
+        ],
+        expires_at=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    )
+
+
+def presigned_part_urls(session):
+    """Presigned UploadPart URLs of a direct session, each bound to its part's checksum"""
+    client, bucket, key = _s3_target(QuarantineStorage(), session.file.name[len(QUARANTINE_PREFIX):])
+    part_size = settings.UPLOAD_DIRECT_PART_SIZE
+    return [
+        {
+            'part_number': part['PartNumber'],
+            'size': min(part_size, session.file_size - (part['PartNumber'] - 1) * part_size),
+            'checksum_sha256': part['ChecksumSHA256'],
+            'url': client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': bucket,
+                    'Key': key,
+                    'UploadId': session.s3_upload_id,
+                    'PartNumber': part['PartNumber'],
+                    'ChecksumSHA256': part['ChecksumSHA256'],
+                },
+                ExpiresIn=settings.UPLOAD_DIRECT_URL_TTL
+            ),
+        }
+        for part in session.s3_parts
+    ]
+
+
+def _complete_direct_upload(session):
+    """Check the parts S3 received against the session, then complete the object"""
+    client, bucket, key = _s3_target(QuarantineStorage(), session.file.name[len(QUARANTINE_PREFIX):])
+    received, marker = {}, 0
+    while True:
+        page = client.list_parts(Bucket=bucket, Key=key, UploadId=session.s3_upload_id, PartNumberMarker=marker)
+        for part in page.get('Parts', []):
+            received[part['PartNumber']] = part
+        if not page.get('IsTruncated'):
+            break
+        marker = page['NextPartNumberMarker']
+
+    missing = [part['PartNumber'] for part in session.s3_parts if part['PartNumber'] not in received]
+    if missing:
+        raise UploadError(f'Parts not uploaded yet: {", ".join(str(number) for number in missing)}')
+    part_size = settings.UPLOAD_DIRECT_PART_SIZE
+    for part in session.s3_parts:
+        uploaded = received[part['PartNumber']]
+        size = min(part_size, session.file_size - (part['PartNumber'] - 1) * part_size)
+        if uploaded.get('ChecksumSHA256') != part['ChecksumSHA256'] or uploaded['Size'] != size:
+            raise UploadError(f'Part {part["PartNumber"]} does not match its declared checksum and size')
+
+    client.complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=session.s3_upload_id,
+        MultipartUpload={'Parts': [
+            {
+                'PartNumber': part['PartNumber'],
+                'ETag': received[part['PartNumber']]['ETag'],
+                'ChecksumSHA256': part['ChecksumSHA256'],
+            }
+            for part in session.s3_parts
+        ]}
+    )
+    head = client.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    if head['ContentLength'] != session.file_size:
+        raise UploadError(f'Stored object is {head["ContentLength"]} bytes, expected {session.file_size}')
+    logger.info(f"Completed direct upload {session.id}, S3 checksum {head.get('ChecksumSHA256')}")
+
+
+def _receive(stream, length, digest):
+    """Spool `length` bytes of a request body, checking the size and digest"""
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    chunk_hash = hashlib.sha256()
+    received = 0
+    while received <= length:
+        data = stream.read(min(READ_SIZE, length + 1 - received))
+        if not data:
+            break
+        received += len(data)
+        chunk_hash.update(data)
+        spool.write(data)
+    if received != length:
+        spool.close()
+        raise UploadError(f'Chunk has {received} bytes, Content-Range announced {length}')
+    if digest is not None and chunk_hash.digest() != digest:
+        spool.close()
+        raise UploadError('Chunk does not match its Content-Digest')
+    spool.seek(0)
+    return spool, chunk_hash.hexdigest()
+
+
+def _write(session, start, spool, length):
+    """Store a chunk after the bytes received so far"""
+    storage = session.file.storage
+    if session.s3_upload_id:
+        # One part per chunk; resending a chunk replaces its part
+        part_number = len(session.s3_parts) + 1
+        client, bucket, key = _s3_target(QuarantineStorage(), session.file.name[len(QUARANTINE_PREFIX):])
+        response = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=session.s3_upload_id,
+            PartNumber=part_number, Body=spool, ContentLength=length
+        )
+        session.s3_parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+    else:
+        with open(storage.path(session.file.name), 'r+b') as partial:
+            # Anything past the offset is left over from a chunk that failed midway
+            partial.seek(start)
+            shutil.copyfileobj(spool, partial, READ_SIZE)
+            partial.truncate()
+
+
+def append_chunk(session_id, owner, content_range, stream, content_digest=None):
+    """
+    Verify one chunk of a request body and append it to the session's file
+
+    The body is spooled and checked against Content-Range (and Content-Digest
+    when given) before the session is locked, so a slow client never holds
+    the lock.
+
+    Returns:
+        The updated UploadSession
+    """
+    start, length, total = parse_content_range(content_range)
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(f'Chunks must not exceed {settings.UPLOAD_CHUNK_MAX_SIZE} bytes')
+    spool, chunk_digest = _receive(stream, length, parse_content_digest(content_digest))
+
+    try:
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(id=session_id, owner=owner)
+            if session.direct:
+                raise UploadError('Parts of direct uploads are sent to their presigned URLs')
+            if total != session.file_size or start + length > session.file_size:
+                raise UploadError(f'The file is {session.file_size} bytes')
+            if start != session.offset:
+                raise UploadOffsetMismatch(session.offset)
+            if session.s3_upload_id and length < S3_MIN_PART_SIZE and start + length < session.file_size:
+                raise UploadError(f'Chunks before the last must be at least {S3_MIN_PART_SIZE} bytes')
+
+            _write(session, start, spool, length)
+
+            session.offset += length
+            session.chunk_digests.append({'offset': start, 'size': length, 'sha256': chunk_digest})
+            session.expires_at = timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+            session.save(update_fields=['offset', 'chunk_digests', 's3_parts', 'expires_at'])
+    finally:
+        spool.close()
+    return session
+
+
+def _rehash(session):
+    """SHA-256 of a session's local file, checking each chunk against the digest it arrived with"""
+    file_hash = hashlib.sha256()
+    with open(session.file.storage.path(session.file.name), 'rb') as stored:
+        for chunk in session.chunk_digests:
+            chunk_hash = hashlib.sha256()
+            left = chunk['size']
+            while left:
+                data = stored.read(min(READ_SIZE, left))
+                if not data:
+                    break
+                left -= len(data)
+                chunk_hash.update(data)
+                file_hash.update(data)
+            if chunk_hash.hexdigest() != chunk['sha256']:
+                raise UploadError(f'Stored chunk at {chunk["offset"]} does not match what was received')
+    return file_hash.hexdigest()
+
+
+def complete_upload(session):
+    """
+    Close a fully received session's file
+
+    Returns:
+        The SHA-256 hex digest of the file, or '' for S3 sessions, whose
+        hash is computed by the scan
+    """
+    if session.direct:
+        _complete_direct_upload(session)
+        return ''
+    if not session.is_complete:
+        raise UploadError(f'Received {session.offset} of {session.file_size} bytes')
+    if session.s3_upload_id:
+        client, bucket, key = _s3_target(QuarantineStorage(), session.file.name[len(QUARANTINE_PREFIX):])
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=session.s3_upload_id,
+            MultipartUpload={'Parts': session.s3_parts}
+        )
+        return ''
+    return _rehash(session)
+
+
+def abort_upload(session):
+    """Delete a session and whatever it received"""
+    if session.s3_upload_id:
+        client, bucket, key = _s3_target(QuarantineStorage(), session.file.name[len(QUARANTINE_PREFIX):])
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=session.s3_upload_id)
+        except Exception as e:
+            logger.error(f"Error aborting multipart upload of {session.id}: {str(e)}")
+    else:
+        session.file.storage.delete(session.file.name)
+    session.delete()
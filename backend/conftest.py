@@ -2,6 +2,9 @@
 Test configuration for pytest
 """
 import os
+import shutil
+import tempfile
+
 import django
 from django.conf import settings
 
@@ -32,6 +35,9 @@ def pytest_configure():
     settings.CELERY_TASK_EAGER_PROPAGATES = True
     settings.CLAMAV_ENABLED = False
     settings.USE_S3 = False
+
+    # Keep uploads, thumbnails and previews written by tests out of the tree
+    settings.MEDIA_ROOT = tempfile.mkdtemp(prefix='schematicshop-media-')
     
     # Disable caching for tests
     settings.CACHES = {
@@ -41,3 +47,7 @@ def pytest_configure():
     }
     
     django.setup()
+
+
+def pytest_unconfigure():
+    shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
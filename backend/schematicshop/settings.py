@@ -197,13 +197,116 @@ if USE_S3:
     # Use S3 for media files
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
+# Promotion out of quarantine copies larger objects server-side in parts
+S3_MULTIPART_COPY_THRESHOLD = env.int('S3_MULTIPART_COPY_THRESHOLD', default=64 * 1024 * 1024)  # bytes
+S3_MULTIPART_COPY_CHUNK_SIZE = env.int('S3_MULTIPART_COPY_CHUNK_SIZE', default=64 * 1024 * 1024)  # bytes
+
 # ClamAV Settings (Always required for security)
 CLAMAV_HOST = env('CLAMAV_HOST', default='localhost')
 CLAMAV_PORT = env.int('CLAMAV_PORT', default=3310)
+CLAMAV_TIMEOUT = env.float('CLAMAV_TIMEOUT', default=120)  # seconds per command
+# Persistent IDSESSION connections kept per worker process
+CLAMAV_POOL_SIZE = env.int('CLAMAV_POOL_SIZE', default=4)
+# Keep below clamd's IdleTimeout (30s by default) so pooled sessions are rarely dead
+CLAMAV_SESSION_IDLE_TIMEOUT = env.float('CLAMAV_SESSION_IDLE_TIMEOUT', default=20)
+# How long a worker trusts the clamd engine/signature version before asking again
+CLAMAV_VERSION_TTL = env.float('CLAMAV_VERSION_TTL', default=60)  # seconds
+# Verdicts remembered per file hash and signature version (Redis copy; the database keeps all)
+SCAN_VERDICT_CACHE_TIMEOUT = env.int('SCAN_VERDICT_CACHE_TIMEOUT', default=7 * 24 * 3600)  # seconds
+# Bytes fetched per ranged GET when streaming an S3 object to clamd
+SCAN_RANGE_SIZE = env.int('SCAN_RANGE_SIZE', default=8 * 1024 * 1024)
+# Uploads up to this size are scanned while they are hashed, inside the request;
+# larger ones (or 0 to disable) are scanned by scan_file_task
+INLINE_SCAN_MAX_SIZE = env.int('INLINE_SCAN_MAX_SIZE', default=8 * 1024 * 1024)  # bytes
+# Longest an upload request waits for the inline verdict before deferring to the task
+INLINE_SCAN_TIMEOUT = env.float('INLINE_SCAN_TIMEOUT', default=10)  # seconds
+# Pending schematics claimed per scan_batch_task run, and scanned at once
+SCAN_BATCH_SIZE = env.int('SCAN_BATCH_SIZE', default=50)
+SCAN_BATCH_CONCURRENCY = env.int('SCAN_BATCH_CONCURRENCY', default=CLAMAV_POOL_SIZE)
+# scan_batch_async_task: schematics per batch and INSTREAM scans in flight on its event loop
+SCAN_ASYNC_BATCH_SIZE = env.int('SCAN_ASYNC_BATCH_SIZE', default=500)
+CLAMAV_ASYNC_CONCURRENCY = env.int('CLAMAV_ASYNC_CONCURRENCY', default=200)
+# Rescans of clean schematics after signature updates, most downloaded first:
+# RESCAN_SWEEP_BATCH schematics every RESCAN_SWEEP_INTERVAL, paused while more
+# than RESCAN_MAX_PENDING uploads wait for their first scan
+RESCAN_SWEEP_INTERVAL = env.int('RESCAN_SWEEP_INTERVAL', default=60)  # seconds
+RESCAN_SWEEP_BATCH = env.int('RESCAN_SWEEP_BATCH', default=100)
+RESCAN_MAX_PENDING = env.int('RESCAN_MAX_PENDING', default=20)
+
+# Scan queues, each consumed by its own workers (see apps/scanning/routing.py)
+SCAN_FAST_QUEUE = env('SCAN_FAST_QUEUE', default='scan-fast')
+SCAN_BULK_QUEUE = env('SCAN_BULK_QUEUE', default='scan-bulk')
+SCAN_FAST_MAX_SIZE = env.int('SCAN_FAST_MAX_SIZE', default=2 * 1024 * 1024)  # bytes
+SCAN_TRUSTED_MIN_CLEAN_UPLOADS = env.int('SCAN_TRUSTED_MIN_CLEAN_UPLOADS', default=1)
+# clamd circuit breaker (apps/scanning/breaker.py): CLAMD_BREAKER_THRESHOLD failed
+# scans within CLAMD_BREAKER_WINDOW park all scans; clamd is probed every
+# CLAMD_BREAKER_PROBE_INTERVAL and, once back, CLAMD_BREAKER_RELEASE_BATCH parked
+# schematics are released per probe
+CLAMD_BREAKER_THRESHOLD = env.int('CLAMD_BREAKER_THRESHOLD', default=5)
+CLAMD_BREAKER_WINDOW = env.int('CLAMD_BREAKER_WINDOW', default=60)  # seconds
+CLAMD_BREAKER_PROBE_INTERVAL = env.int('CLAMD_BREAKER_PROBE_INTERVAL', default=30)  # seconds
+CLAMD_BREAKER_RELEASE_BATCH = env.int('CLAMD_BREAKER_RELEASE_BATCH', default=50)
+
+CELERY_TASK_ROUTES = {
+    'apps.scanning.tasks.scan_batch_task': {'queue': SCAN_BULK_QUEUE},
+    'apps.scanning.tasks.scan_batch_async_task': {'queue': SCAN_BULK_QUEUE},
+    'apps.scanning.tasks.rescan_sweep_task': {'queue': SCAN_BULK_QUEUE},
+    'apps.scanning.tasks.clamd_probe_task': {'queue': SCAN_FAST_QUEUE},
+}
+CELERY_BEAT_SCHEDULE = {
+    'rescan-sweep': {
+        'task': 'apps.scanning.tasks.rescan_sweep_task',
+        'schedule': RESCAN_SWEEP_INTERVAL,
+    },
+    'clamd-probe': {
+        'task': 'apps.scanning.tasks.clamd_probe_task',
+        'schedule': CLAMD_BREAKER_PROBE_INTERVAL,
+    },
+    'expire-upload-sessions': {
+        'task': 'apps.storage.tasks.expire_upload_sessions_task',
+        'schedule': 3600,
+    },
+}
 
 # File Upload Settings
 MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 100MB
 ALLOWED_SCHEMATIC_EXTENSIONS = ['.schematic', '.schem', '.litematic', '.nbt']
+# Bulk uploads (apps/schematics/bulk.py): most files per zip archive, and most bytes
+# they may hold once extracted
+BULK_UPLOAD_MAX_FILES = env.int('BULK_UPLOAD_MAX_FILES', default=500)
+BULK_UPLOAD_MAX_SIZE = env.int('BULK_UPLOAD_MAX_SIZE', default=1024 * 1024 * 1024)  # bytes
+# Django's default handlers, hashing files as they arrive (apps/storage/uploadhandlers.py)
+FILE_UPLOAD_HANDLERS = [
+    'apps.storage.uploadhandlers.HashingMemoryFileUploadHandler',
+    'apps.storage.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# Resumable uploads (apps/storage/uploads.py): largest chunk per request, and how long
+# a session may go without receiving a chunk before expire_upload_sessions_task drops it
+UPLOAD_CHUNK_MAX_SIZE = env.int('UPLOAD_CHUNK_MAX_SIZE', default=16 * 1024 * 1024)  # bytes
+UPLOAD_SESSION_TTL = env.int('UPLOAD_SESSION_TTL', default=24 * 3600)  # seconds
+# Direct-to-S3 uploads (USE_S3 only): part size (S3 requires at least 5 MB) and
+# lifetime of the presigned part URLs
+UPLOAD_DIRECT_PART_SIZE = env.int('UPLOAD_DIRECT_PART_SIZE', default=16 * 1024 * 1024)  # bytes
+UPLOAD_DIRECT_URL_TTL = env.int('UPLOAD_DIRECT_URL_TTL', default=3600)  # seconds
+
+# Limits for reading uploaded NBT; files exceeding them are marked rejected
+SCHEMATIC_MAX_EXPANSION_RATIO = env.float('SCHEMATIC_MAX_EXPANSION_RATIO', default=200)  # inflated / compressed size
+SCHEMATIC_MAX_INFLATED_SIZE = env.int('SCHEMATIC_MAX_INFLATED_SIZE', default=512 * 1024 * 1024)  # bytes
+SCHEMATIC_MAX_NBT_DEPTH = env.int('SCHEMATIC_MAX_NBT_DEPTH', default=64)
+SCHEMATIC_MAX_ARRAY_LENGTH = env.int('SCHEMATIC_MAX_ARRAY_LENGTH', default=128 * 1024 * 1024)  # elements / blocks
+
+# Processes decoding the regions of large multi-region Litematica files (1 disables)
+SCHEMATIC_DECODE_WORKERS = env.int('SCHEMATIC_DECODE_WORKERS', default=min(os.cpu_count() or 1, 4))
+
+# Thumbnail Rendering
+SCHEMATIC_THUMBNAIL_SIZE = env.int('SCHEMATIC_THUMBNAIL_SIZE', default=512)  # pixels
+SCHEMATIC_THUMBNAIL_MAX_CELLS = env.int('SCHEMATIC_THUMBNAIL_MAX_CELLS', default=64)  # LOD voxels per axis
+
+# 3D preview levels of detail, as max cells per axis
+SCHEMATIC_PREVIEW_LODS = env.list('SCHEMATIC_PREVIEW_LODS', cast=int, default=[32, 64, 128, 256])
+
+# Near-duplicate detection: minimum estimated block content similarity (0-1)
+NEAR_DUPLICATE_THRESHOLD = env.float('NEAR_DUPLICATE_THRESHOLD', default=0.8)
 
 # API Documentation
 SPECTACULAR_SETTINGS = {
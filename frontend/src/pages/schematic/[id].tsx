@@ -124,6 +124,11 @@ export default function SchematicDetail() {
                     ⏳ Scanning...
                   </div>
                 )}
+                {schematic.scan_status === 'rejected' && (
+                  <div className="absolute top-4 right-4 bg-red-500 text-white px-4 py-2 rounded-full">
+                    ✕ Rejected
+                  </div>
+                )}
               </div>
             </motion.div>
 
@@ -292,6 +297,31 @@ export default function SchematicDetail() {
                 </div>
               </div>
 
+              {/* Warning for likely re-uploads (only sent to the owner) */}
+              {schematic.possible_duplicates?.length > 0 && (
+                <div className="mt-6 p-4 bg-yellow-50 border border-yellow-200 rounded-lg">
+                  <div className="flex items-start gap-2 text-yellow-800">
+                    <AlertTriangle size={18} className="mt-0.5 flex-shrink-0" />
+                    <div className="text-sm">
+                      <p className="font-medium mb-1">Possible Duplicate</p>
+                      <p className="text-yellow-700 mb-2">
+                        This schematic looks very similar to existing uploads:
+                      </p>
+                      <ul className="list-disc list-inside text-yellow-700">
+                        {schematic.possible_duplicates.map((duplicate: any) => (
+                          <li key={duplicate.id}>
+                            <Link href={`/schematic/${duplicate.id}`} className="underline">
+                              {duplicate.title}
+                            </Link>{' '}
+                            by {duplicate.owner} ({Math.round(duplicate.similarity * 100)}% similar)
+                          </li>
+                        ))}
+                      </ul>
+                    </div>
+                  </div>
+                </div>
+              )}
+
               {/* Warning for pending scan */}
               {schematic.scan_status === 'pending' && (
                 <div className="mt-6 p-4 bg-yellow-50 border border-yellow-200 rounded-lg">